@@ -7,16 +7,44 @@ virtual environment's ``Scripts/`` or ``bin/`` directory has not been exported).
 """
 from __future__ import annotations
 
+from typing import Any, Dict
+
 from livekit.agents import WorkerOptions
 from livekit.agents.cli import run_app
 
+from backend.app.config import get_settings
+from backend.app.services.metrics import start_metrics_server
 from backend.app.services.voice_agent import run_agent
+from backend.app.services.worker_load import compute_load
 
 
-def main() -> None:
-    """Delegate to ``livekit.agents``' CLI using the project entry point."""
+def _job_executor() -> Dict[str, Any]:
+    # Jobs share the worker process so its load counters see every room.  Each
+    # job thread runs its own event loop; the pooled clients are per loop.
+    try:
+        from livekit.agents import JobExecutorType
+    except ImportError:  # pragma: no cover - older livekit-agents releases
+        return {}
+    return {"job_executor_type": JobExecutorType.THREAD}
 
-    options = WorkerOptions(entrypoint_fnc=run_agent)
+
+def main() -> None:
+    """Delegate to ``livekit.agents``' CLI using the project entry point.
+
+    The worker reports :func:`compute_load` to the dispatcher and stops taking
+    rooms once it reaches ``AGENT_LOAD_THRESHOLD``.  With
+    ``AGENT_METRICS_PORT`` set, the metrics registry is served on that port.
+    """
+
+    settings = get_settings()
+    if settings.agent_metrics_port:
+        start_metrics_server(settings.agent_metrics_port)
+    options = WorkerOptions(
+        entrypoint_fnc=run_agent,
+        load_fnc=compute_load,
+        load_threshold=settings.agent_load_threshold,
+        **_job_executor(),
+    )
     run_app(options)
 
 
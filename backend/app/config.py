@@ -10,7 +10,7 @@ from __future__ import annotations
 from functools import lru_cache
 from typing import Any
 
-from pydantic import Field, model_validator
+from pydantic import AliasChoices, Field, model_validator
 from pydantic_settings import BaseSettings, SettingsConfigDict
 
 
@@ -38,6 +38,18 @@ class Settings(BaseSettings):
         "https://dashscope.aliyuncs.com/api/v1/",
         description="Base URL for the Bailian speech APIs",
     )
+    ali_ws_url: str = Field(
+        "wss://dashscope.aliyuncs.com/api-ws/v1/inference",
+        description="WebSocket endpoint used for real-time (streaming) recognition",
+    )
+    ali_asr_model: str = Field(
+        "paraformer-realtime-v2",
+        description="Bailian model used by the streaming speech recognizer",
+    )
+    ali_ws_handshake_timeout: float = Field(
+        10.0,
+        description="Seconds to wait for the recognition WebSocket to report task-started",
+    )
 
     # Dify LLM configuration
     dify_api_base: str = Field(
@@ -55,6 +67,22 @@ class Settings(BaseSettings):
             "X-Dify-App header so that the correct workflow is triggered."
         ),
     )
+    dify_max_concurrency: int = Field(
+        16,
+        description=(
+            "Maximum number of in-flight Dify requests per worker process; "
+            "additional requests wait in a queue"
+        ),
+    )
+
+    session_ttl_seconds: float = Field(
+        1800,
+        description="Idle time after which a chat session forgets its Dify conversation",
+    )
+    session_max_entries: int = Field(
+        10000,
+        description="Maximum number of chat sessions tracked per worker (LRU evicted)",
+    )
 
     # LiveKit configuration for WebRTC rooms
     livekit_api_key: str = Field("", description="LiveKit API key")
@@ -74,6 +102,191 @@ class Settings(BaseSettings):
                 data.setdefault("LIVEKIT_HOST", host)
         return data
 
+    # Speech-to-text uploads
+    stt_spool_max_bytes: int = Field(
+        1024 * 1024,
+        description="Binary uploads larger than this are spooled to a temporary file",
+    )
+    stt_max_upload_bytes: int = Field(
+        50 * 1024 * 1024,
+        description="Largest accepted binary audio upload for /speech-to-text",
+    )
+
+    # Text-to-speech caching
+    tts_cache_max_bytes: int = Field(
+        32 * 1024 * 1024,
+        description="Memory budget of the in-process TTS LRU cache (0 disables it)",
+    )
+    tts_disk_cache_dir: str | None = Field(
+        None,
+        description="Directory of the persistent TTS cache shared by all workers",
+    )
+    tts_disk_cache_max_bytes: int = Field(
+        512 * 1024 * 1024,
+        description="Total size budget of the on-disk TTS cache",
+    )
+    tts_disk_cache_max_age: float = Field(
+        7 * 24 * 3600,
+        description="Seconds after their last use that cached clips expire",
+    )
+    tts_http_max_age: int = Field(
+        86400,
+        description="Cache-Control max-age advertised for synthesized audio",
+    )
+
+    # Voice activity detection in the agent
+    vad_model: str = Field(
+        "energy",
+        description="Speech classifier used by the agent VAD: 'energy' or 'webrtc'",
+    )
+    vad_aggressiveness: int = Field(
+        2, description="Aggressiveness (0-3) of the optional WebRTC VAD model"
+    )
+    vad_pre_roll_ms: int = Field(
+        200, description="Audio kept before detected speech onset"
+    )
+    vad_hangover_ms: int = Field(
+        500, description="Silence required before an utterance is considered finished"
+    )
+    vad_min_speech_ms: int = Field(
+        200, description="Shorter speech bursts are discarded as noise"
+    )
+    vad_max_utterance_ms: int = Field(
+        15000, description="Utterances are force-split after this duration"
+    )
+    agent_audio_buffer_ms: int = Field(
+        30000,
+        description="Audio retained per participant track in the preallocated ring buffer",
+    )
+
+    # Off-loop audio processing in the agent
+    agent_dsp_executor: str = Field(
+        "auto",
+        description=(
+            "Where the agent resamples and classifies audio: 'inline' (event "
+            "loop), 'thread', 'process' (shared-memory worker pool) or 'auto' "
+            "(thread with more than one CPU, otherwise inline)"
+        ),
+    )
+    agent_dsp_workers: int = Field(
+        2, description="Worker threads/processes of the agent's audio executor"
+    )
+
+    # Adaptive end-of-turn detection
+    endpoint_min_ms: int = Field(
+        250, description="Shortest trailing silence that may end a user turn"
+    )
+    endpoint_max_ms: int = Field(
+        1200, description="Trailing silence that always ends a user turn"
+    )
+    agent_streaming_stt: bool = Field(
+        False,
+        description=(
+            "Stream speech to Bailian while the user talks so partial "
+            "transcripts inform endpointing"
+        ),
+    )
+
+    # Speculative replies on stable partial transcripts (needs agent_streaming_stt)
+    agent_speculative_llm: bool = Field(
+        False,
+        description=(
+            "Start the Dify request before the turn ends once the partial "
+            "transcript is stable"
+        ),
+    )
+    agent_speculation_stable_ms: int = Field(
+        300, description="How long a partial transcript must stay unchanged before speculating"
+    )
+    agent_speculative_tts: bool = Field(
+        True,
+        description="Also synthesize the first sentence of a speculative reply into the TTS cache",
+    )
+
+    # Voice agent speech pipeline
+    tts_segment_max_chars: int = Field(
+        80,
+        description="Longest text segment sent to TTS before forcing a cut",
+    )
+    tts_prefetch_segments: int = Field(
+        1,
+        description="Number of synthesized segments buffered ahead of playback",
+    )
+    agent_room_max_concurrent_turns: int = Field(
+        2,
+        description=(
+            "Reply turns per room allowed to call STT/Dify/TTS at the same "
+            "time; further speakers' turns wait their turn"
+        ),
+    )
+    agent_tts_mode: str = Field(
+        "pcm",
+        description=(
+            "'pcm' streams raw PCM at the output rate as paced frames; 'clip' "
+            "publishes each synthesized clip as one frame"
+        ),
+    )
+    agent_output_sample_rate: int = Field(
+        48000, description="Sample rate of the audio track the agent publishes"
+    )
+    agent_output_frame_ms: int = Field(
+        20, description="Duration of each published audio frame (10 or 20 ms)"
+    )
+
+    # Outbound HTTP connection pooling shared by upstream clients
+    http_max_connections: int = Field(
+        100,
+        description="Maximum number of concurrent connections per pooled HTTP client",
+    )
+    http_max_keepalive_connections: int = Field(
+        20,
+        description="Maximum number of idle keep-alive connections kept in the pool",
+    )
+    http_keepalive_expiry: float = Field(
+        30.0,
+        description="Seconds an idle keep-alive connection is retained before closing",
+    )
+    http2_enabled: bool = Field(
+        False,
+        description=(
+            "Negotiate HTTP/2 with upstream services. Requires the optional 'h2' "
+            "package; falls back to HTTP/1.1 when it is missing."
+        ),
+    )
+
+    # Worker load reported to the LiveKit dispatcher
+    agent_max_sessions: int = Field(
+        25, description="Agent sessions (rooms) a worker process counts as fully loaded"
+    )
+    agent_max_in_flight: int = Field(
+        50, description="In-flight reply turns (or Dify requests, if more) at full load"
+    )
+    agent_loop_lag_budget_ms: float = Field(
+        50.0, description="p99 event-loop lag at which a worker counts as fully loaded"
+    )
+    agent_load_threshold: float = Field(
+        0.75,
+        description="Load (0-1) at which the worker stops accepting new rooms",
+    )
+    agent_metrics_port: int = Field(
+        0,
+        description="Port on which agent workers serve Prometheus /metrics (0 disables it)",
+    )
+
+    # Distributed tracing (W3C traceparent, OTLP/JSON export)
+    trace_export_path: str = Field(
+        "",
+        description="File that finished spans are appended to as OTLP/JSON lines (empty disables export)",
+    )
+    trace_service_name: str = Field(
+        "livekit-dify-assistant",
+        description="service.name resource attribute of exported spans",
+    )
+    trace_export_batch_size: int = Field(
+        64,
+        description="Spans buffered before they are written to the export file",
+    )
+
     # Miscellaneous
     allow_origins: str = Field(
         "*",
@@ -1,14 +1,30 @@
 """FastAPI application exposing REST endpoints used by the web client."""
 from __future__ import annotations
 
+import asyncio
 import base64
+import json
 import logging
-from typing import Annotated
-
-from fastapi import Depends, FastAPI, HTTPException
+import tempfile
+from contextlib import asynccontextmanager
+from typing import Annotated, AsyncIterator, BinaryIO, Callable, Dict, Optional, Tuple
+
+import httpx
+from fastapi import (
+    Depends,
+    FastAPI,
+    HTTPException,
+    Query,
+    Request,
+    WebSocket,
+    WebSocketDisconnect,
+)
+from fastapi.concurrency import run_in_threadpool
+from fastapi.exceptions import RequestValidationError
 from fastapi.middleware.cors import CORSMiddleware
-from fastapi.responses import JSONResponse
+from fastapi.responses import JSONResponse, PlainTextResponse, Response, StreamingResponse
 from fastapi.staticfiles import StaticFiles
+from pydantic import ValidationError
 
 from .config import Settings, get_settings
 from .schemas import (
@@ -21,27 +37,51 @@ from .schemas import (
     TokenRequest,
     TokenResponse,
 )
-from .services.ali_bailian import BailianError, synthesize_speech, transcribe_audio
-from .services.dify import generate_reply
+from .services import ali_bailian, dify
+from .services.ali_bailian import (
+    BailianError,
+    StreamingRecognizer,
+    stream_speech,
+    synthesize_speech,
+    transcribe_audio,
+)
+from .services.audio_dsp import TARGET_RATE, PolyphaseResampler, needs_conversion
+from .services.dify import DEFAULT_USER, DifyError, generate_reply, stream_reply
+from .services.metrics import CONTENT_TYPE as METRICS_CONTENT_TYPE
+from .services.metrics import get_registry, upstream_call
+from .services.server_timing import ServerTimingMiddleware, current_timing, timed
+from .services.tracing import TracingMiddleware, get_span_exporter
+from .services.sessions import SessionKey, SessionStore, get_session_store
+from .services.sse import format_sse
+from .services.tts_cache import TTSCache, audio_etag, cache_key, get_tts_cache
 
 logger = logging.getLogger(__name__)
 logging.basicConfig(level=logging.INFO)
 
-app = FastAPI(title="LiveKit Voice Assistant for Dify", version="1.0.0")
 
+@asynccontextmanager
+async def lifespan(_: FastAPI) -> AsyncIterator[None]:
+    """Open the shared upstream connection pools for the app's lifetime."""
 
-@app.on_event("startup")
-def _startup_banner() -> None:
     settings = get_settings()
+    await ali_bailian.open_client(settings)
+    await dify.open_client(settings)
     logger.info("FastAPI application started with Dify base %s", settings.dify_api_base)
+    try:
+        yield
+    finally:
+        await dify.close_client(settings)
+        await ali_bailian.close_client()
+        await asyncio.to_thread(get_span_exporter().flush)
+        logger.info("FastAPI application shutting down")
 
 
-@app.on_event("shutdown")
-def _shutdown_banner() -> None:
-    logger.info("FastAPI application shutting down")
+app = FastAPI(title="LiveKit Voice Assistant for Dify", version="1.0.0", lifespan=lifespan)
 
 
 SettingsDep = Annotated[Settings, Depends(get_settings)]
+TTSCacheDep = Annotated[Optional[TTSCache], Depends(get_tts_cache)]
+SessionStoreDep = Annotated[SessionStore, Depends(get_session_store)]
 
 
 _origins = [
@@ -50,54 +90,406 @@ _origins = [
     if origin.strip()
 ]
 
+# Resource Timing only shows ``serverTiming`` to origins named in
+# ``Timing-Allow-Origin``, so allow the same origins as CORS.
+app.add_middleware(ServerTimingMiddleware, timing_allow_origins=_origins or ["*"])
+app.add_middleware(TracingMiddleware)
 app.add_middleware(
     CORSMiddleware,
     allow_origins=_origins or ["*"],
     allow_credentials=True,
     allow_methods=["*"],
     allow_headers=["*"],
+    # Lets cross-origin scripts read the header itself through fetch().
+    expose_headers=["Server-Timing"],
 )
 
 
 @app.get("/health", summary="Health check")
-async def health(settings: SettingsDep) -> JSONResponse:
+async def health(settings: SettingsDep, tts_cache: TTSCacheDep) -> JSONResponse:
     """Simple health check used by the readiness probe."""
 
     return JSONResponse({
         "status": "ok",
         "dify": str(settings.dify_api_base),
         "livekit": str(settings.livekit_host),
+        "tts_cache": tts_cache.stats() if tts_cache is not None else None,
     })
 
 
+@app.get("/metrics", summary="Prometheus metrics", include_in_schema=False)
+async def metrics() -> PlainTextResponse:
+    """Upstream call counters, latency histograms and cache gauges."""
+
+    return PlainTextResponse(get_registry().render(), media_type=METRICS_CONTENT_TYPE)
+
+
+def _session_key(request: ChatRequest) -> Optional[SessionKey]:
+    if not request.session_id:
+        return None
+    return (request.user or DEFAULT_USER, request.session_id)
+
+
+def _conversation_id(
+    request: ChatRequest, sessions: SessionStore, key: Optional[SessionKey]
+) -> Optional[str]:
+    # The id echoed by the client survives restarts, session eviction and
+    # requests landing on another worker; the store covers clients that
+    # only send a session id.
+    if request.conversation_id:
+        return request.conversation_id
+    return sessions.get(key) if key else None
+
+
+def _is_stale_conversation(exc: Exception) -> bool:
+    # Dify answers 404 when a conversation it no longer knows is referenced.
+    return isinstance(exc, httpx.HTTPStatusError) and exc.response.status_code == 404
+
+
 @app.post("/chat", response_model=ChatResponse, summary="Send conversation to Dify")
-async def chat(request: ChatRequest, settings: SettingsDep) -> ChatResponse:
-    result = await generate_reply(settings=settings, messages=request.messages)
+async def chat(request: ChatRequest, settings: SettingsDep, sessions: SessionStoreDep) -> ChatResponse:
+    key = _session_key(request)
+    conversation_id = _conversation_id(request, sessions, key)
+    try:
+        result = await generate_reply(
+            settings=settings,
+            messages=request.messages,
+            conversation_id=conversation_id,
+            user=request.user,
+        )
+    except httpx.HTTPStatusError as exc:
+        if not (conversation_id and _is_stale_conversation(exc)):
+            raise
+        if key:
+            sessions.discard(key)
+        result = await generate_reply(settings=settings, messages=request.messages, user=request.user)
+    if key and result.get("conversation_id"):
+        sessions.set(key, result["conversation_id"])
     return ChatResponse(**result)
 
 
-@app.post("/speech-to-text", response_model=STTResponse, summary="Convert audio to text")
-async def speech_to_text(request: STTRequest, settings: SettingsDep) -> STTResponse:
+@app.post("/chat/stream", summary="Stream the Dify reply as Server-Sent Events")
+async def chat_stream(
+    request: ChatRequest, settings: SettingsDep, sessions: SessionStoreDep
+) -> StreamingResponse:
+    """Relay Dify's streamed answer to the browser.
+
+    Emits ``delta`` events with text chunks followed by a single ``done`` event
+    carrying the full reply, conversation id and time-to-first-token, or an
+    ``error`` event if the upstream stream fails.  The ``Server-Timing`` header
+    leaves before Dify answers, so ``done`` also carries the request's stage
+    durations as ``server_timing``.
+    """
+
+    key = _session_key(request)
+
+    async def _relay(conversation_id: Optional[str]) -> AsyncIterator[str]:
+        async for event in stream_reply(
+            settings=settings,
+            messages=request.messages,
+            conversation_id=conversation_id,
+            user=request.user,
+        ):
+            kind = event.pop("event")
+            if kind == "started":
+                continue  # the task id only matters to the voice agent's barge-in
+            if kind == "done":
+                if key and event.get("conversation_id"):
+                    sessions.set(key, event["conversation_id"])
+                timing = current_timing()
+                if timing is not None:
+                    event["server_timing"] = timing.snapshot()
+            yield format_sse(event, event=kind)
+
+    async def _events() -> AsyncIterator[str]:
+        conversation_id = _conversation_id(request, sessions, key)
+        try:
+            try:
+                async for frame in _relay(conversation_id):
+                    yield frame
+            except httpx.HTTPStatusError as exc:
+                # The request is rejected before any event is streamed, so a
+                # retry without the stale conversation is safe.
+                if not (conversation_id and _is_stale_conversation(exc)):
+                    raise
+                if key:
+                    sessions.discard(key)
+                async for frame in _relay(None):
+                    yield frame
+        except (DifyError, httpx.HTTPError) as exc:
+            logger.warning("Dify stream failed: %s", exc)
+            yield format_sse({"detail": str(exc)}, event="error")
+
+    return StreamingResponse(
+        _events(),
+        media_type="text/event-stream",
+        headers={"Cache-Control": "no-cache", "X-Accel-Buffering": "no"},
+    )
+
+
+async def _spool_body(request: Request, settings: Settings) -> BinaryIO:
+    """Copy the raw request body into a spooled temporary file.
+
+    Small clips stay in memory; anything above ``stt_spool_max_bytes`` rolls
+    over to disk so large uploads never sit in RAM as a whole.
+    """
+
+    spool = tempfile.SpooledTemporaryFile(max_size=settings.stt_spool_max_bytes)
+    size = 0
+    try:
+        async for chunk in request.stream():
+            size += len(chunk)
+            if size > settings.stt_max_upload_bytes:
+                raise HTTPException(status_code=413, detail="Audio upload too large")
+            spool.write(chunk)
+    except BaseException:
+        spool.close()
+        raise
+    spool.seek(0)
+    return spool
+
+
+async def _multipart_audio(request: Request, settings: Settings) -> "tuple[BinaryIO, dict]":
+    try:
+        form = await request.form()
+    except AssertionError as exc:  # pragma: no cover - python-multipart missing
+        raise HTTPException(
+            status_code=415,
+            detail="Install 'python-multipart' to upload audio as multipart/form-data.",
+        ) from exc
+    upload = form.get("file") or form.get("audio")
+    if upload is None or isinstance(upload, str):
+        raise HTTPException(status_code=422, detail="Multipart upload needs a 'file' field")
+    if upload.size is not None and upload.size > settings.stt_max_upload_bytes:
+        raise HTTPException(status_code=413, detail="Audio upload too large")
+    fields = {key: value for key, value in form.items() if isinstance(value, str)}
+    return upload.file, fields
+
+
+def _convert_upload(
+    settings: Settings,
+    audio_base64: Optional[str],
+    audio_file: Optional[BinaryIO],
+    sample_rate: int,
+    channels: int,
+) -> "tuple[Optional[str], Optional[BinaryIO]]":
+    """Downmix/resample raw PCM to 16 kHz mono; runs in a worker thread."""
+
+    resampler = PolyphaseResampler(sample_rate, channels=channels)
+    if audio_file is None:
+        try:
+            pcm = base64.b64decode(audio_base64 or "", validate=True)
+        except ValueError as exc:
+            raise HTTPException(status_code=422, detail="audio_base64 is not valid base64") from exc
+        pcm = pcm[: len(pcm) - len(pcm) % (2 * max(channels, 1))]
+        return base64.b64encode(resampler.process(pcm)).decode(), None
+
+    converted = tempfile.SpooledTemporaryFile(max_size=settings.stt_spool_max_bytes)
+    try:
+        resampler.convert_file(audio_file, converted)
+    except BaseException:
+        converted.close()
+        raise
+    finally:
+        audio_file.close()
+    converted.seek(0)
+    return None, converted
+
+
+_STT_OPENAPI = {
+    "requestBody": {
+        "required": True,
+        "content": {
+            "application/json": {"schema": STTRequest.model_json_schema()},
+            "application/octet-stream": {"schema": {"type": "string", "format": "binary"}},
+            "multipart/form-data": {
+                "schema": {
+                    "type": "object",
+                    "properties": {
+                        "file": {"type": "string", "format": "binary"},
+                        "format": {"type": "string"},
+                        "sample_rate": {"type": "integer"},
+                        "channels": {"type": "integer"},
+                    },
+                    "required": ["file"],
+                }
+            },
+        },
+    }
+}
+
+
+@app.post(
+    "/speech-to-text",
+    response_model=STTResponse,
+    summary="Convert audio to text",
+    openapi_extra=_STT_OPENAPI,
+)
+async def speech_to_text(
+    http_request: Request,
+    settings: SettingsDep,
+    format: Optional[str] = Query(None, description="Audio format for binary uploads"),
+    sample_rate: Optional[int] = Query(None, description="Sample rate for binary uploads"),
+    channels: Optional[int] = Query(None, description="Interleaved channels for binary uploads"),
+) -> STTResponse:
+    """Transcribe a JSON/base64 payload or a raw binary/multipart audio upload.
+
+    Binary bodies take their format, sample rate and channel count from the
+    query string or the ``X-Audio-Format`` / ``X-Sample-Rate`` /
+    ``X-Audio-Channels`` headers.  Raw PCM above 16 kHz or with several
+    channels is converted to 16 kHz mono before it is uploaded.
+    """
+
+    content_type = http_request.headers.get("content-type", "application/json")
+    audio_file: Optional[BinaryIO] = None
+    audio_base64: Optional[str] = None
+    fields: dict = {}
+
+    if content_type.startswith("application/json"):
+        try:
+            with timed("parse"):
+                request = STTRequest.model_validate_json(await http_request.body())
+        except ValidationError as exc:
+            raise RequestValidationError(exc.errors()) from exc
+        audio_base64 = request.audio_base64
+        fields = {
+            "format": request.format,
+            "sample_rate": request.sample_rate,
+            "channels": request.channels,
+        }
+    elif content_type.startswith("multipart/form-data"):
+        with timed("upload"):
+            audio_file, fields = await _multipart_audio(http_request, settings)
+    else:
+        with timed("upload"):
+            audio_file = await _spool_body(http_request, settings)
+
+    headers = http_request.headers
+    audio_format = fields.get("format") or format or headers.get("x-audio-format") or "pcm"
+    try:
+        rate = int(fields.get("sample_rate") or sample_rate or headers.get("x-sample-rate") or 16000)
+        num_channels = int(fields.get("channels") or channels or headers.get("x-audio-channels") or 1)
+    except ValueError as exc:
+        if audio_file is not None:
+            audio_file.close()
+        raise HTTPException(
+            status_code=422, detail="sample_rate and channels must be integers"
+        ) from exc
+
+    if needs_conversion(rate, num_channels, audio_format):
+        with timed("resample"):
+            audio_base64, audio_file = await run_in_threadpool(
+                _convert_upload, settings, audio_base64, audio_file, rate, num_channels
+            )
+        rate = TARGET_RATE
+
     try:
         text = await transcribe_audio(
             settings=settings,
-            audio_base64=request.audio_base64,
-            audio_format=request.format,
-            sample_rate=request.sample_rate,
+            audio_base64=audio_base64,
+            audio_file=audio_file,
+            audio_format=audio_format,
+            sample_rate=rate,
         )
     except BailianError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
+    finally:
+        if audio_file is not None:
+            audio_file.close()
     return STTResponse(text=text)
 
 
+def get_recognizer_factory() -> Callable[..., StreamingRecognizer]:
+    """Dependency returning the streaming recognizer class (overridable in tests)."""
+
+    return StreamingRecognizer
+
+
+RecognizerFactoryDep = Annotated[Callable[..., StreamingRecognizer], Depends(get_recognizer_factory)]
+
+
+async def _forward_audio(websocket: WebSocket, recognizer: StreamingRecognizer) -> None:
+    """Pump binary PCM frames from the browser into the recognizer."""
+
+    try:
+        while True:
+            message = await websocket.receive()
+            if message["type"] == "websocket.disconnect":
+                break
+            if message.get("bytes"):
+                await recognizer.send_audio(message["bytes"])
+            elif message.get("text"):
+                try:
+                    control = json.loads(message["text"])
+                except ValueError:
+                    continue
+                if control.get("type") == "stop":
+                    break
+    finally:
+        await recognizer.finish()
+
+
+@app.websocket("/ws/stt")
+async def speech_to_text_ws(
+    websocket: WebSocket,
+    settings: SettingsDep,
+    recognizer_factory: RecognizerFactoryDep,
+    format: str = "pcm",
+    sample_rate: int = 16000,
+) -> None:
+    """Streaming recognition: binary PCM in, partial/final transcripts out.
+
+    The client sends raw audio as binary frames and ``{"type": "stop"}`` (or
+    closes the socket) when done.  Every transcript update is pushed back as
+    ``{"type": "partial" | "final", "text", "begin_ms", "end_ms", "elapsed_ms"}``.
+    """
+
+    await websocket.accept()
+    pump: Optional[asyncio.Task[None]] = None
+    try:
+        async with recognizer_factory(
+            settings, audio_format=format, sample_rate=sample_rate
+        ) as recognizer:
+            pump = asyncio.create_task(_forward_audio(websocket, recognizer))
+            async for result in recognizer.results():
+                await websocket.send_json({
+                    "type": "final" if result.is_final else "partial",
+                    "text": result.text,
+                    "begin_ms": result.begin_ms,
+                    "end_ms": result.end_ms,
+                    "elapsed_ms": result.elapsed_ms,
+                })
+            await pump
+        await websocket.send_json({"type": "end"})
+        await websocket.close()
+    except WebSocketDisconnect:
+        logger.debug("STT websocket closed by client")
+    except BailianError as exc:
+        await websocket.send_json({"type": "error", "detail": str(exc)})
+        await websocket.close(code=1011)
+    finally:
+        if pump is not None and not pump.done():
+            pump.cancel()
+
+
 @app.post("/text-to-speech", response_model=TTSResponse, summary="Convert text to audio")
-async def text_to_speech(request: TTSRequest, settings: SettingsDep) -> TTSResponse:
+async def text_to_speech(
+    request: TTSRequest,
+    response: Response,
+    settings: SettingsDep,
+    tts_cache: TTSCacheDep,
+) -> TTSResponse:
+    # The ETag identifies the clip for the cacheable GET stream endpoint; a
+    # POST always answers with the audio, so conditional headers are ignored.
+    response.headers["ETag"] = audio_etag(cache_key(request.text, request.voice, request.format))
+
     try:
         audio_base64 = await synthesize_speech(
             settings=settings,
             text=request.text,
             voice=request.voice,
             audio_format=request.format,
+            cache=tts_cache,
         )
     except BailianError as exc:
         raise HTTPException(status_code=400, detail=str(exc)) from exc
@@ -113,6 +505,156 @@ async def text_to_speech(request: TTSRequest, settings: SettingsDep) -> TTSRespo
     return TTSResponse(audio_base64=audio_base64)
 
 
+AUDIO_MEDIA_TYPES = {
+    "mp3": "audio/mpeg",
+    "wav": "audio/wav",
+    "pcm": "audio/pcm",
+    "opus": "audio/ogg",
+}
+
+
+def _audio_cache_headers(settings: Settings, etag: str) -> Dict[str, str]:
+    return {"ETag": etag, "Cache-Control": f"public, max-age={settings.tts_http_max_age}"}
+
+
+def _etag_matches(if_none_match: Optional[str], etag: str) -> bool:
+    """Weak comparison of an ``If-None-Match`` header against ``etag``."""
+
+    if not if_none_match:
+        return False
+    if if_none_match.strip() == "*":
+        return True
+
+    def _opaque(tag: str) -> str:
+        tag = tag.strip()
+        return tag[2:] if tag.startswith("W/") else tag
+
+    return _opaque(etag) in {_opaque(tag) for tag in if_none_match.split(",")}
+
+
+def _byte_range(header: Optional[str], size: int) -> Optional[Tuple[int, int]]:
+    """Parse a single ``bytes=`` range into an inclusive ``(start, end)`` pair.
+
+    Multi-range and malformed headers are ignored (the full body is served);
+    unsatisfiable ranges raise ``416``.
+    """
+
+    if not header or not header.startswith("bytes=") or "," in header:
+        return None
+    first, _, last = header[len("bytes="):].strip().partition("-")
+    try:
+        if first:
+            start, end = int(first), int(last) if last else size - 1
+        elif last:
+            start, end = size - int(last), size - 1
+            if int(last) == 0:
+                start = size  # zero-length suffix is unsatisfiable
+        else:
+            return None
+    except ValueError:
+        return None
+    start = max(start, 0)
+    if start >= size or start > end:
+        raise HTTPException(
+            status_code=416, detail="Range not satisfiable", headers={"Content-Range": f"bytes */{size}"}
+        )
+    return start, min(end, size - 1)
+
+
+async def _stream_tts_response(
+    request: TTSRequest,
+    settings: Settings,
+    tts_cache: Optional[TTSCache],
+    http_request: Request,
+) -> Response:
+    key = cache_key(request.text, request.voice, request.format)
+    media_type = AUDIO_MEDIA_TYPES.get(request.format.lower(), "application/octet-stream")
+    headers = _audio_cache_headers(settings, audio_etag(key))
+    if _etag_matches(http_request.headers.get("if-none-match"), headers["ETag"]):
+        return Response(status_code=304, headers=headers)
+
+    cached = await tts_cache.aget(key) if tts_cache is not None else None
+    if cached is not None:
+        headers["Accept-Ranges"] = "bytes"
+        byte_range = _byte_range(http_request.headers.get("range"), len(cached))
+        if byte_range is None:
+            return Response(cached, media_type=media_type, headers=headers)
+        start, end = byte_range
+        headers["Content-Range"] = f"bytes {start}-{end}/{len(cached)}"
+        return Response(
+            cached[start : end + 1], status_code=206, media_type=media_type, headers=headers
+        )
+
+    chunks = stream_speech(
+        settings=settings,
+        text=request.text,
+        voice=request.voice,
+        audio_format=request.format,
+    )
+    # Pull the first chunk eagerly so upstream failures still surface as a
+    # proper HTTP error instead of a truncated 200 response.  The wait is the
+    # ``tts`` entry of Server-Timing; later upstream time lands after the
+    # headers are gone.
+    try:
+        with timed("tts"):
+            first = await chunks.__anext__()
+    except StopAsyncIteration:
+        first = b""
+    except BailianError as exc:
+        raise HTTPException(status_code=400, detail=str(exc)) from exc
+    except httpx.TimeoutException as exc:
+        raise HTTPException(status_code=504, detail="Speech synthesis timed out") from exc
+    except httpx.HTTPError as exc:
+        raise HTTPException(status_code=502, detail=f"Speech synthesis failed: {exc}") from exc
+
+    async def _body() -> AsyncIterator[bytes]:
+        received = [first] if first else []
+        try:
+            if first:
+                yield first
+            async for chunk in chunks:
+                received.append(chunk)
+                yield chunk
+        except (BailianError, httpx.HTTPError) as exc:
+            logger.warning("TTS stream aborted: %s", exc)
+            return
+        finally:
+            await chunks.aclose()
+        if tts_cache is not None:
+            await tts_cache.aput(key, b"".join(received))
+
+    return StreamingResponse(_body(), media_type=media_type, headers=headers)
+
+
+@app.get("/text-to-speech/stream", summary="Stream synthesized audio as raw bytes")
+async def text_to_speech_stream(
+    http_request: Request,
+    settings: SettingsDep,
+    tts_cache: TTSCacheDep,
+    text: str = Query(..., description="Text that should be spoken"),
+    voice: Optional[str] = Query(None, description="Optional Bailian voice identifier"),
+    format: str = Query("mp3", description="Desired audio format"),
+) -> Response:
+    """Chunked audio for ``<audio src>`` playback without base64 overhead.
+
+    Cached clips are served with ``ETag``/``Cache-Control`` and honour
+    ``If-None-Match`` and single ``Range`` requests.
+    """
+
+    return await _stream_tts_response(
+        TTSRequest(text=text, voice=voice, format=format), settings, tts_cache, http_request
+    )
+
+
+@app.post("/text-to-speech/stream", summary="Stream synthesized audio as raw bytes")
+async def text_to_speech_stream_post(
+    request: TTSRequest, http_request: Request, settings: SettingsDep, tts_cache: TTSCacheDep
+) -> Response:
+    """Same as the ``GET`` variant for texts too long to fit in a URL."""
+
+    return await _stream_tts_response(request, settings, tts_cache, http_request)
+
+
 @app.post("/livekit/token", response_model=TokenResponse, summary="Create LiveKit access token")
 async def livekit_token(request: TokenRequest, settings: SettingsDep) -> TokenResponse:
     try:
@@ -123,11 +665,14 @@ async def livekit_token(request: TokenRequest, settings: SettingsDep) -> TokenRe
             detail="LiveKit Python SDK is not installed. Install 'livekit' to enable token generation.",
         ) from exc
 
-    grant = rtc.VideoGrant(room=request.room, room_join=True, can_publish=True, can_subscribe=True)
-    token = rtc.AccessToken(settings.livekit_api_key, settings.livekit_api_secret)
-    token.add_grant(grant)
-    token.identity = request.identity
-    jwt = token.to_jwt()
+    async with upstream_call("livekit", "token"):
+        grant = rtc.VideoGrant(
+            room=request.room, room_join=True, can_publish=True, can_subscribe=True
+        )
+        token = rtc.AccessToken(settings.livekit_api_key, settings.livekit_api_secret)
+        token.add_grant(grant)
+        token.identity = request.identity
+        jwt = token.to_jwt()
     return TokenResponse(token=jwt)
 
 
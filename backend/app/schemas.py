@@ -17,7 +17,29 @@ class ChatRequest(BaseModel):
     """Payload sent by the client when requesting a new LLM turn."""
 
     messages: List[Message] = Field(
-        ..., description="Conversation history to send to the Dify LLM"
+        ...,
+        description=(
+            "Conversation history. While a Dify conversation is live only the "
+            "latest message is forwarded; the rest rebuilds the context if Dify "
+            "has dropped the conversation"
+        ),
+    )
+    conversation_id: Optional[str] = Field(
+        None,
+        description=(
+            "Dify conversation returned with an earlier reply; takes precedence "
+            "over the one remembered for ``session_id``"
+        ),
+    )
+    session_id: Optional[str] = Field(
+        None,
+        description=(
+            "Client session identifier. The server remembers its Dify "
+            "conversation for clients that do not send ``conversation_id``"
+        ),
+    )
+    user: Optional[str] = Field(
+        None, description="End-user identifier forwarded to Dify"
     )
 
 
@@ -25,9 +47,15 @@ class ChatResponse(BaseModel):
     """Response wrapper containing the generated assistant text."""
 
     reply: str = Field(..., description="Assistant response returned by Dify")
+    conversation_id: Optional[str] = Field(
+        None, description="Dify conversation the reply belongs to"
+    )
     latency_ms: int = Field(
         ..., description="Measured round-trip time from the Dify API in ms"
     )
+    queue_ms: int = Field(
+        0, description="Time spent waiting for a free Dify request slot in ms"
+    )
 
 
 class STTRequest(BaseModel):
@@ -43,6 +71,11 @@ class STTRequest(BaseModel):
         16000,
         description="Sampling rate of the audio buffer. Bailian expects 16kHz by default",
     )
+    channels: int = Field(
+        1,
+        ge=1,
+        description="Interleaved channels in raw PCM; converted to mono before upload",
+    )
 
 
 class STTResponse(BaseModel):
@@ -7,22 +7,120 @@ return either the transcribed text or base64 audio depending on direction.
 """
 from __future__ import annotations
 
+import asyncio
 import base64
 import json
-from typing import Any, Dict, Optional
+import threading
+import time
+import uuid
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    BinaryIO,
+    Callable,
+    Dict,
+    Mapping,
+    Optional,
+    Tuple,
+    Union,
+)
 
 import httpx
 
 from ..config import Settings
+from .http_pool import create_async_client
+from .metrics import upstream_call
+from .server_timing import record as record_timing
+from .sse import iter_sse_events
+from .tts_cache import TTSCache, cache_key
 
 STT_ENDPOINT = "services/audio/dashscope/speech_to_text"
 TTS_ENDPOINT = "services/audio/dashscope/text_to_speech"
 
+# Slice size used when a non-streaming TTS response is relayed as a stream.
+STREAM_CHUNK_SIZE = 16 * 1024
+
+# Raw bytes read per step when base64-encoding an uploaded file on the fly.
+# Must be a multiple of three so the encoded pieces concatenate cleanly.
+UPLOAD_READ_SIZE = 3 * 16 * 1024
+
+_AUDIO_PLACEHOLDER = "\x00audio\x00"
+
 
 class BailianError(RuntimeError):
     """Raised whenever the Bailian API reports an error."""
 
 
+# Pooled clients, one per event loop.  The FastAPI lifespan and every agent
+# job open one; jobs in the same worker process may run on their own threads
+# and loops, and an ``httpx.AsyncClient`` must only be used on the loop that
+# created it.  Owners on one loop share its pool, so we keep a reference count
+# and only close the pool once the last owner releases it.
+_pools: Dict[asyncio.AbstractEventLoop, Tuple[httpx.AsyncClient, int]] = {}
+_pools_lock = threading.Lock()
+
+
+async def open_client(settings: Settings) -> httpx.AsyncClient:
+    """Create (or reuse) the running loop's Bailian connection pool."""
+
+    loop = asyncio.get_running_loop()
+    with _pools_lock:
+        client, refs = _pools.get(loop, (None, 0))
+        if client is None or client.is_closed:
+            client, refs = create_async_client(settings), 0
+        _pools[loop] = (client, refs + 1)
+        return client
+
+
+async def close_client() -> None:
+    """Release one reference to the loop's pool, closing it when unused."""
+
+    loop = asyncio.get_running_loop()
+    with _pools_lock:
+        if loop not in _pools:
+            return
+        client, refs = _pools.pop(loop)
+        if refs > 1:
+            _pools[loop] = (client, refs - 1)
+            return
+    await client.aclose()
+
+
+def get_client() -> Optional[httpx.AsyncClient]:
+    """Return the running loop's pool if one is currently open."""
+
+    try:
+        loop = asyncio.get_running_loop()
+    except RuntimeError:
+        return None
+    client, _ = _pools.get(loop, (None, 0))
+    if client is None or client.is_closed:
+        return None
+    return client
+
+
+@asynccontextmanager
+async def _client_for(
+    settings: Settings, client: Optional[httpx.AsyncClient]
+) -> AsyncIterator[httpx.AsyncClient]:
+    """Yield the explicit client, the shared pool or a throwaway client."""
+
+    client = client or get_client()
+    if client is not None:
+        yield client
+        return
+    async with create_async_client(settings) as ephemeral:
+        yield ephemeral
+
+
+def _endpoint_url(settings: Settings, endpoint: str) -> httpx.URL:
+    # The shared pool is host agnostic, so resolve absolute URLs per call.
+    return httpx.URL(str(settings.ali_api_base)).join(endpoint)
+
+
 def _build_headers(settings: Settings) -> Dict[str, str]:
     """Return HTTP headers required by Bailian.
 
@@ -38,45 +136,77 @@ def _build_headers(settings: Settings) -> Dict[str, str]:
     }
 
 
+async def _stream_base64_json(
+    head: bytes, audio_file: BinaryIO, tail: bytes
+) -> AsyncIterator[bytes]:
+    """Yield a JSON document whose audio field is base64-encoded on the fly.
+
+    Uploads are spooled temp files that may have rolled over to disk, so each
+    read runs in a worker thread rather than blocking the event loop.
+    """
+
+    yield head
+    while chunk := await asyncio.to_thread(audio_file.read, UPLOAD_READ_SIZE):
+        yield base64.b64encode(chunk)
+    yield tail
+
+
 async def transcribe_audio(
     *,
     settings: Settings,
-    audio_base64: str,
+    audio_base64: Optional[str] = None,
+    audio_file: Optional[BinaryIO] = None,
     audio_format: str = "pcm",
     sample_rate: int = 16000,
     language: str = "zh-CN",
     timeout: Optional[float] = 30.0,
+    client: Optional[httpx.AsyncClient] = None,
 ) -> str:
     """Send audio to Bailian STT and return the transcribed text.
 
     Args:
         settings: Shared settings containing Bailian credentials.
         audio_base64: Audio data encoded in base64.
+        audio_file: Alternatively, a binary file object holding raw audio.  It is
+            read incrementally and base64-encoded while the request body is
+            sent, so the clip never has to exist as one encoded string.
         audio_format: Format accepted by the API, e.g. ``pcm`` or ``wav``.
         sample_rate: Sample rate in Hz.
         language: Spoken language for the recognition engine.
         timeout: Optional request timeout (seconds).
+        client: Optional pooled client; defaults to the shared pool when open.
     """
 
+    if (audio_base64 is None) == (audio_file is None):
+        raise ValueError("Pass exactly one of audio_base64 or audio_file")
+
     payload: Dict[str, Any] = {
         "input": {
             "audio": {
                 "format": audio_format,
                 "sample_rate": sample_rate,
                 "encoding": "base64",
-                "data": audio_base64,
+                "data": audio_base64 if audio_file is None else _AUDIO_PLACEHOLDER,
             },
             "language": language,
         }
     }
 
-    async with httpx.AsyncClient(base_url=str(settings.ali_api_base)) as client:
-        response = await client.post(
-            STT_ENDPOINT,
-            content=json.dumps(payload),
-            headers=_build_headers(settings),
+    content: Union[str, AsyncIterator[bytes]] = json.dumps(payload)
+    if audio_file is not None:
+        head, tail = content.split(json.dumps(_AUDIO_PLACEHOLDER))
+        content = _stream_base64_json(f'{head}"'.encode(), audio_file, f'"{tail}'.encode())
+
+    async with _client_for(settings, client) as http, upstream_call(
+        "bailian_stt", STT_ENDPOINT
+    ) as call:
+        response = await http.post(
+            _endpoint_url(settings, STT_ENDPOINT),
+            content=content,
+            headers=call.trace_headers(_build_headers(settings)),
             timeout=timeout,
         )
+        call.status = response.status_code
         data = response.json()
 
     if response.status_code != 200:
@@ -88,6 +218,23 @@ async def transcribe_audio(
         raise BailianError("Malformed Bailian STT response") from exc
 
 
+def _tts_payload(
+    text: str, voice: Optional[str], audio_format: str, sample_rate: Optional[int] = None
+) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {
+        "input": {
+            "text": text,
+            "format": audio_format,
+        }
+    }
+
+    if voice:
+        payload["input"]["voice"] = voice
+    if sample_rate:
+        payload["input"]["sample_rate"] = sample_rate
+    return payload
+
+
 async def synthesize_speech(
     *,
     settings: Settings,
@@ -95,29 +242,34 @@ async def synthesize_speech(
     voice: Optional[str] = None,
     audio_format: str = "mp3",
     timeout: Optional[float] = 30.0,
+    client: Optional[httpx.AsyncClient] = None,
+    cache: Optional[TTSCache] = None,
+    sample_rate: Optional[int] = None,
 ) -> str:
     """Convert text to speech using the Bailian TTS service.
 
-    Returns the resulting audio as a base64 encoded string.
+    Returns the resulting audio as a base64 encoded string.  When ``cache`` is
+    given, hits are answered from memory without touching the network.
+    ``sample_rate`` requests a specific output rate, e.g. for raw ``pcm``.
     """
 
-    payload: Dict[str, Any] = {
-        "input": {
-            "text": text,
-            "format": audio_format,
-        }
-    }
+    key = cache_key(text, voice, audio_format, sample_rate)
+    if cache is not None and (cached := await cache.aget(key)) is not None:
+        record_timing("tts-cache", description="hit")
+        return base64.b64encode(cached).decode()
 
-    if voice:
-        payload["input"]["voice"] = voice
+    payload = _tts_payload(text, voice, audio_format, sample_rate)
 
-    async with httpx.AsyncClient(base_url=str(settings.ali_api_base)) as client:
-        response = await client.post(
-            TTS_ENDPOINT,
+    async with _client_for(settings, client) as http, upstream_call(
+        "bailian_tts", TTS_ENDPOINT
+    ) as call:
+        response = await http.post(
+            _endpoint_url(settings, TTS_ENDPOINT),
             content=json.dumps(payload),
-            headers=_build_headers(settings),
+            headers=call.trace_headers(_build_headers(settings)),
             timeout=timeout,
         )
+        call.status = response.status_code
         data = response.json()
 
     if response.status_code != 200:
@@ -133,7 +285,283 @@ async def synthesize_speech(
     if not isinstance(audio_data, str):
         audio_data = base64.b64encode(audio_data).decode()
 
+    if cache is not None:
+        await cache.aput(key, base64.b64decode(audio_data))
     return audio_data
 
 
-__all__ = ["transcribe_audio", "synthesize_speech", "BailianError"]
+def _decode_audio_chunk(data: Dict[str, Any]) -> bytes:
+    try:
+        audio_data = data["output"]["audio"]["data"]
+    except (KeyError, TypeError) as exc:
+        raise BailianError(data.get("message", "Malformed Bailian TTS response")) from exc
+    if isinstance(audio_data, str):
+        return base64.b64decode(audio_data)
+    return bytes(audio_data)
+
+
+async def stream_speech(
+    *,
+    settings: Settings,
+    text: str,
+    voice: Optional[str] = None,
+    audio_format: str = "mp3",
+    timeout: Optional[float] = 30.0,
+    client: Optional[httpx.AsyncClient] = None,
+    chunk_size: int = STREAM_CHUNK_SIZE,
+    cache: Optional[TTSCache] = None,
+    sample_rate: Optional[int] = None,
+) -> AsyncIterator[bytes]:
+    """Stream synthesized speech as raw audio bytes.
+
+    The request asks DashScope for server-sent events so audio chunks can be
+    forwarded as soon as they are produced.  Deployments that ignore the SSE
+    header and answer with a single JSON document are still supported; the
+    decoded clip is then yielded in ``chunk_size`` slices.  With a ``cache``,
+    hits are replayed from memory and completed streams are stored.  With
+    ``audio_format="pcm"`` and a ``sample_rate`` the chunks are raw int16
+    samples ready to be published without decoding.
+    """
+
+    key = cache_key(text, voice, audio_format, sample_rate)
+    if cache is not None and (cached := await cache.aget(key)) is not None:
+        audio = memoryview(cached)
+        for offset in range(0, len(audio), chunk_size):
+            yield bytes(audio[offset : offset + chunk_size])
+        return
+
+    chunks = []
+    async for chunk in _stream_speech_upstream(
+        settings, text, voice, audio_format, timeout, client, chunk_size, sample_rate
+    ):
+        if cache is not None:
+            chunks.append(chunk)
+        yield chunk
+    if cache is not None:
+        await cache.aput(key, b"".join(chunks))
+
+
+async def _stream_speech_upstream(
+    settings: Settings,
+    text: str,
+    voice: Optional[str],
+    audio_format: str,
+    timeout: Optional[float],
+    client: Optional[httpx.AsyncClient],
+    chunk_size: int,
+    sample_rate: Optional[int] = None,
+) -> AsyncIterator[bytes]:
+    headers = {**_build_headers(settings), "X-DashScope-SSE": "enable"}
+    payload = _tts_payload(text, voice, audio_format, sample_rate)
+
+    async with _client_for(settings, client) as http, upstream_call(
+        "bailian_tts", f"{TTS_ENDPOINT} (sse)"
+    ) as call:
+        async with http.stream(
+            "POST",
+            _endpoint_url(settings, TTS_ENDPOINT),
+            content=json.dumps(payload),
+            headers=call.trace_headers(headers),
+            timeout=timeout,
+        ) as response:
+            call.status = response.status_code
+            if response.status_code != 200:
+                await response.aread()
+                try:
+                    message = response.json().get("message")
+                except ValueError:
+                    message = None
+                raise BailianError(message or "Unknown Bailian TTS error")
+
+            if response.headers.get("content-type", "").startswith("text/event-stream"):
+                async for event in iter_sse_events(response.aiter_lines()):
+                    try:
+                        data = event.json()
+                    except ValueError:
+                        continue
+                    if data.get("code"):
+                        raise BailianError(data.get("message", "Bailian TTS stream failed"))
+                    if (data.get("output") or {}).get("audio") is None:
+                        continue  # progress/usage events without audio
+                    chunk = _decode_audio_chunk(data)
+                    if chunk:
+                        yield chunk
+                return
+
+            await response.aread()
+            audio = memoryview(_decode_audio_chunk(response.json()))
+            for offset in range(0, len(audio), chunk_size):
+                yield bytes(audio[offset : offset + chunk_size])
+
+
+@dataclass
+class RecognitionResult:
+    """Partial or final transcript produced by :class:`StreamingRecognizer`."""
+
+    text: str
+    is_final: bool
+    begin_ms: Optional[int] = None
+    end_ms: Optional[int] = None
+    elapsed_ms: int = 0
+
+
+async def _default_connect(url: str, headers: Mapping[str, str]) -> Any:
+    try:
+        from websockets.asyncio.client import connect
+    except Exception:  # pragma: no cover - websockets < 13
+        try:
+            import websockets
+        except Exception as exc:  # pragma: no cover - depends on environment
+            raise BailianError(
+                "The 'websockets' package is required for streaming recognition."
+            ) from exc
+        return await websockets.connect(url, extra_headers=dict(headers))
+    return await connect(url, additional_headers=dict(headers), max_size=None)
+
+
+class StreamingRecognizer:
+    """Real-time Bailian speech recognition over the DashScope duplex WebSocket.
+
+    Usage::
+
+        async with StreamingRecognizer(settings) as recognizer:
+            await recognizer.send_audio(pcm_chunk)
+            ...
+            await recognizer.finish()
+            async for result in recognizer.results():
+                ...
+
+    Audio may be sent while :meth:`results` is being consumed from another
+    task; partial transcripts are yielded with ``is_final=False`` and each
+    completed sentence once more with ``is_final=True``.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        *,
+        audio_format: str = "pcm",
+        sample_rate: int = 16000,
+        language: str = "zh-CN",
+        connect: Optional[Callable[[str, Mapping[str, str]], Awaitable[Any]]] = None,
+    ) -> None:
+        self._settings = settings
+        self._audio_format = audio_format
+        self._sample_rate = sample_rate
+        self._language = language
+        self._connect = connect or _default_connect
+        self._task_id = uuid.uuid4().hex
+        self._ws: Any = None
+        self._started = 0.0
+        self._finished = False
+
+    def _command(self, action: str, payload: Dict[str, Any]) -> str:
+        header = {"action": action, "task_id": self._task_id, "streaming": "duplex"}
+        return json.dumps({"header": header, "payload": payload})
+
+    async def __aenter__(self) -> "StreamingRecognizer":
+        # ``__aexit__`` does not run when entering fails, so a failed or
+        # stalled handshake closes the socket here.
+        try:
+            await asyncio.wait_for(self._handshake(), self._settings.ali_ws_handshake_timeout)
+        except asyncio.TimeoutError as exc:
+            await self.aclose()
+            raise BailianError("Bailian streaming recognition did not start in time") from exc
+        except BaseException:
+            await self.aclose()
+            raise
+        return self
+
+    async def _handshake(self) -> None:
+        headers = {
+            "Authorization": f"Bearer {self._settings.ali_access_token}",
+            "X-DashScope-App-Key": self._settings.ali_app_key,
+        }
+        async with upstream_call("bailian_stt", "websocket") as call:
+            url = str(self._settings.ali_ws_url)
+            self._ws = await self._connect(url, call.trace_headers(headers))
+            call.status = 101
+        self._started = time.monotonic()
+        await self._ws.send(
+            self._command(
+                "run-task",
+                {
+                    "task_group": "audio",
+                    "task": "asr",
+                    "function": "recognition",
+                    "model": self._settings.ali_asr_model,
+                    "parameters": {
+                        "format": self._audio_format,
+                        "sample_rate": self._sample_rate,
+                        "language_hints": [self._language.split("-")[0]],
+                    },
+                    "input": {},
+                },
+            )
+        )
+        while True:
+            header, _ = await self._receive_event()
+            if header.get("event") == "task-started":
+                return
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+    async def _receive_event(self) -> "tuple[Dict[str, Any], Dict[str, Any]]":
+        message = json.loads(await self._ws.recv())
+        header = message.get("header", {})
+        if header.get("event") == "task-failed":
+            raise BailianError(header.get("error_message", "Bailian streaming recognition failed"))
+        return header, message.get("payload", {})
+
+    async def send_audio(self, chunk: bytes) -> None:
+        """Forward a chunk of raw audio to the recognizer."""
+
+        if chunk and not self._finished:
+            await self._ws.send(chunk)
+
+    async def finish(self) -> None:
+        """Signal the end of the audio stream; remaining results still arrive."""
+
+        if not self._finished:
+            self._finished = True
+            await self._ws.send(self._command("finish-task", {"input": {}}))
+
+    async def results(self) -> AsyncIterator[RecognitionResult]:
+        """Yield transcripts until the recognizer reports the task finished."""
+
+        while True:
+            header, payload = await self._receive_event()
+            event = header.get("event")
+            if event == "task-finished":
+                return
+            if event != "result-generated":
+                continue
+            sentence = (payload.get("output") or {}).get("sentence") or {}
+            if "text" not in sentence:
+                continue
+            yield RecognitionResult(
+                text=sentence["text"],
+                is_final=bool(sentence.get("sentence_end")),
+                begin_ms=sentence.get("begin_time"),
+                end_ms=sentence.get("end_time"),
+                elapsed_ms=int((time.monotonic() - self._started) * 1000),
+            )
+
+    async def aclose(self) -> None:
+        if self._ws is not None:
+            await self._ws.close()
+            self._ws = None
+
+
+__all__ = [
+    "transcribe_audio",
+    "synthesize_speech",
+    "stream_speech",
+    "StreamingRecognizer",
+    "RecognitionResult",
+    "open_client",
+    "close_client",
+    "get_client",
+    "BailianError",
+]
@@ -0,0 +1,96 @@
+"""Preallocated PCM ring buffer for per-track audio.
+
+Each participant track gets one fixed-size buffer that incoming frames are
+copied into exactly once.  Everything downstream – VAD frames, utterances
+handed to STT, audio streamed to the recognizer – is a read-only NumPy view
+into that buffer, so memory per session is bounded by the buffer size
+regardless of how long the participant talks.
+
+The buffer is *mirrored*: every sample is stored at ``i`` and again at
+``i + capacity``.  Any window of up to ``capacity`` samples is therefore one
+contiguous slice, even when it wraps around the end of the ring, and can be
+returned without copying.  Positions are absolute sample counts since the
+buffer was created; a view stays valid until ``capacity`` further samples have
+been written.
+"""
+from __future__ import annotations
+
+from typing import Dict, Union
+
+import numpy as np
+
+PCMInput = Union[bytes, bytearray, memoryview, np.ndarray]
+
+
+class PCMRingBuffer:
+    """Fixed-capacity mono int16 ring buffer with zero-copy reads."""
+
+    def __init__(self, capacity: int, *, sample_rate: int = 16000) -> None:
+        if capacity <= 0:
+            raise ValueError("capacity must be positive")
+        self.capacity = capacity
+        self.sample_rate = sample_rate
+        self._data = np.zeros(2 * capacity, dtype=np.int16)
+        self.written = 0
+
+    @property
+    def oldest(self) -> int:
+        """Absolute position of the oldest sample still held."""
+
+        return max(0, self.written - self.capacity)
+
+    @property
+    def nbytes(self) -> int:
+        return self._data.nbytes
+
+    def contains(self, start: int) -> bool:
+        return self.oldest <= start <= self.written
+
+    def write(self, pcm: PCMInput) -> int:
+        """Append samples and return the absolute position of the first one.
+
+        ``bytes``/``memoryview`` input is reinterpreted in place with
+        :func:`numpy.frombuffer`; the only copy is the one into the ring.
+        """
+
+        samples = pcm if isinstance(pcm, np.ndarray) else np.frombuffer(pcm, dtype=np.int16)
+        position = self.written
+        if samples.size > self.capacity:
+            # Older samples would be overwritten by this very write anyway.
+            self.written += samples.size - self.capacity
+            samples = samples[-self.capacity :]
+        count = samples.size
+        offset = self.written % self.capacity
+        first = min(count, self.capacity - offset)
+        data, cap = self._data, self.capacity
+        data[offset : offset + first] = samples[:first]
+        data[offset + cap : offset + cap + first] = samples[:first]
+        if count > first:
+            rest = count - first
+            data[:rest] = samples[first:]
+            data[cap : cap + rest] = samples[first:]
+        self.written += count
+        return position
+
+    def view(self, start: int, end: int) -> np.ndarray:
+        """Return samples ``[start, end)`` as a read-only view."""
+
+        if not (self.oldest <= start <= end <= self.written):
+            raise ValueError(
+                f"Samples [{start}, {end}) are not buffered (holding [{self.oldest}, {self.written}))"
+            )
+        offset = start % self.capacity
+        window = self._data[offset : offset + end - start]
+        window.flags.writeable = False
+        return window
+
+    def stats(self) -> Dict[str, int]:
+        return {
+            "capacity_ms": self.capacity * 1000 // self.sample_rate,
+            "bytes": self.nbytes,
+            "buffered_ms": (self.written - self.oldest) * 1000 // self.sample_rate,
+            "written_ms": self.written * 1000 // self.sample_rate,
+        }
+
+
+__all__ = ["PCMRingBuffer", "PCMInput"]
@@ -0,0 +1,177 @@
+"""Vectorised downmix and polyphase resampling to Bailian's 16 kHz mono.
+
+WebRTC delivers 48 kHz audio, frequently stereo, while Bailian recognition
+expects 16 kHz mono int16.  Converting before upload cuts the payload roughly
+six-fold and lets the VAD work on a third of the samples.
+
+:class:`PolyphaseResampler` implements rational ``L/M`` resampling with a
+Kaiser-windowed sinc prototype split into ``L`` polyphase branches.  Each
+output sample only evaluates the ``taps`` coefficients of its own branch, and
+a whole chunk is computed with one gather + multiply-accumulate in NumPy.  The
+resampler is stateful, so a track can be fed frame by frame without seams.
+"""
+from __future__ import annotations
+
+from functools import lru_cache
+from math import gcd
+from typing import Any, BinaryIO, Dict, Optional, Tuple
+
+import numpy as np
+
+from .audio_buffer import PCMInput
+
+TARGET_RATE = 16000
+
+
+def downmix(pcm: PCMInput, channels: int) -> np.ndarray:
+    """Average interleaved int16 channels into mono ``float32`` samples."""
+
+    samples = pcm if isinstance(pcm, np.ndarray) else np.frombuffer(pcm, dtype=np.int16)
+    if channels <= 1:
+        return samples.astype(np.float32)
+    usable = samples.size - samples.size % channels
+    return samples[:usable].reshape(-1, channels).mean(axis=1, dtype=np.float32)
+
+
+def design_polyphase_filter(up: int, down: int, taps: int, beta: float = 8.0) -> np.ndarray:
+    """Return the ``(up, taps)`` polyphase decomposition of the anti-alias filter."""
+
+    length = up * taps
+    cutoff = 0.5 / max(up, down) * 0.92  # cycles per upsampled sample, with roll-off
+    n = np.arange(length) - (length - 1) / 2.0
+    prototype = 2 * cutoff * np.sinc(2 * cutoff * n) * np.kaiser(length, beta)
+    prototype *= up / prototype.sum()
+    # Branch p holds h[p], h[p + up], h[p + 2*up], ...
+    return prototype.reshape(taps, up).T.astype(np.float32).copy()
+
+
+@lru_cache(maxsize=32)
+def _shared_filter(up: int, down: int, taps: int) -> np.ndarray:
+    branches = design_polyphase_filter(up, down, taps)
+    branches.flags.writeable = False
+    return branches
+
+
+class PolyphaseResampler:
+    """Streaming int16 downmix + rational resampler."""
+
+    def __init__(
+        self,
+        in_rate: int,
+        out_rate: int = TARGET_RATE,
+        *,
+        channels: int = 1,
+        taps: int = 32,
+    ) -> None:
+        divisor = gcd(in_rate, out_rate)
+        self.in_rate = in_rate
+        self.out_rate = out_rate
+        self.channels = channels
+        self.up = out_rate // divisor
+        self.down = in_rate // divisor
+        self.taps = taps
+        self.passthrough = self.up == self.down
+        self._branches = None if self.passthrough else _shared_filter(self.up, self.down, taps)
+        self._history = np.zeros(taps - 1, dtype=np.float32)
+        self._consumed = 0  # input samples seen
+        self._produced = 0  # output samples emitted
+
+    def __getstate__(self) -> Dict[str, Any]:
+        # Only the small streaming state travels to worker processes; the
+        # filter bank is rebuilt from the per-process cache.
+        return {**self.__dict__, "_branches": None}
+
+    def __setstate__(self, state: Dict[str, Any]) -> None:
+        self.__dict__.update(state)
+        if not self.passthrough:
+            self._branches = _shared_filter(self.up, self.down, self.taps)
+
+    def process(self, pcm: PCMInput) -> np.ndarray:
+        """Convert a chunk of interleaved int16 PCM; returns mono int16."""
+
+        if self.passthrough and self.channels <= 1:
+            return pcm if isinstance(pcm, np.ndarray) else np.frombuffer(pcm, dtype=np.int16)
+        mono = downmix(pcm, self.channels)
+        if self.passthrough:
+            return _to_int16(mono)
+
+        buffer = np.concatenate((self._history, mono))
+        buffer_start = self._consumed - (self.taps - 1)
+        self._consumed += mono.size
+        # Output n sits at upsampled position n*down, i.e. after input
+        # sample (n*down)//up; emit every output whose inputs have arrived.
+        end = -(-self._consumed * self.up // self.down)
+        positions = np.arange(self._produced, end, dtype=np.int64) * self.down
+        self._produced = end
+        self._history = buffer[buffer.size - (self.taps - 1) :]
+        if not positions.size:
+            return np.empty(0, dtype=np.int16)
+
+        newest = positions // self.up - buffer_start
+        window = buffer[newest[:, None] - np.arange(self.taps)[None, :]]
+        coefficients = self._branches[positions % self.up]
+        return _to_int16(np.einsum("nk,nk->n", window, coefficients))
+
+    def convert_file(self, source: BinaryIO, target: BinaryIO, *, block_bytes: int = 1 << 16) -> int:
+        """Stream-convert raw PCM from ``source`` into ``target``; returns bytes written."""
+
+        frame_bytes = 2 * max(self.channels, 1)
+        block_bytes -= block_bytes % frame_bytes
+        written = 0
+        carry = b""
+        while True:
+            chunk = source.read(block_bytes)
+            if not chunk:
+                break
+            chunk = carry + chunk
+            usable = len(chunk) - len(chunk) % frame_bytes
+            carry = chunk[usable:]
+            converted = self.process(chunk[:usable])
+            target.write(converted.tobytes())
+            written += converted.nbytes
+        return written
+
+
+def _to_int16(samples: np.ndarray) -> np.ndarray:
+    return np.clip(np.rint(samples), -32768, 32767).astype(np.int16)
+
+
+def resample_detached(
+    pcm: PCMInput, resampler: PolyphaseResampler
+) -> Tuple[np.ndarray, PolyphaseResampler]:
+    """``resampler.process`` returning the resampler, for executor jobs.
+
+    A process pool works on a copy of ``resampler``; handing back the updated
+    copy keeps the stream seamless whichever executor ran the chunk.
+    """
+
+    return resampler.process(pcm), resampler
+
+
+def to_target_rate(pcm: PCMInput, sample_rate: int, channels: int = 1) -> np.ndarray:
+    """One-shot conversion of a complete clip to 16 kHz mono int16."""
+
+    return PolyphaseResampler(sample_rate, channels=channels).process(pcm)
+
+
+def needs_conversion(sample_rate: int, channels: int, audio_format: Optional[str] = "pcm") -> bool:
+    """Whether raw PCM should be converted before upload.
+
+    Only downsampling/downmixing reduces the payload; lower rates and
+    container formats are forwarded untouched.
+    """
+
+    return (audio_format or "pcm").lower() == "pcm" and (
+        sample_rate > TARGET_RATE or channels > 1
+    )
+
+
+__all__ = [
+    "TARGET_RATE",
+    "PolyphaseResampler",
+    "design_polyphase_filter",
+    "downmix",
+    "needs_conversion",
+    "resample_detached",
+    "to_target_rate",
+]
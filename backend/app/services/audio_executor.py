@@ -0,0 +1,233 @@
+"""Run CPU-bound audio transforms off the agent's event loop.
+
+One agent worker process serves many rooms from a single event loop, so every
+millisecond spent resampling, classifying VAD frames or encoding an utterance
+inline delays the audio and network I/O of every other room.  The agent sends
+these transforms through an :class:`AudioExecutor` instead:
+
+* ``inline`` – run on the loop (lowest overhead for a single room),
+* ``thread`` – a thread pool; the NumPy kernels release the GIL, so other
+  rooms keep running while a frame is processed,
+* ``process`` – a process pool for work that holds the GIL (pure-Python
+  codecs).  Audio is exchanged through reusable ``multiprocessing``
+  shared-memory slots rather than pickled: the caller copies the samples into
+  a slot, the worker maps it as an array and writes an array result back into
+  the same slot.
+
+The default, ``auto``, picks ``thread`` only when the host has more than one
+CPU.  On a single core a pool cannot run a kernel in parallel with the loop;
+it only adds a hand-off per frame, and ``benchmarks/loop_lag.py`` measures no
+consistent gain over ``inline`` there.
+
+The executor returned by :func:`get_audio_executor` is shut down when the
+process exits, which unlinks the shared-memory slots; pool workers close
+their mappings of those slots as they exit.
+
+Every transform has the signature ``fn(pcm, *args)``.  For process pools
+``fn`` and ``args`` must be picklable and should be small; stateful objects
+such as :class:`~backend.app.services.audio_dsp.PolyphaseResampler` are
+passed in and returned alongside the result.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+from concurrent.futures import ProcessPoolExecutor, ThreadPoolExecutor
+from functools import lru_cache
+from multiprocessing.shared_memory import SharedMemory
+from multiprocessing.util import Finalize
+from typing import Any, Callable, Dict, List, NamedTuple, Tuple
+
+import numpy as np
+
+from ..config import Settings, get_settings
+from .audio_buffer import PCMInput
+
+logger = logging.getLogger(__name__)
+
+AudioTransform = Callable[..., Any]
+
+MIN_SLOT_BYTES = 64 * 1024
+
+
+class AudioExecutor:
+    """Inline executor; subclasses move the work to a pool."""
+
+    kind = "inline"
+
+    async def run(self, fn: AudioTransform, pcm: PCMInput, *args: Any) -> Any:
+        """Return ``fn(pcm, *args)``."""
+
+        return fn(pcm, *args)
+
+    def shutdown(self) -> None:
+        """Release pool workers and shared memory."""
+
+
+class ThreadAudioExecutor(AudioExecutor):
+    """Run transforms in a thread pool; arrays are passed by reference."""
+
+    kind = "thread"
+
+    def __init__(self, max_workers: int = 2) -> None:
+        self._pool = ThreadPoolExecutor(max_workers, thread_name_prefix="audio-dsp")
+
+    async def run(self, fn: AudioTransform, pcm: PCMInput, *args: Any) -> Any:
+        return await asyncio.get_running_loop().run_in_executor(self._pool, fn, pcm, *args)
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=False, cancel_futures=True)
+
+
+class _Shared(NamedTuple):
+    """Marker for an array result left in the job's shared-memory slot."""
+
+    shape: Tuple[int, ...]
+    dtype: str
+
+
+_ATTACHED: Dict[str, SharedMemory] = {}  # slots mapped by this worker process
+
+
+def _attach(name: str) -> SharedMemory:
+    shm = _ATTACHED.get(name)
+    if shm is None:
+        shm = _ATTACHED[name] = SharedMemory(name=name)
+    return shm
+
+
+def _detach_all() -> None:
+    while _ATTACHED:
+        _, shm = _ATTACHED.popitem()
+        try:
+            shm.close()
+        except BufferError:  # pragma: no cover - an array still views the slot
+            pass
+
+
+def _init_worker() -> None:
+    # Pool workers skip ``atexit`` handlers but run multiprocessing finalizers.
+    Finalize(None, _detach_all, exitpriority=0)
+
+
+def _run_shared(
+    fn: AudioTransform, name: str, shape: Tuple[int, ...], dtype: str, args: Tuple[Any, ...]
+) -> Any:
+    """Worker side of :class:`ProcessAudioExecutor`."""
+
+    shm = _attach(name)
+    result = fn(np.ndarray(shape, dtype, buffer=shm.buf), *args)
+    array = result[0] if isinstance(result, tuple) and result else result
+    if not isinstance(array, np.ndarray) or array.nbytes > shm.size:
+        return result
+    # Overlapping input/output memory is handled by NumPy's copy.
+    np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = array
+    marker = _Shared(array.shape, array.dtype.str)
+    return marker if array is result else (marker, *result[1:])
+
+
+class ProcessAudioExecutor(AudioExecutor):
+    """Run transforms in worker processes, exchanging audio via shared memory."""
+
+    kind = "process"
+
+    def __init__(self, max_workers: int = 2, *, slot_bytes: int = MIN_SLOT_BYTES) -> None:
+        self._pool = ProcessPoolExecutor(max_workers, initializer=_init_worker)
+        self._slot_bytes = slot_bytes
+        self._free: List[SharedMemory] = []
+        self._slots: List[SharedMemory] = []
+        self._lock = threading.Lock()  # rooms on other job threads share the slots
+
+    def _acquire(self, nbytes: int) -> SharedMemory:
+        with self._lock:
+            for index, slot in enumerate(self._free):
+                if slot.size >= nbytes:
+                    return self._free.pop(index)
+            size = max(self._slot_bytes, 1 << max(nbytes - 1, 1).bit_length())
+            slot = SharedMemory(create=True, size=size)
+            self._slots.append(slot)
+            return slot
+
+    async def run(self, fn: AudioTransform, pcm: PCMInput, *args: Any) -> Any:
+        samples = pcm if isinstance(pcm, np.ndarray) else np.frombuffer(pcm, dtype=np.int16)
+        slot = self._acquire(samples.nbytes)
+        np.ndarray(samples.shape, samples.dtype, buffer=slot.buf)[...] = samples
+        future = asyncio.get_running_loop().run_in_executor(
+            self._pool, _run_shared, fn, slot.name, samples.shape, samples.dtype.str, args
+        )
+        try:
+            result = await asyncio.shield(future)
+        except asyncio.CancelledError:
+            # The worker may still write into the slot; recycle it afterwards.
+            future.add_done_callback(lambda _: self._release(slot))
+            raise
+        except BaseException:
+            self._release(slot)
+            raise
+        try:
+            return self._collect(result, slot)
+        finally:
+            self._release(slot)
+
+    def _release(self, slot: SharedMemory) -> None:
+        with self._lock:
+            self._free.append(slot)
+
+    @staticmethod
+    def _collect(result: Any, slot: SharedMemory) -> Any:
+        if isinstance(result, _Shared):
+            marker = result
+        elif isinstance(result, tuple) and result and isinstance(result[0], _Shared):
+            marker = result[0]
+        else:
+            return result
+        array = np.ndarray(marker.shape, marker.dtype, buffer=slot.buf).copy()
+        return array if marker is result else (array, *result[1:])
+
+    def shutdown(self) -> None:
+        self._pool.shutdown(wait=True, cancel_futures=True)
+        with self._lock:
+            for slot in self._slots:
+                slot.close()
+                slot.unlink()
+            self._slots.clear()
+            self._free.clear()
+
+
+def create_audio_executor(settings: Settings) -> AudioExecutor:
+    """Build the executor selected by ``agent_dsp_executor``."""
+
+    kind = settings.agent_dsp_executor
+    if kind == "auto":
+        kind = "thread" if (os.cpu_count() or 1) > 1 else "inline"
+    if kind == "inline":
+        return AudioExecutor()
+    if kind == "thread":
+        return ThreadAudioExecutor(settings.agent_dsp_workers)
+    if kind == "process":
+        return ProcessAudioExecutor(settings.agent_dsp_workers)
+    raise ValueError(f"Unknown audio executor {kind!r}")
+
+
+@lru_cache()
+def get_audio_executor() -> AudioExecutor:
+    """Return the executor shared by all rooms of this worker process."""
+
+    executor = create_audio_executor(get_settings())
+    logger.info("Audio transforms run on a %s executor", executor.kind)
+    # Unlike ``atexit``, multiprocessing finalizers also run when the worker
+    # is itself a child process, e.g. a LiveKit job process.
+    Finalize(None, executor.shutdown, exitpriority=10)
+    return executor
+
+
+__all__ = [
+    "AudioExecutor",
+    "AudioTransform",
+    "ProcessAudioExecutor",
+    "ThreadAudioExecutor",
+    "create_audio_executor",
+    "get_audio_executor",
+]
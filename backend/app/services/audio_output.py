@@ -0,0 +1,182 @@
+"""Real-time paced PCM playback for the voice agent.
+
+Publishing a whole synthesized clip as one LiveKit frame forces a decode step
+up front, delays the first sound until the clip is complete and leaves nothing
+to interrupt.  Instead the agent asks Bailian for raw PCM at the room sample
+rate and:
+
+* :class:`StreamedClip` pulls TTS chunks in the background, so playback of a
+  sentence starts with its first chunk while the rest is still arriving,
+* :class:`PacedPublisher` slices the samples into fixed 10/20 ms frames inside
+  one preallocated buffer and hands each frame to the ``AudioSource`` on a
+  real-time schedule.
+
+Frames are scheduled against an absolute deadline rather than by sleeping a
+fixed interval, so timer jitter does not accumulate (drift correction).  The
+publisher runs up to ``lead_ms`` ahead of real time to keep LiveKit's jitter
+buffer fed, and when the producer falls behind by more than ``max_lag_ms`` the
+schedule is re-anchored instead of bursting to catch up.  Because every frame
+is a separate ``await``, barge-in stops playback between two frames.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from contextlib import aclosing
+from typing import AsyncIterator, Awaitable, Callable, Optional, Union
+
+import numpy as np
+
+_END = object()
+_NO_HEAD = object()
+
+
+class PacedPublisher:
+    """Publish int16 PCM as fixed-size frames at real-time pace.
+
+    ``on_first_frame`` is called as soon as the first frame of a clip has been
+    handed to ``capture``, before the publisher sleeps to keep pace; a clip
+    ends with :meth:`finish` or :meth:`clear`.
+    """
+
+    def __init__(
+        self,
+        capture: Callable[[np.ndarray], Awaitable[None]],
+        *,
+        sample_rate: int = 48000,
+        channels: int = 1,
+        frame_ms: int = 20,
+        buffer: Optional[np.ndarray] = None,
+        lead_ms: float = 60.0,
+        max_lag_ms: float = 200.0,
+        clock: Callable[[], float] = time.monotonic,
+        sleep: Callable[[float], Awaitable[None]] = asyncio.sleep,
+        on_first_frame: Optional[Callable[[], None]] = None,
+    ) -> None:
+        if frame_ms not in (10, 20):
+            raise ValueError("frame_ms must be 10 or 20")
+        self.sample_rate = sample_rate
+        self.channels = channels
+        self.frame_ms = frame_ms
+        self.frame_samples = sample_rate * frame_ms // 1000 * channels
+        # ``buffer`` may be the memory of a preallocated ``rtc.AudioFrame`` so
+        # frames are filled in place and never allocated per publish.
+        self._frame = buffer if buffer is not None else np.zeros(self.frame_samples, np.int16)
+        if self._frame.size != self.frame_samples:
+            raise ValueError("buffer must hold exactly one frame")
+        self._capture = capture
+        self._fill = 0
+        self._odd = b""  # half of a sample split across two byte chunks
+        self._lead = lead_ms / 1000
+        self._max_lag = max_lag_ms / 1000
+        self._clock = clock
+        self._sleep = sleep
+        self._deadline: Optional[float] = None
+        self._on_first_frame = on_first_frame
+        self._clip_frames = 0
+        self.frames_sent = 0
+        self.resyncs = 0
+
+    async def write(self, pcm: Union[bytes, memoryview, np.ndarray]) -> None:
+        """Queue samples for playback, publishing every completed frame."""
+
+        if isinstance(pcm, np.ndarray):
+            samples = pcm
+        else:
+            data = self._odd + bytes(pcm) if self._odd else pcm
+            usable = len(data) - len(data) % 2
+            self._odd = bytes(data[usable:])
+            samples = np.frombuffer(data[:usable], dtype=np.int16)
+        offset = 0
+        while offset < samples.size:
+            take = min(self.frame_samples - self._fill, samples.size - offset)
+            self._frame[self._fill : self._fill + take] = samples[offset : offset + take]
+            self._fill += take
+            offset += take
+            if self._fill == self.frame_samples:
+                await self._publish()
+
+    async def finish(self) -> None:
+        """Pad and publish the trailing partial frame of a clip."""
+
+        if self._fill:
+            self._frame[self._fill :] = 0
+            await self._publish()
+        self._clip_frames = 0
+
+    def clear(self) -> None:
+        """Drop buffered samples and restart the schedule (barge-in)."""
+
+        self._fill = 0
+        self._odd = b""
+        self._deadline = None
+        self._clip_frames = 0
+
+    async def _publish(self) -> None:
+        now = self._clock()
+        if self._deadline is None or now - self._deadline > self._max_lag:
+            if self._deadline is not None:
+                self.resyncs += 1
+            self._deadline = now
+        self._fill = 0
+        await self._capture(self._frame)
+        self.frames_sent += 1
+        self._clip_frames += 1
+        if self._clip_frames == 1 and self._on_first_frame is not None:
+            self._on_first_frame()
+        self._deadline += self.frame_ms / 1000
+        delay = self._deadline - self._clock() - self._lead
+        if delay > 0:
+            await self._sleep(delay)
+
+
+class StreamedClip:
+    """TTS audio chunks fetched in the background while earlier clips play."""
+
+    def __init__(self, chunks: AsyncIterator[bytes]) -> None:
+        self._queue: "asyncio.Queue[object]" = asyncio.Queue()
+        self._head: object = _NO_HEAD
+        self._task = asyncio.create_task(self._pump(chunks))
+
+    @classmethod
+    async def open(cls, chunks: AsyncIterator[bytes]) -> "StreamedClip":
+        """Start streaming and wait for the first chunk (or the failure)."""
+
+        clip = cls(chunks)
+        try:
+            first = await clip._queue.get()
+        except BaseException:
+            await clip.aclose()
+            raise
+        if isinstance(first, Exception):
+            await clip.aclose()
+            raise first
+        clip._head = first
+        return clip
+
+    async def _pump(self, chunks: AsyncIterator[bytes]) -> None:
+        try:
+            async with aclosing(chunks):
+                async for chunk in chunks:
+                    self._queue.put_nowait(chunk)
+        except Exception as exc:
+            self._queue.put_nowait(exc)
+        finally:
+            self._queue.put_nowait(_END)
+
+    async def __aiter__(self) -> AsyncIterator[bytes]:
+        item, self._head = self._head, _NO_HEAD
+        if item is _NO_HEAD:
+            item = await self._queue.get()
+        while item is not _END:
+            if isinstance(item, Exception):
+                raise item
+            yield item  # type: ignore[misc]
+            item = await self._queue.get()
+
+    async def aclose(self) -> None:
+        self._task.cancel()
+        await asyncio.gather(self._task, return_exceptions=True)
+
+
+__all__ = ["PacedPublisher", "StreamedClip"]
@@ -1,16 +1,36 @@
 """Helper for interacting with a self-hosted Dify deployment."""
 from __future__ import annotations
 
+import asyncio
 import json
+import logging
+import threading
 import time
-from typing import Any, Dict, Iterable, Optional
+from collections import deque
+from contextlib import asynccontextmanager, nullcontext
+from typing import Any, AsyncIterator, Deque, Dict, Iterable, Optional, Tuple
 
 import httpx
 
 from ..config import Settings
 from ..schemas import Message
+from .http_pool import create_async_client
+from .metrics import REGISTRY, upstream_call
+from .server_timing import record as record_timing
+from .sse import iter_sse_events
+
+logger = logging.getLogger(__name__)
 
 CHAT_COMPLETIONS_ENDPOINT = "chat-messages"
+STOP_ENDPOINT = "chat-messages/{task_id}/stop"
+DEFAULT_USER = "livekit-web-assistant"
+
+# Dify emits ``agent_message`` instead of ``message`` for agent-style apps.
+_ANSWER_EVENTS = {"message", "agent_message"}
+
+
+class DifyError(RuntimeError):
+    """Raised when Dify reports an error inside a streamed response."""
 
 
 def _build_headers(settings: Settings) -> Dict[str, str]:
@@ -23,40 +43,469 @@ def _build_headers(settings: Settings) -> Dict[str, str]:
     return headers
 
 
+def _backend_key(settings: Settings) -> Tuple[str, str, Optional[str]]:
+    return (str(settings.dify_api_base), settings.dify_api_key, settings.dify_app_id)
+
+
+class RequestGate:
+    """FIFO counting semaphore that event loops on several threads can share.
+
+    :class:`asyncio.Semaphore` binds to the first loop that waits on it, but
+    agent jobs may each run their own loop in one worker process.  Waiters
+    park on a future of their own loop; :meth:`release` hands the slot to the
+    oldest waiter directly, so the cap holds across loops.
+    """
+
+    def __init__(self, limit: int) -> None:
+        self.limit = max(1, limit)
+        self._held = 0
+        self._waiters: Deque[Tuple[asyncio.AbstractEventLoop, "asyncio.Future[None]"]] = deque()
+        self._lock = threading.Lock()
+
+    async def acquire(self) -> None:
+        loop = asyncio.get_running_loop()
+        with self._lock:
+            if self._held < self.limit and not self._waiters:
+                self._held += 1
+                return
+            waiter = (loop, loop.create_future())
+            self._waiters.append(waiter)
+        try:
+            await waiter[1]
+        except asyncio.CancelledError:
+            with self._lock:
+                granted = waiter not in self._waiters
+                if not granted:
+                    self._waiters.remove(waiter)
+            if granted:  # the slot arrived together with the cancellation
+                self.release()
+            raise
+
+    def release(self) -> None:
+        while True:
+            with self._lock:
+                if not self._waiters:
+                    self._held -= 1
+                    return
+                loop, future = self._waiters.popleft()
+            try:
+                loop.call_soon_threadsafe(_grant, future)
+                return
+            except RuntimeError:  # that loop is closed; try the next waiter
+                continue
+
+
+def _grant(future: "asyncio.Future[None]") -> None:
+    if not future.done():
+        future.set_result(None)
+
+
+class DifyClient:
+    """Long-lived Dify client with connection reuse and bounded concurrency.
+
+    A single instance owns a pooled :class:`httpx.AsyncClient` for one Dify
+    backend and a :class:`RequestGate` capping the number of in-flight
+    requests; clients on different loops may share one gate.  Callers above
+    the cap wait in FIFO order; the time spent waiting is reported separately
+    from the upstream round trip.
+    """
+
+    def __init__(
+        self,
+        settings: Settings,
+        *,
+        max_concurrency: Optional[int] = None,
+        http: Optional[httpx.AsyncClient] = None,
+        gate: Optional[RequestGate] = None,
+    ) -> None:
+        self._base_url = httpx.URL(str(settings.dify_api_base))
+        self._headers = _build_headers(settings)
+        self._http = http or create_async_client(settings)
+        self._owns_http = http is None
+        self._slots = gate or RequestGate(max_concurrency or settings.dify_max_concurrency)
+        self.in_flight = 0
+        self.waiting = 0
+
+    @property
+    def is_closed(self) -> bool:
+        return self._http.is_closed
+
+    def url(self, endpoint: str) -> httpx.URL:
+        return self._base_url.join(endpoint)
+
+    @asynccontextmanager
+    async def _slot(self) -> AsyncIterator[int]:
+        """Hold one request slot, yielding the milliseconds spent queueing."""
+
+        queued = time.monotonic()
+        self.waiting += 1
+        try:
+            await self._slots.acquire()
+        finally:
+            self.waiting -= 1
+        self.in_flight += 1
+        queue_ms = (time.monotonic() - queued) * 1000
+        record_timing("queue", queue_ms)
+        try:
+            yield int(queue_ms)
+        finally:
+            self.in_flight -= 1
+            self._slots.release()
+
+    async def post_json(
+        self,
+        endpoint: str,
+        payload: Dict[str, Any],
+        *,
+        timeout: Optional[float] = 30.0,
+        bypass_queue: bool = False,
+        label: Optional[str] = None,
+    ) -> Tuple[Dict[str, Any], int, int]:
+        """POST ``payload`` and return ``(data, queue_ms, upstream_ms)``.
+
+        ``bypass_queue`` skips the concurrency cap for short control calls
+        such as stopping a generation, which must not wait behind the very
+        streams they are meant to end.  ``label`` replaces ``endpoint`` in
+        metrics when the path carries ids.
+        """
+
+        async with nullcontext(0) if bypass_queue else self._slot() as queue_ms:
+            async with upstream_call("dify", label or endpoint) as call:
+                start = time.monotonic()
+                response = await self._http.post(
+                    self.url(endpoint),
+                    content=json.dumps(payload),
+                    headers=call.trace_headers(self._headers),
+                    timeout=timeout,
+                )
+                upstream_ms = int((time.monotonic() - start) * 1000)
+                call.status = response.status_code
+                response.raise_for_status()
+                return response.json(), queue_ms, upstream_ms
+
+    @asynccontextmanager
+    async def stream(
+        self,
+        endpoint: str,
+        payload: Dict[str, Any],
+        *,
+        timeout: Optional[float] = 30.0,
+    ) -> AsyncIterator[Tuple[httpx.Response, int, float]]:
+        """POST ``payload`` and yield ``(response, queue_ms, sent_at)``.
+
+        ``sent_at`` is the :func:`time.monotonic` timestamp taken once a slot
+        is held and just before the request goes out, so latencies measured
+        from it include connecting, the upload and the wait for headers.  The
+        request slot is held until the caller leaves the context, so long
+        running streams count against the concurrency cap like blocking calls.
+        """
+
+        async with self._slot() as queue_ms, upstream_call("dify", endpoint) as call:
+            sent_at = time.monotonic()
+            async with self._http.stream(
+                "POST",
+                self.url(endpoint),
+                content=json.dumps(payload),
+                headers=call.trace_headers(self._headers),
+                timeout=timeout,
+            ) as response:
+                call.status = response.status_code
+                if response.is_error:
+                    await response.aread()
+                response.raise_for_status()
+                yield response, queue_ms, sent_at
+
+    async def aclose(self) -> None:
+        if self._owns_http:
+            await self._http.aclose()
+
+    async def __aenter__(self) -> "DifyClient":
+        return self
+
+    async def __aexit__(self, *exc_info: Any) -> None:
+        await self.aclose()
+
+
+# Shared clients, one per event loop and Dify backend.  The FastAPI lifespan
+# and every agent job open one; jobs may run on their own threads and loops,
+# and an ``httpx.AsyncClient`` must stay on the loop that created it.  Clients
+# of one backend share a gate, so the concurrency cap is per worker process.
+# Reference counted like the Bailian pools so owners open and close them
+# independently.
+ClientKey = Tuple[asyncio.AbstractEventLoop, Tuple[str, str, Optional[str]]]
+_clients: Dict[ClientKey, Tuple[DifyClient, int]] = {}
+_gates: Dict[Tuple[str, str, Optional[str]], RequestGate] = {}
+_clients_lock = threading.Lock()
+
+
+def _client_key(settings: Settings) -> ClientKey:
+    return asyncio.get_running_loop(), _backend_key(settings)
+
+
+async def open_client(settings: Settings) -> DifyClient:
+    """Create (or reuse) the running loop's client for the Dify backend."""
+
+    key = _client_key(settings)
+    with _clients_lock:
+        client, refs = _clients.get(key, (None, 0))
+        if client is None or client.is_closed:
+            gate = _gates.get(key[1])
+            if gate is None:
+                gate = _gates[key[1]] = RequestGate(settings.dify_max_concurrency)
+            client, refs = DifyClient(settings, gate=gate), 0
+        _clients[key] = (client, refs + 1)
+        return client
+
+
+async def close_client(settings: Settings) -> None:
+    """Release one reference to the loop's client, closing it when unused."""
+
+    key = _client_key(settings)
+    with _clients_lock:
+        if key not in _clients:
+            return
+        client, refs = _clients.pop(key)
+        if refs > 1:
+            _clients[key] = (client, refs - 1)
+            return
+    await client.aclose()
+
+
+def get_client(settings: Settings) -> Optional[DifyClient]:
+    """Return the running loop's client for ``settings`` if one is open."""
+
+    try:
+        key = _client_key(settings)
+    except RuntimeError:
+        return None
+    client, _ = _clients.get(key, (None, 0))
+    if client is None or client.is_closed:
+        return None
+    return client
+
+
+def requests_in_flight() -> int:
+    """Dify requests holding a slot, summed over the clients of every loop."""
+
+    with _clients_lock:
+        clients = [client for client, _ in _clients.values()]
+    return sum(client.in_flight for client in clients)
+
+
+def requests_waiting() -> int:
+    """Dify requests queued for a slot, summed over the clients of every loop."""
+
+    with _clients_lock:
+        clients = [client for client, _ in _clients.values()]
+    return sum(client.waiting for client in clients)
+
+
+REGISTRY.gauge(
+    "dify_requests_in_flight",
+    "Dify requests holding a concurrency slot, summed over open clients",
+    function=requests_in_flight,
+)
+REGISTRY.gauge(
+    "dify_requests_waiting",
+    "Dify requests queued for a concurrency slot",
+    function=requests_waiting,
+)
+
+
+def _build_payload(
+    messages: Iterable[Message],
+    *,
+    response_mode: str,
+    conversation_id: Optional[str] = None,
+    user: Optional[str] = None,
+) -> Dict[str, Any]:
+    payload: Dict[str, Any] = {
+        "inputs": {},
+        "response_mode": response_mode,
+        "query": messages[-1].content if messages else "",
+        "user": user or DEFAULT_USER,
+        "conversation_id": conversation_id,
+    }
+    # Once Dify owns the conversation it already has the history; resending it
+    # would only grow the payload and the prompt-processing work every turn.
+    if conversation_id is None:
+        payload["messages"] = [message.dict() for message in messages]
+    return payload
+
+
 async def generate_reply(
     *,
     settings: Settings,
     messages: Iterable[Message],
     timeout: Optional[float] = 30.0,
+    client: Optional[DifyClient] = None,
+    conversation_id: Optional[str] = None,
+    user: Optional[str] = None,
 ) -> Dict[str, Any]:
     """Send the conversation to Dify and return the response payload.
 
     The function returns both the generated text and metadata such as latency so
-    the HTTP API can report progress back to the browser.
+    the HTTP API can report progress back to the browser.  ``latency_ms`` covers
+    the upstream round trip only; time spent waiting for a free request slot is
+    reported as ``queue_ms``.  With a ``conversation_id`` only the latest
+    message is sent and Dify supplies the earlier turns.
     """
 
-    payload: Dict[str, Any] = {
-        "inputs": {},
-        "response_mode": "blocking",
-        "query": messages[-1].content if messages else "",
-        "user": "livekit-web-assistant",
-        "conversation_id": None,
-        "messages": [message.dict() for message in messages],
-    }
+    payload = _build_payload(
+        messages, response_mode="blocking", conversation_id=conversation_id, user=user
+    )
 
-    start = time.monotonic()
-    async with httpx.AsyncClient(base_url=str(settings.dify_api_base)) as client:
-        response = await client.post(
-            CHAT_COMPLETIONS_ENDPOINT,
-            content=json.dumps(payload),
-            headers=_build_headers(settings),
-            timeout=timeout,
+    client = client or get_client(settings)
+    if client is not None:
+        data, queue_ms, latency = await client.post_json(
+            CHAT_COMPLETIONS_ENDPOINT, payload, timeout=timeout
         )
+    else:
+        async with DifyClient(settings) as ephemeral:
+            data, queue_ms, latency = await ephemeral.post_json(
+                CHAT_COMPLETIONS_ENDPOINT, payload, timeout=timeout
+            )
+
+    return {
+        "reply": data.get("answer", ""),
+        "conversation_id": data.get("conversation_id"),
+        "latency_ms": latency,
+        "queue_ms": queue_ms,
+    }
+
+
+async def stream_reply(
+    *,
+    settings: Settings,
+    messages: Iterable[Message],
+    timeout: Optional[float] = 30.0,
+    client: Optional[DifyClient] = None,
+    conversation_id: Optional[str] = None,
+    user: Optional[str] = None,
+) -> AsyncIterator[Dict[str, Any]]:
+    """Stream the assistant reply from Dify as it is generated.
+
+    Yields ``{"event": "started", "task_id": ...}`` as soon as any event
+    carries the Dify ``task_id`` – usually before the first token, so a
+    barge-in can stop the generation early – then
+    ``{"event": "delta", "text": ...}`` for every answer chunk and a
+    final ``{"event": "done", ...}`` carrying the full reply, the Dify
+    conversation/message/task ids, ``ttft_ms`` (time to first token),
+    ``latency_ms`` and ``queue_ms``.  Errors reported inside the stream raise
+    :class:`DifyError`.
+    """
+
+    payload = _build_payload(
+        messages, response_mode="streaming", conversation_id=conversation_id, user=user
+    )
+
+    client = client or get_client(settings)
+    if client is None:
+        async with DifyClient(settings) as ephemeral:
+            async for event in stream_reply(
+                settings=settings,
+                messages=messages,
+                timeout=timeout,
+                client=ephemeral,
+                conversation_id=conversation_id,
+                user=user,
+            ):
+                yield event
+        return
+
+    parts = []
+    ids: Dict[str, Optional[str]] = {
+        "conversation_id": None,
+        "message_id": None,
+        "task_id": None,
+    }
+    ttft_ms: Optional[int] = None
+    async with client.stream(CHAT_COMPLETIONS_ENDPOINT, payload, timeout=timeout) as (
+        response,
+        queue_ms,
+        start,
+    ):
+        async for sse in iter_sse_events(response.aiter_lines()):
+            try:
+                data = sse.json()
+            except ValueError:
+                continue
+            kind = data.get("event", sse.event)
+            started = ids["task_id"] is not None
+            for key in ids:
+                ids[key] = data.get(key) or ids[key]
+            if not started and ids["task_id"]:
+                yield {"event": "started", "task_id": ids["task_id"]}
+            if kind in _ANSWER_EVENTS:
+                text = data.get("answer") or ""
+                if not text:
+                    continue
+                if ttft_ms is None:
+                    ttft_ms = int((time.monotonic() - start) * 1000)
+                parts.append(text)
+                yield {"event": "delta", "text": text, "task_id": ids["task_id"]}
+            elif kind == "message_end":
+                break
+            elif kind == "error":
+                raise DifyError(data.get("message", "Unknown Dify streaming error"))
         latency = int((time.monotonic() - start) * 1000)
-        response.raise_for_status()
-        data = response.json()
 
-    return {"reply": data.get("answer", ""), "latency_ms": latency}
+    yield {
+        "event": "done",
+        "reply": "".join(parts),
+        **ids,
+        "ttft_ms": ttft_ms if ttft_ms is not None else latency,
+        "latency_ms": latency,
+        "queue_ms": queue_ms,
+    }
+
+
+async def stop_generation(
+    *,
+    settings: Settings,
+    task_id: str,
+    user: Optional[str] = None,
+    timeout: Optional[float] = 5.0,
+    client: Optional[DifyClient] = None,
+) -> bool:
+    """Ask Dify to stop generating the streamed reply identified by ``task_id``.
+
+    Closing the stream alone leaves the model running server-side, so barge-in
+    calls this with the ``task_id`` seen in the stream.  ``user`` must match
+    the user that started the generation.  Returns whether Dify acknowledged;
+    failures are logged rather than raised because the turn is being
+    abandoned anyway.
+    """
+
+    endpoint = STOP_ENDPOINT.format(task_id=task_id)
+    payload = {"user": user or DEFAULT_USER}
+    client = client or get_client(settings)
+    try:
+        if client is not None:
+            data, _, _ = await client.post_json(
+                endpoint, payload, timeout=timeout, bypass_queue=True, label=STOP_ENDPOINT
+            )
+        else:
+            async with DifyClient(settings) as ephemeral:
+                data, _, _ = await ephemeral.post_json(
+                    endpoint, payload, timeout=timeout, label=STOP_ENDPOINT
+                )
+    except httpx.HTTPError as exc:
+        logger.warning("Failed to stop Dify task %s: %s", task_id, exc)
+        return False
+    return data.get("result") == "success"
 
 
-__all__ = ["generate_reply"]
+__all__ = [
+    "DifyClient",
+    "DifyError",
+    "RequestGate",
+    "generate_reply",
+    "stream_reply",
+    "stop_generation",
+    "open_client",
+    "close_client",
+    "get_client",
+    "requests_in_flight",
+    "requests_waiting",
+]
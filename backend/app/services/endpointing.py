@@ -0,0 +1,165 @@
+"""Adaptive end-of-turn detection for the voice agent.
+
+A fixed silence timeout either cuts speakers off mid-thought or adds dead air
+before the assistant answers.  :class:`EndpointDetector` instead derives the
+required silence from three signals:
+
+* a per-speaker hangover learnt from the pauses that speaker makes *inside*
+  their turns (pauses after which they carried on talking),
+* lexical cues in the latest partial transcript – final punctuation and
+  question particles (吗/呢/吧…) shorten the wait, trailing fillers and
+  conjunctions (嗯, 那个, 然后, um…) lengthen it,
+* hard lower/upper bounds so tuning mistakes cannot stall a conversation.
+
+Every end-of-turn decision is logged with its timing so thresholds can be
+tuned from production logs.
+"""
+from __future__ import annotations
+
+import logging
+import re
+from collections import deque
+from dataclasses import dataclass
+from typing import Callable, Deque, Dict, Optional, Tuple
+
+from ..config import Settings
+
+logger = logging.getLogger(__name__)
+
+_FINAL_PUNCTUATION = re.compile(r"[。！？!?.…]\s*$")
+_QUESTION_PARTICLE = re.compile(r"[吗呢吧么嘛][？?]?\s*$")
+_CONTINUATION = re.compile(
+    r"(?:[，,、：:]|嗯|呃|额|啊|那个|这个|就是|然后|所以|但是|而且|还有|因为|如果"
+    r"|\b(?:and|but|so|um|uh|er|because|like))\s*$",
+    re.IGNORECASE,
+)
+
+# Multipliers applied to the speaker's hangover for each transcript cue.
+CUE_FACTORS: Dict[str, float] = {
+    "question_particle": 0.5,
+    "final_punctuation": 0.6,
+    "continuation": 1.6,
+    "silence": 1.0,
+}
+
+
+@dataclass
+class EndpointDecision:
+    """Outcome of one end-of-turn evaluation."""
+
+    speaker: str
+    end_of_turn: bool
+    silence_ms: int
+    required_ms: int
+    hangover_ms: int
+    cue: str
+    transcript: str
+
+
+def classify_cue(transcript: str) -> str:
+    """Return the transcript cue name used to scale the hangover."""
+
+    text = transcript.strip()
+    if not text:
+        return "silence"
+    if _CONTINUATION.search(text):
+        return "continuation"
+    if _QUESTION_PARTICLE.search(text):
+        return "question_particle"
+    if _FINAL_PUNCTUATION.search(text):
+        return "final_punctuation"
+    return "silence"
+
+
+class EndpointDetector:
+    """Per-speaker adaptive end-of-turn decisions."""
+
+    def __init__(
+        self,
+        *,
+        base_hangover_ms: int = 500,
+        min_ms: int = 250,
+        max_ms: int = 1200,
+        pause_margin_ms: int = 120,
+        history: int = 20,
+        on_decision: Optional[Callable[[EndpointDecision], None]] = None,
+    ) -> None:
+        self.base_hangover_ms = base_hangover_ms
+        self.min_ms = min_ms
+        self.max_ms = max_ms
+        self.pause_margin_ms = pause_margin_ms
+        self._history = history
+        self._pauses: Dict[str, Deque[int]] = {}
+        self._on_decision = on_decision
+
+    def observe_pause(self, speaker: str, pause_ms: int) -> None:
+        """Record a pause after which ``speaker`` kept talking."""
+
+        self._pauses.setdefault(speaker, deque(maxlen=self._history)).append(pause_ms)
+
+    def hangover_ms(self, speaker: str) -> int:
+        """Speaker-specific silence budget before cues are applied.
+
+        Uses the 90th percentile of the speaker's observed in-turn pauses plus
+        a margin, so slow, deliberate speakers get more room and quick
+        speakers get faster replies.
+        """
+
+        pauses = self._pauses.get(speaker)
+        if not pauses or len(pauses) < 3:
+            return self.base_hangover_ms
+        ordered = sorted(pauses)
+        p90 = ordered[min(len(ordered) - 1, int(0.9 * len(ordered)))]
+        return int(min(max(p90 + self.pause_margin_ms, self.min_ms), self.max_ms))
+
+    def required_silence(self, speaker: str, transcript: str = "") -> Tuple[int, int, str]:
+        """Return ``(required_ms, hangover_ms, cue)`` for the current state."""
+
+        hangover = self.hangover_ms(speaker)
+        cue = classify_cue(transcript)
+        required = int(hangover * CUE_FACTORS[cue])
+        return min(max(required, self.min_ms), self.max_ms), hangover, cue
+
+    def update(self, speaker: str, silence_ms: int, transcript: str = "") -> EndpointDecision:
+        """Evaluate whether ``silence_ms`` of trailing silence ends the turn."""
+
+        required, hangover, cue = self.required_silence(speaker, transcript)
+        decision = EndpointDecision(
+            speaker=speaker,
+            end_of_turn=silence_ms >= required,
+            silence_ms=silence_ms,
+            required_ms=required,
+            hangover_ms=hangover,
+            cue=cue,
+            transcript=transcript,
+        )
+        if decision.end_of_turn:
+            logger.info(
+                "End of turn for %s after %d ms silence (required %d ms, hangover %d ms, cue %s, %d chars)",
+                speaker,
+                silence_ms,
+                required,
+                hangover,
+                cue,
+                len(transcript),
+            )
+            if self._on_decision is not None:
+                self._on_decision(decision)
+        return decision
+
+
+def create_endpoint_detector(settings: Settings) -> EndpointDetector:
+    return EndpointDetector(
+        base_hangover_ms=settings.vad_hangover_ms,
+        min_ms=settings.endpoint_min_ms,
+        max_ms=settings.endpoint_max_ms,
+    )
+
+
+__all__ = [
+    "CUE_FACTORS",
+    "EndpointDecision",
+    "EndpointDetector",
+    "classify_cue",
+    "create_endpoint_detector",
+]
@@ -0,0 +1,86 @@
+"""Compact latency histograms with bounded relative error.
+
+:class:`LatencyHistogram` follows the HdrHistogram layout: values (in
+microseconds) below ``2 * 2**precision_bits`` get one bucket each, and every
+further power of two is split into ``2**precision_bits`` equal sub-buckets.
+With the default 5 bits a recorded value is off by at most ~3 %, recording
+is O(1) without allocation, and a histogram covering one minute fits in an
+``array`` of well under a thousand counters.
+"""
+from __future__ import annotations
+
+from array import array
+from typing import Dict, Iterator, Tuple
+
+
+class LatencyHistogram:
+    """Log-linear histogram of millisecond latencies."""
+
+    __slots__ = ("_bits", "_sub", "_max_us", "counts", "count", "total_ms", "min_ms", "max_ms")
+
+    def __init__(self, *, max_ms: float = 60_000.0, precision_bits: int = 5) -> None:
+        self._bits = precision_bits
+        self._sub = 1 << precision_bits
+        self._max_us = int(max_ms * 1000)
+        self.counts = array("Q", bytes(8 * (self._index(self._max_us) + 1)))
+        self.count = 0
+        self.total_ms = 0.0
+        self.min_ms = float("inf")
+        self.max_ms = 0.0
+
+    def _index(self, micros: int) -> int:
+        if micros < 2 * self._sub:
+            return micros
+        shift = micros.bit_length() - self._bits - 1
+        return self._sub * shift + (micros >> shift)
+
+    def _bounds(self, index: int) -> Tuple[int, int]:
+        """``[low, high)`` microsecond range of bucket ``index``."""
+
+        if index < 2 * self._sub:
+            return index, index + 1
+        shift = index // self._sub - 1
+        low = (index - self._sub * shift) << shift
+        return low, low + (1 << shift)
+
+    def observe(self, value_ms: float) -> None:
+        micros = min(max(int(value_ms * 1000), 0), self._max_us)
+        self.counts[self._index(micros)] += 1
+        self.count += 1
+        self.total_ms += value_ms
+        self.min_ms = min(self.min_ms, value_ms)
+        self.max_ms = max(self.max_ms, value_ms)
+
+    def percentile(self, q: float) -> float:
+        """Value at quantile ``q`` (0-1) in ms, ``0.0`` when empty."""
+
+        if not self.count:
+            return 0.0
+        rank = max(1, round(q * self.count))
+        seen = 0
+        for index, bucket_count in enumerate(self.counts):
+            seen += bucket_count
+            if seen >= rank:
+                low, high = self._bounds(index)
+                return min((low + high) / 2000, self.max_ms)
+        return self.max_ms  # pragma: no cover - counts always sum to count
+
+    def buckets(self) -> Iterator[Tuple[float, int]]:
+        """Non-empty buckets as ``(upper bound in ms, count)``, ascending."""
+
+        for index, bucket_count in enumerate(self.counts):
+            if bucket_count:
+                yield self._bounds(index)[1] / 1000, bucket_count
+
+    def snapshot(self) -> Dict[str, float]:
+        return {
+            "count": self.count,
+            "mean_ms": round(self.total_ms / self.count, 2) if self.count else 0.0,
+            "p50_ms": round(self.percentile(0.5), 2),
+            "p95_ms": round(self.percentile(0.95), 2),
+            "p99_ms": round(self.percentile(0.99), 2),
+            "max_ms": round(self.max_ms, 2),
+        }
+
+
+__all__ = ["LatencyHistogram"]
@@ -0,0 +1,52 @@
+"""Factory for the long-lived :mod:`httpx` clients shared by upstream services.
+
+Creating an ``httpx.AsyncClient`` per request means every call pays DNS, TCP
+and TLS setup again.  The helpers here build pooled clients configured from
+:class:`~backend.app.config.Settings` so service modules can keep a single
+instance alive for the lifetime of the process.
+"""
+from __future__ import annotations
+
+import logging
+
+import httpx
+
+from ..config import Settings
+
+logger = logging.getLogger(__name__)
+
+
+def build_limits(settings: Settings) -> httpx.Limits:
+    """Translate the pooling settings into :class:`httpx.Limits`."""
+
+    return httpx.Limits(
+        max_connections=settings.http_max_connections,
+        max_keepalive_connections=settings.http_max_keepalive_connections,
+        keepalive_expiry=settings.http_keepalive_expiry,
+    )
+
+
+def _http2_available() -> bool:
+    try:
+        import h2  # noqa: F401
+    except Exception:  # pragma: no cover - depends on environment
+        return False
+    return True
+
+
+def create_async_client(settings: Settings, **kwargs) -> httpx.AsyncClient:
+    """Return a pooled ``httpx.AsyncClient`` honouring the pooling settings.
+
+    HTTP/2 is only negotiated when requested *and* the optional ``h2`` package
+    is importable, otherwise the client silently stays on HTTP/1.1 keep-alive.
+    """
+
+    http2 = settings.http2_enabled
+    if http2 and not _http2_available():
+        logger.warning("HTTP/2 requested but the 'h2' package is missing; using HTTP/1.1")
+        http2 = False
+
+    return httpx.AsyncClient(limits=build_limits(settings), http2=http2, **kwargs)
+
+
+__all__ = ["build_limits", "create_async_client"]
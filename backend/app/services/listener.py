@@ -0,0 +1,262 @@
+"""Per-participant speech intake for the voice agent.
+
+:class:`ParticipantListener` owns everything that happens to one microphone
+track before a user turn is handed to the LLM: voice-activity detection,
+adaptive end-of-turn decisions and – when ``agent_streaming_stt`` is enabled –
+a streaming Bailian recognizer that transcribes while the user is still
+talking.  Partial transcripts feed back into the
+:class:`~backend.app.services.endpointing.EndpointDetector`, so a finished
+question ends the turn sooner than a sentence trailing off into "然后…", and
+partials that stop changing can trigger a speculative reply.
+
+The class does not depend on LiveKit, which keeps it unit-testable; the agent
+only hands over the raw frame memory via :meth:`push`.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from dataclasses import dataclass
+from functools import partial
+from typing import Awaitable, Callable, Dict, List, Optional
+
+import numpy as np
+
+from ..config import Settings
+from .ali_bailian import BailianError, StreamingRecognizer
+from .audio_buffer import PCMInput
+from .audio_dsp import PolyphaseResampler, resample_detached
+from .audio_executor import AudioExecutor
+from .endpointing import EndpointDecision, EndpointDetector
+from .vad import Utterance, VoiceActivityDetector, create_vad
+
+logger = logging.getLogger(__name__)
+
+RecognizerFactory = Callable[[int], StreamingRecognizer]
+
+
+@dataclass
+class Turn:
+    """A finished user turn; ``transcript()`` resolves its text."""
+
+    speaker: str
+    utterance: Utterance
+    decision: Optional[EndpointDecision]
+    transcript: Callable[[], Awaitable[str]]
+    ended_at: float = 0.0  # clock time at which the end of the turn was detected
+
+    def detach(self) -> None:
+        """Copy the utterance out of the ring buffer before the turn waits.
+
+        The buffer keeps being written while the participant talks on, so a
+        turn queued for longer than ``agent_audio_buffer_ms`` would otherwise
+        find its audio overwritten.
+        """
+
+        self.utterance = self.utterance.detach()
+
+
+class _RecognitionStream:
+    """Streams one utterance to a recognizer and tracks its partial text."""
+
+    def __init__(self, recognizer: StreamingRecognizer) -> None:
+        self._audio: "asyncio.Queue[Optional[bytes]]" = asyncio.Queue()
+        self._finals: List[str] = []
+        self._partial = ""
+        self.task: "asyncio.Task[str]" = asyncio.create_task(self._run(recognizer))
+
+    @property
+    def text(self) -> str:
+        return "".join(self._finals) + self._partial
+
+    def send(self, pcm: PCMInput) -> None:
+        chunk = pcm.tobytes() if isinstance(pcm, np.ndarray) else bytes(pcm)
+        if chunk:
+            self._audio.put_nowait(chunk)
+
+    def finish(self) -> None:
+        self._audio.put_nowait(None)
+
+    async def _run(self, recognizer: StreamingRecognizer) -> str:
+        async with recognizer:
+            reader = asyncio.create_task(self._read(recognizer))
+            try:
+                while True:
+                    chunk = await self._audio.get()
+                    if chunk is None:
+                        break
+                    await recognizer.send_audio(chunk)
+                await recognizer.finish()
+                await reader
+            finally:
+                reader.cancel()
+        return self.text
+
+    async def _read(self, recognizer: StreamingRecognizer) -> None:
+        async for result in recognizer.results():
+            if result.is_final:
+                self._finals.append(result.text)
+                self._partial = ""
+            else:
+                self._partial = result.text
+
+
+class ParticipantListener:
+    """Turn one participant's PCM stream into finished :class:`Turn` objects."""
+
+    def __init__(
+        self,
+        settings: Settings,
+        identity: str,
+        *,
+        endpointer: EndpointDetector,
+        on_speech_start: Callable[[], Awaitable[None]],
+        on_turn: Callable[[Turn], Awaitable[None]],
+        transcribe: Callable[[Utterance], Awaitable[str]],
+        recognizer_factory: Optional[RecognizerFactory] = None,
+        on_stable_partial: Optional[Callable[[str], Awaitable[None]]] = None,
+        stable_ms: int = 300,
+        executor: Optional[AudioExecutor] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._settings = settings
+        # Resampling and VAD classification run here; the agent shares one
+        # thread/process pool between rooms to keep its event loop free.
+        self._executor = executor or AudioExecutor()
+        self.identity = identity
+        self._endpointer = endpointer
+        self._on_speech_start = on_speech_start
+        self._on_turn = on_turn
+        self._transcribe = transcribe
+        self._recognizer_factory = recognizer_factory
+        self._vad: Optional[VoiceActivityDetector] = None
+        self._resampler: Optional[PolyphaseResampler] = None
+        self._stream: Optional[_RecognitionStream] = None
+        self._decision: Optional[EndpointDecision] = None
+        # Speculation: fire ``on_stable_partial`` once a partial transcript has
+        # not changed for ``stable_ms`` while the turn is still open.
+        self._on_stable_partial = on_stable_partial
+        self._stable_ms = stable_ms
+        self._clock = clock
+        self._stable_text = ""
+        self._stable_since = 0.0
+        self._stable_reported = False
+
+    @property
+    def partial_transcript(self) -> str:
+        return self._stream.text if self._stream is not None else ""
+
+    def _end_of_turn(self, silence_ms: int) -> bool:
+        decision = self._endpointer.update(self.identity, silence_ms, self.partial_transcript)
+        if decision.end_of_turn:
+            self._decision = decision
+        return decision.end_of_turn
+
+    def stats(self) -> Dict[str, int]:
+        """Memory held for this track; bounded by ``agent_audio_buffer_ms``."""
+
+        return self._vad.buffer.stats() if self._vad is not None else {"bytes": 0}
+
+    async def push(self, pcm: PCMInput, sample_rate: int, channels: int = 1) -> None:
+        """Feed interleaved int16 samples captured at ``sample_rate``.
+
+        Audio is downmixed and resampled to 16 kHz mono first, so the VAD, the
+        ring buffer and STT uploads all work on a third of WebRTC's samples.
+        """
+
+        if self._resampler is None or (
+            self._resampler.in_rate,
+            self._resampler.channels,
+        ) != (sample_rate, channels):
+            self._resampler = PolyphaseResampler(sample_rate, channels=channels)
+        pcm, self._resampler = await self._executor.run(resample_detached, pcm, self._resampler)
+        sample_rate = self._resampler.out_rate
+
+        if self._vad is None:
+            self._vad = create_vad(
+                self._settings,
+                sample_rate,
+                end_of_turn=self._end_of_turn,
+                on_pause=partial(self._endpointer.observe_pause, self.identity),
+            )
+            logger.info(
+                "Allocated %d KiB PCM ring buffer for %s",
+                self._vad.buffer.nbytes // 1024,
+                self.identity,
+            )
+        vad = self._vad
+        was_speaking = vad.speaking
+        utterances = await vad.process_with(self._executor.run, pcm)
+
+        for utterance in utterances:
+            await self._emit(utterance)
+        if was_speaking and not vad.speaking and not utterances:
+            self._drop_stream()  # segment was too short to be speech
+
+        if vad.speaking and (utterances or not was_speaking):
+            await self._on_speech_start()
+            if self._recognizer_factory is not None:
+                self._stream = _RecognitionStream(self._recognizer_factory(sample_rate))
+                self._stream.send(vad.active_pcm)
+                self._stable_text, self._stable_reported = "", False
+        elif vad.speaking and self._stream is not None:
+            self._stream.send(pcm)
+            await self._check_stable_partial()
+
+    async def _check_stable_partial(self) -> None:
+        if self._on_stable_partial is None or self._stream is None:
+            return
+        text, now = self._stream.text, self._clock()
+        if text != self._stable_text:
+            self._stable_text, self._stable_since, self._stable_reported = text, now, False
+        elif (
+            text
+            and not self._stable_reported
+            and (now - self._stable_since) * 1000 >= self._stable_ms
+        ):
+            self._stable_reported = True
+            await self._on_stable_partial(text)
+
+    async def flush(self) -> None:
+        """Close the open segment, e.g. when the track is unpublished."""
+
+        for utterance in self._vad.flush() if self._vad is not None else []:
+            await self._emit(utterance)
+        self._drop_stream()
+        logger.info("Audio buffer for %s: %s", self.identity, self.stats())
+
+    async def _emit(self, utterance: Utterance) -> None:
+        stream, self._stream = self._stream, None
+        decision, self._decision = self._decision, None
+        if stream is not None:
+            stream.finish()
+        turn = Turn(
+            speaker=self.identity,
+            utterance=utterance,
+            decision=decision,
+            # Reads ``turn.utterance`` when called, so a detached copy is used.
+            transcript=lambda: self._final_transcript(stream, turn),
+            ended_at=self._clock(),
+        )
+        await self._on_turn(turn)
+
+    async def _final_transcript(self, stream: Optional[_RecognitionStream], turn: Turn) -> str:
+        utterance = turn.utterance
+        if stream is not None:
+            try:
+                return await stream.task
+            except BailianError as exc:
+                logger.warning("Streaming recognition failed, retrying as one request: %s", exc)
+        if not utterance.valid:
+            logger.warning("Audio for %s was overwritten before transcription", self.identity)
+            return ""
+        return await self._transcribe(utterance)
+
+    def _drop_stream(self) -> None:
+        if self._stream is not None:
+            self._stream.task.cancel()
+            self._stream = None
+
+
+__all__ = ["ParticipantListener", "Turn", "RecognizerFactory"]
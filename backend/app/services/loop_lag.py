@@ -0,0 +1,69 @@
+"""Event-loop lag sampling.
+
+A task sleeps for ``interval`` seconds over and over and records how much
+later than requested it woke up.  That overshoot is the time some callback
+held the loop, i.e. the delay every other room on the worker experienced at
+that moment.
+"""
+from __future__ import annotations
+
+import asyncio
+import time
+from collections import deque
+from typing import Callable, Deque, Dict, Optional
+
+
+class LoopLagMonitor:
+    """Sample the scheduling delay of the running event loop."""
+
+    def __init__(
+        self,
+        interval: float = 0.05,
+        *,
+        window: int = 1200,
+        clock: Callable[[], float] = time.perf_counter,
+    ) -> None:
+        self.interval = interval
+        self._clock = clock
+        self._samples: Deque[float] = deque(maxlen=window)
+        self._task: Optional["asyncio.Task[None]"] = None
+
+    def start(self) -> None:
+        if self._task is None:
+            self._task = asyncio.create_task(self._run())
+
+    async def stop(self) -> None:
+        task, self._task = self._task, None
+        if task is not None:
+            task.cancel()
+            await asyncio.gather(task, return_exceptions=True)
+
+    async def _run(self) -> None:
+        while True:
+            started = self._clock()
+            await asyncio.sleep(self.interval)
+            self._samples.append(max(0.0, self._clock() - started - self.interval))
+
+    @property
+    def last_ms(self) -> float:
+        return self._samples[-1] * 1000 if self._samples else 0.0
+
+    def stats(self) -> Dict[str, float]:
+        """Lag percentiles in milliseconds over the sampling window."""
+
+        ordered = sorted(self._samples)
+        if not ordered:
+            return {"samples": 0, "p50_ms": 0.0, "p99_ms": 0.0, "max_ms": 0.0}
+
+        def pick(q: float) -> float:
+            return round(ordered[min(len(ordered) - 1, int(q * len(ordered)))] * 1000, 3)
+
+        return {
+            "samples": len(ordered),
+            "p50_ms": pick(0.5),
+            "p99_ms": pick(0.99),
+            "max_ms": round(ordered[-1] * 1000, 3),
+        }
+
+
+__all__ = ["LoopLagMonitor"]
@@ -0,0 +1,406 @@
+"""Process-wide metrics served in the Prometheus text format.
+
+The registry keeps plain dictionaries keyed by label values and, for
+latencies, array-backed :class:`~backend.app.services.histogram.LatencyHistogram`
+instances, so recording on the hot path is a dict lookup plus an increment.
+Prometheus buckets (``le``) are derived from the fine-grained histogram only
+when ``/metrics`` is scraped.
+
+Every upstream call goes through :func:`upstream_call`, which records
+
+* ``upstream_requests_total{service, endpoint, status}``,
+* ``upstream_request_duration_seconds{service, endpoint}``,
+* ``upstream_in_flight{service}``.
+
+Point-in-time values such as cache hit ratios are registered as callback
+gauges, and totals kept elsewhere (cache hits, evictions) as callback
+counters; both are evaluated at scrape time.  Agent jobs may record from
+several threads, so every family guards its values with its own lock.  The FastAPI app serves the registry at
+``/metrics``; agent workers expose the same registry with
+:func:`start_metrics_server`.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import threading
+import time
+from contextlib import asynccontextmanager
+from http.server import BaseHTTPRequestHandler, ThreadingHTTPServer
+from typing import (
+    Any,
+    AsyncIterator,
+    Callable,
+    Dict,
+    Iterator,
+    List,
+    Mapping,
+    Optional,
+    Sequence,
+    Tuple,
+    Union,
+)
+
+import httpx
+
+from . import server_timing
+from .histogram import LatencyHistogram
+from .tracing import CLIENT, Span, inject, new_span
+
+logger = logging.getLogger(__name__)
+
+CONTENT_TYPE = "text/plain; version=0.0.4; charset=utf-8"
+
+# Exported ``le`` bounds in seconds.
+DEFAULT_BUCKETS = (0.005, 0.01, 0.025, 0.05, 0.1, 0.25, 0.5, 1.0, 2.5, 5.0, 10.0, 30.0, 60.0)
+
+LabelKey = Tuple[str, ...]
+Sample = Tuple[str, Mapping[str, str], float]
+GaugeValue = Union[float, Mapping[LabelKey, float]]
+
+
+def _escape(value: str) -> str:
+    return value.replace("\\", "\\\\").replace("\n", "\\n").replace('"', '\\"')
+
+
+def _format_value(value: float) -> str:
+    if value == float("inf"):
+        return "+Inf"
+    return repr(float(value)) if value != int(value) else str(int(value))
+
+
+class _Family:
+    kind = "untyped"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], GaugeValue]] = None,
+    ) -> None:
+        self.name = name
+        self.documentation = documentation
+        self.labelnames = tuple(labelnames)
+        self.function = function
+        self._values: Dict[LabelKey, float] = {}
+        self._lock = threading.Lock()
+
+    def _key(self, labels: Mapping[str, Any]) -> LabelKey:
+        if set(labels) != set(self.labelnames):
+            raise ValueError(f"{self.name} expects labels {self.labelnames}, got {tuple(labels)}")
+        return tuple(str(labels[name]) for name in self.labelnames)
+
+    def _labels(self, key: LabelKey) -> Dict[str, str]:
+        return dict(zip(self.labelnames, key))
+
+    def _add(self, amount: float, labels: Mapping[str, Any]) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = self._values.get(key, 0.0) + amount
+
+    def value(self, **labels: Any) -> float:
+        key = self._key(labels)
+        with self._lock:
+            return self._values.get(key, 0.0)
+
+    def samples(self) -> Iterator[Sample]:
+        """Current values, or the callback's result when one is set.
+
+        A callback returns one value for an unlabelled family, or a mapping
+        from label-value tuples to values.
+        """
+
+        if self.function is not None:
+            try:
+                result = self.function()
+            except Exception:  # pragma: no cover - never fail a scrape
+                logger.exception("Metric callback for %s failed", self.name)
+                return
+            values = dict(result) if isinstance(result, Mapping) else {(): result}
+        else:
+            with self._lock:
+                values = dict(self._values)
+        for key, value in values.items():
+            yield self.name, self._labels(key), value
+
+
+class Counter(_Family):
+    """Monotonic counter per label set, or a callback returning running totals."""
+
+    kind = "counter"
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        self._add(amount, labels)
+
+
+class Gauge(_Family):
+    """Settable gauge, or a callback evaluated at scrape time."""
+
+    kind = "gauge"
+
+    def set(self, value: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._values[key] = value
+
+    def inc(self, amount: float = 1.0, **labels: Any) -> None:
+        self._add(amount, labels)
+
+    def dec(self, amount: float = 1.0, **labels: Any) -> None:
+        self._add(-amount, labels)
+
+
+class Histogram(_Family):
+    """Latency histogram per label set, exported in seconds.
+
+    Children created here are observed under the family lock; histograms
+    passed to :meth:`attach` are owned, and locked, by their caller.
+    """
+
+    kind = "histogram"
+
+    def __init__(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> None:
+        super().__init__(name, documentation, labelnames)
+        self.buckets = tuple(sorted(buckets))
+        self._children: Dict[LabelKey, LatencyHistogram] = {}
+
+    def _child(self, key: LabelKey) -> LatencyHistogram:
+        # Callers hold ``self._lock``.
+        child = self._children.get(key)
+        if child is None:
+            child = self._children[key] = LatencyHistogram()
+        return child
+
+    def labels(self, **labels: Any) -> LatencyHistogram:
+        key = self._key(labels)
+        with self._lock:
+            return self._child(key)
+
+    def observe(self, value_ms: float, **labels: Any) -> None:
+        key = self._key(labels)
+        with self._lock:
+            self._child(key).observe(value_ms)
+
+    def attach(self, histogram: LatencyHistogram, **labels: Any) -> None:
+        """Export an existing histogram under ``labels``."""
+
+        key = self._key(labels)
+        with self._lock:
+            self._children[key] = histogram
+
+    def samples(self) -> Iterator[Sample]:
+        with self._lock:
+            children = list(self._children.items())
+        for key, child in children:
+            labels = self._labels(key)
+            cumulative, buckets = 0, child.buckets()
+            pending = next(buckets, None)
+            for bound in self.buckets:
+                # A fine bucket counts towards ``le`` once it ends at or below it.
+                while pending is not None and pending[0] <= bound * 1000:
+                    cumulative += pending[1]
+                    pending = next(buckets, None)
+                yield f"{self.name}_bucket", {**labels, "le": _format_value(bound)}, cumulative
+            yield f"{self.name}_bucket", {**labels, "le": "+Inf"}, child.count
+            yield f"{self.name}_sum", labels, child.total_ms / 1000
+            yield f"{self.name}_count", labels, child.count
+
+
+class MetricsRegistry:
+    """Named metric families; registering an existing name returns it."""
+
+    def __init__(self) -> None:
+        self._families: Dict[str, _Family] = {}
+        self._lock = threading.Lock()
+
+    def _register(self, family: _Family) -> Any:
+        with self._lock:
+            existing = self._families.get(family.name)
+            if existing is not None:
+                if type(existing) is not type(family):
+                    raise ValueError(f"Metric {family.name} already registered as {existing.kind}")
+                if family.function is not None:
+                    existing.function = family.function
+                return existing
+            self._families[family.name] = family
+            return family
+
+    def counter(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], GaugeValue]] = None,
+    ) -> Counter:
+        return self._register(Counter(name, documentation, labelnames, function))
+
+    def gauge(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        function: Optional[Callable[[], GaugeValue]] = None,
+    ) -> Gauge:
+        return self._register(Gauge(name, documentation, labelnames, function))
+
+    def histogram(
+        self,
+        name: str,
+        documentation: str,
+        labelnames: Sequence[str] = (),
+        buckets: Sequence[float] = DEFAULT_BUCKETS,
+    ) -> Histogram:
+        return self._register(Histogram(name, documentation, labelnames, buckets))
+
+    def render(self) -> str:
+        """Return every family in the Prometheus text exposition format."""
+
+        lines: List[str] = []
+        with self._lock:
+            families = list(self._families.values())
+        for family in families:
+            lines.append(f"# HELP {family.name} {family.documentation}")
+            lines.append(f"# TYPE {family.name} {family.kind}")
+            for name, labels, value in family.samples():
+                if labels:
+                    rendered = ",".join(f'{key}="{_escape(val)}"' for key, val in labels.items())
+                    name = f"{name}{{{rendered}}}"
+                lines.append(f"{name} {_format_value(value)}")
+        return "\n".join(lines) + "\n"
+
+
+REGISTRY = MetricsRegistry()
+
+
+def get_registry() -> MetricsRegistry:
+    """Return the registry shared by the app and the agent of this process."""
+
+    return REGISTRY
+
+
+UPSTREAM_REQUESTS = REGISTRY.counter(
+    "upstream_requests_total",
+    "Upstream calls by service, endpoint and HTTP status (or error kind)",
+    ("service", "endpoint", "status"),
+)
+UPSTREAM_DURATION = REGISTRY.histogram(
+    "upstream_request_duration_seconds",
+    "Duration of upstream calls, including streamed bodies",
+    ("service", "endpoint"),
+)
+UPSTREAM_IN_FLIGHT = REGISTRY.gauge(
+    "upstream_in_flight", "Upstream calls currently in progress", ("service",)
+)
+
+# ``Server-Timing`` entry names of the upstream services.
+_TIMING_NAMES = {"bailian_stt": "stt", "bailian_tts": "tts"}
+
+
+class UpstreamCall:
+    """Handle of one instrumented call; set ``status`` to the HTTP status."""
+
+    __slots__ = ("status", "span")
+
+    def __init__(self, span: Span) -> None:
+        self.status: Union[int, str, None] = None
+        self.span = span
+
+    def trace_headers(self, headers: Mapping[str, str]) -> Dict[str, str]:
+        """``headers`` plus the ``traceparent`` of this call's span."""
+
+        return inject(dict(headers), self.span)
+
+
+@asynccontextmanager
+async def upstream_call(service: str, endpoint: str) -> AsyncIterator[UpstreamCall]:
+    """Count and time one call to ``service``; failures are labelled by kind.
+
+    The duration is also added to the current request's ``Server-Timing``,
+    and the call gets a client span whose ``traceparent`` the caller sends
+    via :meth:`UpstreamCall.trace_headers`.
+    """
+
+    span = new_span(
+        f"{service} {endpoint}",
+        kind=CLIENT,
+        attributes={"peer.service": service, "upstream.endpoint": endpoint},
+    )
+    call = UpstreamCall(span)
+    UPSTREAM_IN_FLIGHT.inc(service=service)
+    started = time.perf_counter()
+    try:
+        yield call
+    except asyncio.CancelledError:
+        call.status = call.status or "cancelled"
+        raise
+    except httpx.TimeoutException:
+        call.status = "timeout"
+        raise
+    except Exception:
+        call.status = call.status or "error"
+        raise
+    finally:
+        UPSTREAM_IN_FLIGHT.dec(service=service)
+        labels = {"service": service, "endpoint": endpoint}
+        UPSTREAM_REQUESTS.inc(status=call.status or "ok", **labels)
+        elapsed_ms = (time.perf_counter() - started) * 1000
+        UPSTREAM_DURATION.observe(elapsed_ms, **labels)
+        server_timing.record(_TIMING_NAMES.get(service, service), elapsed_ms)
+        if isinstance(call.status, int):
+            span.set_attribute("http.status_code", call.status)
+            if call.status >= 400:
+                span.set_error(f"HTTP {call.status}")
+        elif call.status is not None:
+            span.set_error(call.status)
+        span.end()
+
+
+class _MetricsHandler(BaseHTTPRequestHandler):
+    registry: MetricsRegistry = REGISTRY
+
+    def do_GET(self) -> None:  # noqa: N802 - http.server naming
+        if self.path.split("?")[0] != "/metrics":
+            self.send_error(404)
+            return
+        body = self.registry.render().encode()
+        self.send_response(200)
+        self.send_header("Content-Type", CONTENT_TYPE)
+        self.send_header("Content-Length", str(len(body)))
+        self.end_headers()
+        self.wfile.write(body)
+
+    def log_message(self, *args: Any) -> None:
+        pass  # scrapes are too frequent for access logs
+
+
+def start_metrics_server(
+    port: int, host: str = "0.0.0.0", registry: MetricsRegistry = REGISTRY
+) -> ThreadingHTTPServer:
+    """Serve ``/metrics`` from a daemon thread (used by agent workers)."""
+
+    handler = type("MetricsHandler", (_MetricsHandler,), {"registry": registry})
+    server = ThreadingHTTPServer((host, port), handler)
+    threading.Thread(target=server.serve_forever, name="metrics", daemon=True).start()
+    logger.info("Serving agent metrics on %s:%d/metrics", host, server.server_address[1])
+    return server
+
+
+__all__ = [
+    "CONTENT_TYPE",
+    "Counter",
+    "Gauge",
+    "Histogram",
+    "MetricsRegistry",
+    "REGISTRY",
+    "UpstreamCall",
+    "get_registry",
+    "start_metrics_server",
+    "upstream_call",
+]
@@ -0,0 +1,141 @@
+"""``Server-Timing`` headers for API responses.
+
+:class:`ServerTimingMiddleware` gives every HTTP request a
+:class:`ServerTiming` collector, kept in a :mod:`contextvars` variable so that
+service code records durations without the request being passed around.
+Upstream calls made through
+:func:`~backend.app.services.metrics.upstream_call` report themselves
+(``dify``, ``stt``, ``tts``, ``livekit``), the Dify client adds the time spent
+waiting for a request slot (``queue``), and handlers wrap their own expensive
+steps in :func:`timed`.  When the response starts the middleware appends
+``app`` – the total time spent in the application – and sends::
+
+    Server-Timing: queue;dur=0.4, dify;dur=812.3, app;dur=815.9
+
+Streaming responses send their headers before the body is produced, so for
+them the header only covers the work done before the first byte; the
+streaming endpoints therefore time their first upstream chunk before
+responding, or report :meth:`ServerTiming.snapshot` in the stream itself.
+
+Browsers hide ``serverTiming`` in the Resource Timing API from pages of other
+origins unless the response carries ``Timing-Allow-Origin``; CORS
+``expose_headers`` only covers reading the header through ``fetch``.  The
+middleware therefore sends ``Timing-Allow-Origin`` for the origins it is
+given.
+"""
+from __future__ import annotations
+
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from typing import Any, Awaitable, Callable, Dict, Iterator, MutableMapping, Optional, Sequence
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+Receive = Callable[[], Awaitable[Message]]
+Send = Callable[[Message], Awaitable[None]]
+ASGIApp = Callable[[Scope, Receive, Send], Awaitable[None]]
+
+
+class ServerTiming:
+    """Named durations of one request; repeated names are summed."""
+
+    __slots__ = ("started", "durations", "descriptions")
+
+    def __init__(self) -> None:
+        self.started = time.perf_counter()
+        self.durations: Dict[str, float] = {}
+        self.descriptions: Dict[str, str] = {}
+
+    def add(self, name: str, duration_ms: float = 0.0, description: Optional[str] = None) -> None:
+        self.durations[name] = self.durations.get(name, 0.0) + duration_ms
+        if description is not None:
+            self.descriptions[name] = description
+
+    def snapshot(self) -> Dict[str, float]:
+        """Durations recorded so far, in ms, with ``app`` as the time elapsed."""
+
+        durations = {name: round(value, 1) for name, value in self.durations.items()}
+        durations["app"] = round((time.perf_counter() - self.started) * 1000, 1)
+        return durations
+
+    def header(self) -> str:
+        self.add("app", (time.perf_counter() - self.started) * 1000)
+        entries = []
+        for name, duration in self.durations.items():
+            entry = f"{name};dur={duration:.1f}"
+            if name in self.descriptions:
+                entry += f';desc="{self.descriptions[name]}"'
+            entries.append(entry)
+        return ", ".join(entries)
+
+
+_current: ContextVar[Optional[ServerTiming]] = ContextVar("server_timing", default=None)
+
+
+def current_timing() -> Optional[ServerTiming]:
+    return _current.get()
+
+
+def record(name: str, duration_ms: float = 0.0, description: Optional[str] = None) -> None:
+    """Add a duration to the current request's header, if any."""
+
+    timing = _current.get()
+    if timing is not None:
+        timing.add(name, duration_ms, description)
+
+
+@contextmanager
+def timed(name: str) -> Iterator[None]:
+    """Record the duration of the enclosed block as ``name``."""
+
+    started = time.perf_counter()
+    try:
+        yield
+    finally:
+        record(name, (time.perf_counter() - started) * 1000)
+
+
+class ServerTimingMiddleware:
+    """ASGI middleware adding a ``Server-Timing`` header to HTTP responses.
+
+    Implemented as plain ASGI rather than ``BaseHTTPMiddleware`` so streamed
+    bodies pass through untouched and the context variable is visible to the
+    endpoint.  ``timing_allow_origins`` lists the origins (or ``"*"``) whose
+    pages may read the timings from the Resource Timing API.
+    """
+
+    def __init__(self, app: ASGIApp, *, timing_allow_origins: Sequence[str] = ()) -> None:
+        self.app = app
+        self._allow_origin = ", ".join(timing_allow_origins).encode("latin-1")
+
+    async def __call__(self, scope: Scope, receive: Receive, send: Send) -> None:
+        if scope["type"] != "http":
+            await self.app(scope, receive, send)
+            return
+
+        timing = ServerTiming()
+        token = _current.set(timing)
+
+        async def _send(message: Message) -> None:
+            if message["type"] == "http.response.start":
+                headers = list(message.get("headers", []))
+                headers.append((b"server-timing", timing.header().encode("latin-1")))
+                if self._allow_origin:
+                    headers.append((b"timing-allow-origin", self._allow_origin))
+                message["headers"] = headers
+            await send(message)
+
+        try:
+            await self.app(scope, receive, _send)
+        finally:
+            _current.reset(token)
+
+
+__all__ = [
+    "ServerTiming",
+    "ServerTimingMiddleware",
+    "current_timing",
+    "record",
+    "timed",
+]
@@ -0,0 +1,104 @@
+"""Server-side mapping from client sessions to Dify conversations.
+
+Dify keeps the conversation history itself once a ``conversation_id`` is
+known, so later turns only need to send the new query.  The store remembers
+that id per ``(user, session)`` pair and forgets idle sessions after a TTL, or
+the least recently used ones when the configured capacity is exceeded.  The
+store is shared by every thread of the process, so access is locked.
+"""
+from __future__ import annotations
+
+import threading
+import time
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+
+from ..config import get_settings
+from .metrics import REGISTRY
+
+SessionKey = Tuple[str, str]
+
+
+class SessionStore:
+    """TTL + LRU bounded map of session keys to Dify conversation ids."""
+
+    def __init__(
+        self,
+        *,
+        ttl: float,
+        max_sessions: int,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.ttl = ttl
+        self.max_sessions = max_sessions
+        self._clock = clock
+        self._entries: "OrderedDict[SessionKey, Tuple[str, float]]" = OrderedDict()
+        self.expired = 0
+        self.evicted = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def get(self, key: SessionKey) -> Optional[str]:
+        """Return the conversation id for ``key`` and refresh its idle timer."""
+
+        with self._lock:
+            self._expire()
+            entry = self._entries.get(key)
+            if entry is None:
+                return None
+            conversation_id, _ = entry
+            self._entries[key] = (conversation_id, self._clock())
+            self._entries.move_to_end(key)
+            return conversation_id
+
+    def set(self, key: SessionKey, conversation_id: str) -> None:
+        with self._lock:
+            self._entries[key] = (conversation_id, self._clock())
+            self._entries.move_to_end(key)
+            while len(self._entries) > self.max_sessions:
+                self._entries.popitem(last=False)
+                self.evicted += 1
+
+    def discard(self, key: SessionKey) -> None:
+        with self._lock:
+            self._entries.pop(key, None)
+
+    def _expire(self) -> None:
+        # Callers hold ``self._lock``.  Entries are ordered by last use, so
+        # expired ones sit at the front.
+        deadline = self._clock() - self.ttl
+        while self._entries:
+            key, (_, last_used) = next(iter(self._entries.items()))
+            if last_used > deadline:
+                break
+            del self._entries[key]
+            self.expired += 1
+
+    def stats(self) -> Dict[str, int]:
+        with self._lock:
+            return {
+                "sessions": len(self._entries),
+                "expired": self.expired,
+                "evicted": self.evicted,
+            }
+
+
+@lru_cache()
+def get_session_store() -> SessionStore:
+    """Return the process-wide session store."""
+
+    settings = get_settings()
+    return SessionStore(ttl=settings.session_ttl_seconds, max_sessions=settings.session_max_entries)
+
+
+REGISTRY.gauge(
+    "dify_conversation_sessions",
+    "Client sessions mapped to a Dify conversation",
+    function=lambda: len(get_session_store()),
+)
+
+
+__all__ = ["SessionKey", "SessionStore", "get_session_store"]
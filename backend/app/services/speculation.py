@@ -0,0 +1,198 @@
+"""Speculative Dify requests on stable partial transcripts.
+
+With streaming recognition the partial transcript usually stops changing a
+few hundred milliseconds before endpointing confirms the end of the turn.
+:class:`Speculator` uses that gap: once a partial has been stable for
+``agent_speculation_stable_ms`` the Dify request is started (and, optionally,
+the first sentence is synthesized so it lands in the TTS cache).  When the
+turn ends, :meth:`Speculator.claim` compares the final transcript with the
+speculated text:
+
+* *hit* – the buffered and still-streaming events are handed to the speech
+  pipeline as if the request had been made just now,
+* *miss* – the stream is closed and Dify is told to stop generating.
+
+Hit rate and the head start gained on hits are tracked in :meth:`stats`, so
+the extra Dify load can be weighed against the latency saved.  Note that Dify
+records a stopped speculative query in the conversation history when a
+``conversation_id`` is reused; operators should enable speculation only where
+that is acceptable.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import re
+import time
+import unicodedata
+from contextlib import aclosing
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional, Set
+
+from .metrics import REGISTRY
+from .text_segmenter import SentenceSegmenter
+
+logger = logging.getLogger(__name__)
+
+Event = Dict[str, Any]
+
+_IGNORED = re.compile(r"[\s\W_]+", re.UNICODE)
+_END = object()
+
+SPECULATIONS = REGISTRY.counter(
+    "agent_speculations_total", "Speculative Dify requests by outcome", ("outcome",)
+)
+
+
+def transcript_key(text: str) -> str:
+    """Comparison key ignoring width, case, whitespace and punctuation."""
+
+    return _IGNORED.sub("", unicodedata.normalize("NFKC", text)).lower()
+
+
+class SpeculativeReply:
+    """A Dify reply started ahead of the final transcript."""
+
+    def __init__(
+        self,
+        text: str,
+        events: AsyncIterator[Event],
+        *,
+        warm: Optional[Callable[[str], Awaitable[Any]]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.text = text
+        self.key = transcript_key(text)
+        self.started = clock()
+        self.task_id: Optional[str] = None
+        self._warm = warm
+        self._queue: "asyncio.Queue[object]" = asyncio.Queue()
+        self._helpers: Set["asyncio.Task[Any]"] = set()
+        self._task = asyncio.create_task(self._pump(events))
+
+    async def _pump(self, events: AsyncIterator[Event]) -> None:
+        segmenter = SentenceSegmenter() if self._warm is not None else None
+        try:
+            async with aclosing(events):
+                async for event in events:
+                    self.task_id = event.get("task_id") or self.task_id
+                    self._queue.put_nowait(event)
+                    if segmenter is not None and event.get("event") == "delta":
+                        segments = segmenter.feed(event.get("text", ""))
+                        if segments:
+                            # Synthesize the first sentence so it is cached by
+                            # the time the pipeline asks for it.
+                            warm = asyncio.create_task(self._warm(segments[0]))
+                            self._helpers.add(warm)
+                            warm.add_done_callback(self._helpers.discard)
+                            segmenter = None
+        except Exception as exc:
+            self._queue.put_nowait(exc)
+        finally:
+            self._queue.put_nowait(_END)
+
+    async def events(self) -> AsyncIterator[Event]:
+        """Replay buffered events, then continue with the live stream."""
+
+        try:
+            while True:
+                item = await self._queue.get()
+                if item is _END:
+                    return
+                if isinstance(item, Exception):
+                    raise item
+                yield item  # type: ignore[misc]
+        finally:
+            self._task.cancel()  # the consumer went away, e.g. barge-in
+
+    async def cancel(self) -> None:
+        tasks = [self._task, *self._helpers]
+        for task in tasks:
+            task.cancel()
+        await asyncio.gather(*tasks, return_exceptions=True)
+
+
+class Speculator:
+    """Start, commit or discard speculative replies for one speaker."""
+
+    def __init__(
+        self,
+        *,
+        start: Callable[[str], AsyncIterator[Event]],
+        stop: Callable[[str], Awaitable[Any]],
+        warm: Optional[Callable[[str], Awaitable[Any]]] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self._start = start
+        self._stop = stop
+        self._warm = warm
+        self._clock = clock
+        self._pending: Optional[SpeculativeReply] = None
+        self._background: Set["asyncio.Task[Any]"] = set()
+        self.attempts = 0
+        self.hits = 0
+        self.misses = 0
+        self.saved_ms = 0.0
+
+    async def speculate(self, text: str) -> None:
+        """Start a reply for ``text`` unless one is already running for it."""
+
+        key = transcript_key(text)
+        if not key or (self._pending is not None and self._pending.key == key):
+            return
+        await self.discard()
+        self.attempts += 1
+        self._pending = SpeculativeReply(text, self._start(text), warm=self._warm, clock=self._clock)
+        logger.debug("Speculatively requesting a reply for %r", text)
+
+    async def claim(self, transcript: str) -> Optional[SpeculativeReply]:
+        """Return the speculative reply if it matches ``transcript``."""
+
+        pending, self._pending = self._pending, None
+        if pending is None:
+            return None
+        if pending.key == transcript_key(transcript):
+            saved = (self._clock() - pending.started) * 1000
+            self.hits += 1
+            self.saved_ms += saved
+            SPECULATIONS.inc(outcome="hit")
+            logger.info("Speculation hit, reply started %.0f ms early", saved)
+            return pending
+        logger.info("Speculation miss: %r became %r", pending.text, transcript)
+        self.misses += 1
+        SPECULATIONS.inc(outcome="miss")
+        await self._abandon(pending)
+        return None
+
+    async def discard(self) -> None:
+        """Abandon the pending speculation, if any."""
+
+        pending, self._pending = self._pending, None
+        if pending is not None:
+            self.misses += 1
+            SPECULATIONS.inc(outcome="discarded")
+            await self._abandon(pending)
+
+    async def _abandon(self, pending: SpeculativeReply) -> None:
+        await pending.cancel()
+        if pending.task_id:
+            stop = asyncio.create_task(self._stop(pending.task_id))
+            self._background.add(stop)
+            stop.add_done_callback(self._background.discard)
+
+    async def aclose(self) -> None:
+        await self.discard()
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "attempts": self.attempts,
+            "hits": self.hits,
+            "misses": self.misses,
+            "hit_rate": self.hits / self.attempts if self.attempts else 0.0,
+            "saved_ms_total": round(self.saved_ms, 1),
+            "saved_ms_avg": round(self.saved_ms / self.hits, 1) if self.hits else 0.0,
+        }
+
+
+__all__ = ["SpeculativeReply", "Speculator", "transcript_key"]
@@ -0,0 +1,119 @@
+"""Pipelined text-to-speech playback for streamed assistant replies.
+
+:class:`SpeechPipeline` connects three stages with bounded queues:
+
+1. *segment* – cut incoming text deltas into sentences,
+2. *synthesize* – turn each sentence into audio, running ahead of playback,
+3. *play* – publish the synthesized audio strictly in order.
+
+While segment N is playing, segment N+1 is already being synthesized, so the
+first audio is heard after one sentence of LLM output plus one TTS call rather
+than after the whole reply.  Cancelling :meth:`SpeechPipeline.run` (barge-in)
+cancels every stage and drops all queued segments; audio objects with an
+``aclose()`` method (such as streamed clips) are closed once played or dropped.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+from typing import AsyncIterable, Awaitable, Callable, Generic, List, Optional, TypeVar
+
+from .text_segmenter import SentenceSegmenter
+
+logger = logging.getLogger(__name__)
+
+AudioT = TypeVar("AudioT")
+
+_DONE = object()
+
+
+class SpeechPipeline(Generic[AudioT]):
+    """Speak a streamed reply sentence by sentence."""
+
+    def __init__(
+        self,
+        *,
+        synthesize: Callable[[str], Awaitable[AudioT]],
+        play: Callable[[AudioT], Awaitable[None]],
+        on_segment: Optional[Callable[[str], Awaitable[None]]] = None,
+        max_chars: int = 80,
+        prefetch: int = 1,
+    ) -> None:
+        self._synthesize = synthesize
+        self._play = play
+        self._on_segment = on_segment
+        self._max_chars = max_chars
+        self._prefetch = max(1, prefetch)
+
+    async def run(self, deltas: AsyncIterable[str]) -> str:
+        """Consume ``deltas`` until exhausted and return the full spoken text."""
+
+        texts: "asyncio.Queue[object]" = asyncio.Queue()
+        ready: "asyncio.Queue[object]" = asyncio.Queue(maxsize=self._prefetch)
+        spoken: List[str] = []
+
+        tasks = [
+            asyncio.create_task(self._segment(deltas, texts, spoken)),
+            asyncio.create_task(self._synthesize_all(texts, ready)),
+            asyncio.create_task(self._play_all(ready)),
+        ]
+        try:
+            await asyncio.gather(*tasks)
+        finally:
+            for task in tasks:
+                task.cancel()
+            await asyncio.gather(*tasks, return_exceptions=True)
+            while not ready.empty():
+                item = ready.get_nowait()
+                if item is not _DONE:
+                    await _close(item[1])  # type: ignore[index]
+        return "".join(spoken)
+
+    async def _segment(
+        self,
+        deltas: AsyncIterable[str],
+        texts: "asyncio.Queue[object]",
+        spoken: List[str],
+    ) -> None:
+        segmenter = SentenceSegmenter(max_chars=self._max_chars)
+        async for delta in deltas:
+            spoken.append(delta)
+            for segment in segmenter.feed(delta):
+                await texts.put(segment)
+        for segment in segmenter.flush():
+            await texts.put(segment)
+        await texts.put(_DONE)
+
+    async def _synthesize_all(
+        self, texts: "asyncio.Queue[object]", ready: "asyncio.Queue[object]"
+    ) -> None:
+        while (text := await texts.get()) is not _DONE:
+            audio = await self._synthesize(text)  # type: ignore[arg-type]
+            try:
+                await ready.put((text, audio))
+            except BaseException:
+                # Cancelled while playback is behind: the clip never reached
+                # the queue, so nobody else will close it.
+                await _close(audio)
+                raise
+        await ready.put(_DONE)
+
+    async def _play_all(self, ready: "asyncio.Queue[object]") -> None:
+        while (item := await ready.get()) is not _DONE:
+            text, audio = item  # type: ignore[misc]
+            if self._on_segment is not None:
+                await self._on_segment(text)
+            logger.debug("Playing segment of %d chars", len(text))
+            try:
+                await self._play(audio)
+            finally:
+                await _close(audio)
+
+
+async def _close(audio: object) -> None:
+    aclose = getattr(audio, "aclose", None)
+    if aclose is not None:
+        await aclose()
+
+
+__all__ = ["SpeechPipeline"]
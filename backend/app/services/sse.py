@@ -0,0 +1,60 @@
+"""Minimal Server-Sent Events parsing and formatting helpers.
+
+Both Dify and Bailian can stream their results as ``text/event-stream``.  The
+parser here follows the WHATWG framing rules closely enough for those services
+(``event``/``data`` fields, multi-line data, blank-line dispatch) without
+pulling in a dedicated dependency.
+"""
+from __future__ import annotations
+
+import json
+from dataclasses import dataclass
+from typing import Any, AsyncIterable, AsyncIterator, List, Optional
+
+
+@dataclass
+class ServerSentEvent:
+    """A single dispatched SSE message."""
+
+    event: str
+    data: str
+
+    def json(self) -> Any:
+        return json.loads(self.data)
+
+
+async def iter_sse_events(lines: AsyncIterable[str]) -> AsyncIterator[ServerSentEvent]:
+    """Group decoded text lines into :class:`ServerSentEvent` instances."""
+
+    event = "message"
+    data: List[str] = []
+    async for line in lines:
+        line = line.rstrip("\r")
+        if not line:
+            if data:
+                yield ServerSentEvent(event=event, data="\n".join(data))
+            event, data = "message", []
+            continue
+        if line.startswith(":"):
+            continue  # comment / keep-alive
+        field, _, value = line.partition(":")
+        if value.startswith(" "):
+            value = value[1:]
+        if field == "event":
+            event = value or "message"
+        elif field == "data":
+            data.append(value)
+    if data:
+        yield ServerSentEvent(event=event, data="\n".join(data))
+
+
+def format_sse(data: Any, *, event: Optional[str] = None) -> str:
+    """Encode ``data`` as JSON inside an SSE frame."""
+
+    frame = f"data: {json.dumps(data, ensure_ascii=False)}\n\n"
+    if event:
+        frame = f"event: {event}\n{frame}"
+    return frame
+
+
+__all__ = ["ServerSentEvent", "iter_sse_events", "format_sse"]
@@ -0,0 +1,68 @@
+"""Incremental sentence segmentation for streamed LLM output.
+
+The voice agent speaks the Dify reply while it is still being generated, so
+text deltas have to be cut into speakable segments as soon as a sentence
+boundary appears.  Chinese punctuation always ends a segment; English ``.``
+only does so once it is followed by whitespace to avoid splitting decimals and
+abbreviations mid-stream.  Overlong runs without punctuation are cut at the
+last soft boundary (comma, colon, space) or, failing that, at the length cap.
+"""
+from __future__ import annotations
+
+from typing import List
+
+HARD_BREAKS = frozenset("。！？；!?;\n")
+SOFT_BREAKS = frozenset("，,、：: ")
+_CLOSERS = frozenset("”’\"')）】」』")
+
+
+class SentenceSegmenter:
+    """Accumulate text deltas and emit complete, speakable segments."""
+
+    def __init__(self, *, max_chars: int = 80, min_chars: int = 2) -> None:
+        self.max_chars = max_chars
+        self.min_chars = min_chars
+        self._buffer = ""
+
+    def feed(self, delta: str) -> List[str]:
+        """Add ``delta`` and return every segment that is now complete."""
+
+        self._buffer += delta
+        segments: List[str] = []
+        while True:
+            cut = self._find_cut()
+            if cut is None:
+                break
+            segment, self._buffer = self._buffer[:cut], self._buffer[cut:]
+            segment = segment.strip()
+            if segment:
+                segments.append(segment)
+        return segments
+
+    def flush(self) -> List[str]:
+        """Return whatever text is left once the stream has finished."""
+
+        remainder, self._buffer = self._buffer.strip(), ""
+        return [remainder] if remainder else []
+
+    def _find_cut(self) -> "int | None":
+        text = self._buffer
+        for index, char in enumerate(text):
+            if char in HARD_BREAKS or (
+                char == "." and index + 1 < len(text) and text[index + 1].isspace()
+            ):
+                end = index + 1
+                while end < len(text) and text[end] in _CLOSERS:
+                    end += 1
+                if len(text[:end].strip()) >= self.min_chars or char == "\n":
+                    return end
+            if index + 1 >= self.max_chars:
+                soft = max(
+                    (i for i in range(index, 0, -1) if text[i] in SOFT_BREAKS),
+                    default=-1,
+                )
+                return soft + 1 if soft > 0 else index + 1
+        return None
+
+
+__all__ = ["SentenceSegmenter", "HARD_BREAKS", "SOFT_BREAKS"]
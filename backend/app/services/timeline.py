@@ -0,0 +1,240 @@
+"""Per-turn latency timelines for the voice agent.
+
+Every user turn gets a :class:`TurnTimeline` that the agent stamps as the
+turn moves through its stages::
+
+    speech_end → turn_end → stt_request → stt_response → dify_request →
+    dify_first_token → tts_request[i] → tts_first_byte[i] → first_frame →
+    dify_final → playback_end | cancelled
+
+The current timeline travels in a :mod:`contextvars` variable, so stages deep
+inside the pipeline (TTS requests, frame publishing) mark it without threading
+it through every call; tasks spawned by the turn inherit it.  Finished
+timelines go to a sink – by default :class:`LatencyHistograms`, which keeps a
+:class:`~backend.app.services.histogram.LatencyHistogram` per derived latency
+such as ``first_audio_ms`` (speech end to first published frame).
+
+Records use ``__slots__`` and store monotonic timestamps only; durations are
+derived when the turn is emitted.
+"""
+from __future__ import annotations
+
+import itertools
+import json
+import logging
+import threading
+import time
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Callable, Dict, List, Optional
+
+from .histogram import LatencyHistogram
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+SPEECH_END = "speech_end"
+TURN_END = "turn_end"
+STT_REQUEST = "stt_request"
+STT_RESPONSE = "stt_response"
+DIFY_REQUEST = "dify_request"
+DIFY_FIRST_TOKEN = "dify_first_token"
+DIFY_FINAL = "dify_final"
+TTS_REQUEST = "tts_request"
+TTS_FIRST_BYTE = "tts_first_byte"
+FIRST_FRAME = "first_frame"
+PLAYBACK_END = "playback_end"
+CANCELLED = "cancelled"
+
+# Derived latency -> (from stage, to stage); ``None`` ends at the turn's end.
+LATENCIES = {
+    "endpoint_ms": (SPEECH_END, TURN_END),
+    "stt_ms": (STT_REQUEST, STT_RESPONSE),
+    "dify_ttft_ms": (DIFY_REQUEST, DIFY_FIRST_TOKEN),
+    "dify_total_ms": (DIFY_REQUEST, DIFY_FINAL),
+    "tts_first_byte_ms": (TTS_REQUEST, TTS_FIRST_BYTE),
+    "first_audio_ms": (SPEECH_END, FIRST_FRAME),
+    "turn_ms": (SPEECH_END, None),
+}
+
+_turn_ids = itertools.count(1)
+
+
+class Mark:
+    """One timestamped stage; ``index`` numbers repeated stages (TTS segments)."""
+
+    __slots__ = ("stage", "at", "index")
+
+    def __init__(self, stage: str, at: float, index: int = 0) -> None:
+        self.stage = stage
+        self.at = at
+        self.index = index
+
+
+class TurnTimeline:
+    """Stage timestamps of one user turn."""
+
+    __slots__ = ("turn_id", "speaker", "marks", "_clock")
+
+    def __init__(
+        self,
+        speaker: str,
+        *,
+        speech_end: Optional[float] = None,
+        clock: Callable[[], float] = time.monotonic,
+    ) -> None:
+        self.turn_id = next(_turn_ids)
+        self.speaker = speaker
+        self._clock = clock
+        self.marks: List[Mark] = []
+        self.mark(SPEECH_END, at=speech_end)
+
+    def mark(self, stage: str, *, index: int = 0, at: Optional[float] = None) -> None:
+        self.marks.append(Mark(stage, self._clock() if at is None else at, index))
+
+    def mark_once(self, stage: str, *, at: Optional[float] = None) -> None:
+        if self.first(stage) is None:
+            self.mark(stage, at=at)
+
+    def count(self, stage: str) -> int:
+        return sum(1 for mark in self.marks if mark.stage == stage)
+
+    def first(self, stage: str, index: Optional[int] = None) -> Optional[float]:
+        for mark in self.marks:
+            if mark.stage == stage and (index is None or mark.index == index):
+                return mark.at
+        return None
+
+    @property
+    def cancelled(self) -> bool:
+        return self.first(CANCELLED) is not None
+
+    def latencies(self) -> Dict[str, float]:
+        """Derived durations in ms for every pair of stages that was reached."""
+
+        end = self.first(PLAYBACK_END) or self.first(CANCELLED)
+        result: Dict[str, float] = {}
+        for name, (start_stage, end_stage) in LATENCIES.items():
+            start = self.first(start_stage, 0 if start_stage == TTS_REQUEST else None)
+            stop = end if end_stage is None else self.first(
+                end_stage, 0 if end_stage == TTS_FIRST_BYTE else None
+            )
+            if start is not None and stop is not None:
+                result[name] = round((stop - start) * 1000, 2)
+        return result
+
+    def as_dict(self) -> Dict[str, Any]:
+        origin = self.marks[0].at
+        return {
+            "turn_id": self.turn_id,
+            "speaker": self.speaker,
+            "outcome": "cancelled" if self.cancelled else "completed",
+            "marks": [
+                [mark.stage, mark.index, round((mark.at - origin) * 1000, 2)]
+                for mark in self.marks
+            ],
+            "latency": self.latencies(),
+        }
+
+
+TimelineSink = Callable[[TurnTimeline], None]
+
+_current: ContextVar[Optional[TurnTimeline]] = ContextVar("turn_timeline", default=None)
+
+
+def current_timeline() -> Optional[TurnTimeline]:
+    return _current.get()
+
+
+def set_current(timeline: Optional[TurnTimeline]) -> None:
+    """Make ``timeline`` current for this task and the tasks it spawns."""
+
+    _current.set(timeline)
+
+
+def mark(stage: str, *, index: int = 0) -> None:
+    """Stamp ``stage`` on the current turn, if any."""
+
+    timeline = _current.get()
+    if timeline is not None:
+        timeline.mark(stage, index=index)
+
+
+class LatencyHistograms:
+    """Timeline sink aggregating derived latencies into histograms.
+
+    Sessions on several job threads feed one sink, so updates are locked.
+    """
+
+    def __init__(self) -> None:
+        self.histograms: Dict[str, LatencyHistogram] = {
+            name: LatencyHistogram() for name in LATENCIES
+        }
+        self.turns = 0
+        self.cancelled = 0
+        self._lock = threading.Lock()
+
+    def __call__(self, timeline: TurnTimeline) -> None:
+        latencies = timeline.latencies()
+        with self._lock:
+            self.turns += 1
+            self.cancelled += timeline.cancelled
+            for name, value in latencies.items():
+                self.histograms[name].observe(value)
+
+    def snapshot(self) -> Dict[str, Any]:
+        with self._lock:
+            return {
+                "turns": self.turns,
+                "cancelled": self.cancelled,
+                **{name: histogram.snapshot() for name, histogram in self.histograms.items()},
+            }
+
+
+def log_timeline(timeline: TurnTimeline) -> None:
+    """Timeline sink writing one JSON line per turn at DEBUG level."""
+
+    if logger.isEnabledFor(logging.DEBUG):
+        logger.debug("Turn timeline %s", json.dumps(timeline.as_dict(), ensure_ascii=False))
+
+
+@lru_cache()
+def get_latency_histograms() -> LatencyHistograms:
+    """Return the process-wide latency histograms fed by every agent session.
+
+    They are also exported as ``agent_turn_latency_seconds{latency}``.
+    """
+
+    sink = LatencyHistograms()
+    family = REGISTRY.histogram(
+        "agent_turn_latency_seconds", "Per-turn latencies of the voice agent", ("latency",)
+    )
+    for name, histogram in sink.histograms.items():
+        family.attach(histogram, latency=name.removesuffix("_ms"))
+    return sink
+
+
+__all__ = [
+    "CANCELLED",
+    "DIFY_FINAL",
+    "DIFY_FIRST_TOKEN",
+    "DIFY_REQUEST",
+    "FIRST_FRAME",
+    "LATENCIES",
+    "LatencyHistograms",
+    "Mark",
+    "PLAYBACK_END",
+    "SPEECH_END",
+    "STT_REQUEST",
+    "STT_RESPONSE",
+    "TTS_FIRST_BYTE",
+    "TTS_REQUEST",
+    "TURN_END",
+    "TimelineSink",
+    "TurnTimeline",
+    "current_timeline",
+    "get_latency_histograms",
+    "log_timeline",
+    "mark",
+    "set_current",
+]
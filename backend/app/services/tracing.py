@@ -0,0 +1,385 @@
+"""Minimal W3C Trace Context tracing with OTLP/JSON file export.
+
+A trace follows one user action across the browser, the API, the agent worker
+and the upstream services:
+
+* the frontend sends a ``traceparent`` header with every API call, or a
+  ``traceparent`` query parameter where a media element makes the request
+  and cannot set headers,
+* :class:`TracingMiddleware` continues it in a ``SERVER`` span per request,
+* :func:`~backend.app.services.metrics.upstream_call` opens a ``CLIENT`` span
+  per Dify/Bailian call, whose ``traceparent`` goes out with the request,
+* the voice agent starts a root span per user turn, so the STT, Dify and TTS
+  calls of a turn share one trace id.
+
+The current span lives in a :mod:`contextvars` variable; tasks spawned while
+it is current inherit it.  Client spans are deliberately *not* made current:
+they are opened inside async generators (streamed replies) whose cleanup may
+run in another context.
+
+Finished, sampled spans are batched and appended to ``TRACE_EXPORT_PATH`` as
+OTLP/JSON lines – the format written by the OpenTelemetry Collector's file
+exporter and read by its ``otlpjsonfile`` receiver, so the file can be
+replayed into any OTLP backend.  A background thread does the writing, so the
+event loop never waits on the file.  Without a path spans are still created
+and propagated, just not written.
+"""
+from __future__ import annotations
+
+import atexit
+import json
+import logging
+import os
+import queue
+import re
+import secrets
+import threading
+import time
+from contextlib import contextmanager
+from contextvars import ContextVar
+from functools import lru_cache
+from typing import Any, Awaitable, Callable, Dict, Iterator, List, MutableMapping, Optional, Tuple
+from urllib.parse import parse_qs
+
+from ..config import get_settings
+
+logger = logging.getLogger(__name__)
+
+# OTLP span kinds.
+INTERNAL = 1
+SERVER = 2
+CLIENT = 3
+
+_STATUS_ERROR = 2
+
+_TRACEPARENT = re.compile(r"^([0-9a-f]{2})-([0-9a-f]{32})-([0-9a-f]{16})-([0-9a-f]{2})(-.*)?$")
+_INVALID_TRACE_ID = "0" * 32
+_INVALID_SPAN_ID = "0" * 16
+
+
+class SpanContext:
+    """Identifiers propagated in the ``traceparent`` header."""
+
+    __slots__ = ("trace_id", "span_id", "sampled")
+
+    def __init__(self, trace_id: str, span_id: str, sampled: bool = True) -> None:
+        self.trace_id = trace_id
+        self.span_id = span_id
+        self.sampled = sampled
+
+    @property
+    def traceparent(self) -> str:
+        return f"00-{self.trace_id}-{self.span_id}-{'01' if self.sampled else '00'}"
+
+
+def parse_traceparent(header: Optional[str]) -> Optional[SpanContext]:
+    """Parse a ``traceparent`` header; ``None`` if absent or malformed."""
+
+    match = _TRACEPARENT.match((header or "").strip())
+    if match is None:
+        return None
+    version, trace_id, span_id, flags, rest = match.groups()
+    if version == "ff" or (version == "00" and rest):
+        return None
+    if trace_id == _INVALID_TRACE_ID or span_id == _INVALID_SPAN_ID:
+        return None
+    return SpanContext(trace_id, span_id, sampled=bool(int(flags, 16) & 1))
+
+
+class Span:
+    """One timed operation; call :meth:`end` exactly once."""
+
+    __slots__ = ("name", "kind", "context", "parent_id", "start_ns", "end_ns", "attributes", "status")
+
+    def __init__(
+        self,
+        name: str,
+        context: SpanContext,
+        *,
+        parent_id: Optional[str] = None,
+        kind: int = INTERNAL,
+        attributes: Optional[Dict[str, Any]] = None,
+    ) -> None:
+        self.name = name
+        self.kind = kind
+        self.context = context
+        self.parent_id = parent_id
+        self.start_ns = time.time_ns()
+        self.end_ns: Optional[int] = None
+        self.attributes: Dict[str, Any] = dict(attributes or {})
+        self.status: Optional[Tuple[int, str]] = None
+
+    @property
+    def traceparent(self) -> str:
+        return self.context.traceparent
+
+    def set_attribute(self, key: str, value: Any) -> None:
+        self.attributes[key] = value
+
+    def set_error(self, message: str) -> None:
+        self.status = (_STATUS_ERROR, message)
+
+    def end(self) -> None:
+        if self.end_ns is not None:
+            return
+        self.end_ns = time.time_ns()
+        if self.context.sampled:
+            get_span_exporter().export(self)
+
+    def to_otlp(self) -> Dict[str, Any]:
+        span: Dict[str, Any] = {
+            "traceId": self.context.trace_id,
+            "spanId": self.context.span_id,
+            "name": self.name,
+            "kind": self.kind,
+            "startTimeUnixNano": str(self.start_ns),
+            "endTimeUnixNano": str(self.end_ns or self.start_ns),
+            "attributes": [_otlp_attribute(key, value) for key, value in self.attributes.items()],
+        }
+        if self.parent_id:
+            span["parentSpanId"] = self.parent_id
+        if self.status is not None:
+            span["status"] = {"code": self.status[0], "message": self.status[1]}
+        return span
+
+
+def _otlp_attribute(key: str, value: Any) -> Dict[str, Any]:
+    if isinstance(value, bool):
+        typed = {"boolValue": value}
+    elif isinstance(value, int):
+        typed = {"intValue": str(value)}
+    elif isinstance(value, float):
+        typed = {"doubleValue": value}
+    else:
+        typed = {"stringValue": str(value)}
+    return {"key": key, "value": typed}
+
+
+_current: ContextVar[Optional[Span]] = ContextVar("current_span", default=None)
+
+
+def current_span() -> Optional[Span]:
+    return _current.get()
+
+
+def new_span(
+    name: str,
+    *,
+    kind: int = INTERNAL,
+    parent: Optional[SpanContext] = None,
+    attributes: Optional[Dict[str, Any]] = None,
+) -> Span:
+    """Start a span under ``parent`` (default: the current span) without
+    making it current."""
+
+    if parent is None:
+        current = _current.get()
+        parent = current.context if current is not None else None
+    if parent is None:
+        context = SpanContext(secrets.token_hex(16), secrets.token_hex(8))
+    else:
+        context = SpanContext(parent.trace_id, secrets.token_hex(8), parent.sampled)
+    return Span(
+        name,
+        context,
+        parent_id=parent.span_id if parent is not None else None,
+        kind=kind,
+        attributes=attributes,
+    )
+
+
+@contextmanager
+def start_span(
+    name: str,
+    *,
+    kind: int = INTERNAL,
+    parent: Optional[SpanContext] = None,
+    attributes: Optional[Dict[str, Any]] = None,
+) -> Iterator[Span]:
+    """Run the block in a new current span, recording exceptions as errors."""
+
+    span = new_span(name, kind=kind, parent=parent, attributes=attributes)
+    token = _current.set(span)
+    try:
+        yield span
+    except BaseException as exc:
+        span.set_error(type(exc).__name__)
+        raise
+    finally:
+        _current.reset(token)
+        span.end()
+
+
+def inject(headers: Dict[str, str], span: Optional[Span] = None) -> Dict[str, str]:
+    """Add the ``traceparent`` of ``span`` (default: current span) to ``headers``."""
+
+    span = span or _current.get()
+    if span is not None:
+        headers["traceparent"] = span.traceparent
+    return headers
+
+
+class SpanExporter:
+    """Discards spans; used when no export path is configured."""
+
+    def export(self, span: Span) -> None:
+        pass
+
+    def flush(self) -> None:
+        pass
+
+
+class FileSpanExporter(SpanExporter):
+    """Append finished spans to ``path`` as OTLP/JSON, ``batch_size`` at a time.
+
+    Full batches are handed to a daemon writer thread; :meth:`flush` queues
+    the partial batch and blocks until everything queued so far is written.
+    """
+
+    def __init__(self, path: str, *, service_name: str, batch_size: int = 64) -> None:
+        self.path = path
+        self.service_name = service_name
+        self.batch_size = max(1, batch_size)
+        self._spans: List[Span] = []
+        self._lock = threading.Lock()
+        self._batches: "queue.Queue[List[Span]]" = queue.Queue()
+        self._writer: Optional[threading.Thread] = None
+
+    def export(self, span: Span) -> None:
+        with self._lock:
+            self._spans.append(span)
+            if len(self._spans) < self.batch_size:
+                return
+            batch, self._spans = self._spans, []
+            self._submit(batch)
+
+    def flush(self) -> None:
+        with self._lock:
+            batch, self._spans = self._spans, []
+            if batch:
+                self._submit(batch)
+        self._batches.join()
+
+    def _submit(self, batch: List[Span]) -> None:
+        # Callers hold ``self._lock``.  Started lazily, and again after a fork.
+        if self._writer is None or not self._writer.is_alive():
+            self._writer = threading.Thread(
+                target=self._drain, name="span-exporter", daemon=True
+            )
+            self._writer.start()
+        self._batches.put(batch)
+
+    def _drain(self) -> None:
+        while True:
+            batch = self._batches.get()
+            try:
+                self._write(batch)
+            finally:
+                self._batches.task_done()
+
+    def _write(self, batch: List[Span]) -> None:
+        document = {
+            "resourceSpans": [
+                {
+                    "resource": {
+                        "attributes": [
+                            _otlp_attribute("service.name", self.service_name),
+                            _otlp_attribute("process.pid", os.getpid()),
+                        ]
+                    },
+                    "scopeSpans": [
+                        {
+                            "scope": {"name": __name__},
+                            "spans": [span.to_otlp() for span in batch],
+                        }
+                    ],
+                }
+            ]
+        }
+        line = json.dumps(document, ensure_ascii=False, separators=(",", ":"))
+        try:
+            with open(self.path, "a", encoding="utf-8") as handle:
+                handle.write(line + "\n")
+        except OSError as exc:
+            logger.warning("Failed to export %d spans to %s: %s", len(batch), self.path, exc)
+
+
+@lru_cache()
+def get_span_exporter() -> SpanExporter:
+    """Return the exporter configured by ``TRACE_EXPORT_PATH``."""
+
+    settings = get_settings()
+    if not settings.trace_export_path:
+        return SpanExporter()
+    exporter = FileSpanExporter(
+        settings.trace_export_path,
+        service_name=settings.trace_service_name,
+        batch_size=settings.trace_export_batch_size,
+    )
+    atexit.register(exporter.flush)
+    return exporter
+
+
+Scope = MutableMapping[str, Any]
+Message = MutableMapping[str, Any]
+ASGIApp = Callable[..., Awaitable[None]]
+
+
+def _query_traceparent(scope: Scope) -> Optional[str]:
+    query = parse_qs(scope.get("query_string", b"").decode("latin-1"))
+    values = query.get("traceparent")
+    return values[0] if values else None
+
+
+class TracingMiddleware:
+    """ASGI middleware continuing the caller's trace in a ``SERVER`` span.
+
+    The parent comes from the ``traceparent`` header, falling back to a
+    ``traceparent`` query parameter for requests made by ``<audio src>``.
+    """
+
+    def __init__(self, app: ASGIApp) -> None:
+        self.app = app
+
+    async def __call__(self, scope: Scope, receive: Any, send: Any) -> None:
+        if scope["type"] not in ("http", "websocket"):
+            await self.app(scope, receive, send)
+            return
+
+        headers = dict(scope.get("headers") or [])
+        header = headers.get(b"traceparent", b"").decode("latin-1")
+        parent = parse_traceparent(header or _query_traceparent(scope))
+        method = scope.get("method", "WS")
+        attributes = {"http.method": method, "http.target": scope.get("path", "")}
+
+        with start_span(
+            f"{method} {scope.get('path', '')}", kind=SERVER, parent=parent, attributes=attributes
+        ) as span:
+
+            async def _send(message: Message) -> None:
+                if message["type"] == "http.response.start":
+                    status = message["status"]
+                    span.set_attribute("http.status_code", status)
+                    if status >= 500:
+                        span.set_error(f"HTTP {status}")
+                await send(message)
+
+            await self.app(scope, receive, _send)
+
+
+__all__ = [
+    "CLIENT",
+    "FileSpanExporter",
+    "INTERNAL",
+    "SERVER",
+    "Span",
+    "SpanContext",
+    "SpanExporter",
+    "TracingMiddleware",
+    "current_span",
+    "get_span_exporter",
+    "inject",
+    "new_span",
+    "parse_traceparent",
+    "start_span",
+]
@@ -0,0 +1,191 @@
+"""In-process LRU cache for synthesized speech.
+
+Assistants repeat themselves a lot (greetings, "请稍等", error messages, FAQ
+answers), so identical TTS requests are served from memory instead of going
+back to Bailian.  Entries are keyed by ``(normalised text, voice, format)`` and
+the cache is bounded by the total number of audio bytes it holds; the least
+recently used clips are evicted first.  An optional
+:class:`~backend.app.services.tts_store.DiskTTSStore` acts as a second,
+persistent tier shared by every worker on the host.  Agent jobs may run on
+several threads of one process, so the memory tier is guarded by a lock.
+"""
+from __future__ import annotations
+
+import asyncio
+import re
+import threading
+import unicodedata
+from collections import OrderedDict
+from functools import lru_cache
+from typing import Callable, Dict, Optional, Tuple
+
+from ..config import get_settings
+from .metrics import REGISTRY
+from .tts_store import CacheKey, DiskTTSStore, key_digest
+
+_WHITESPACE = re.compile(r"\s+")
+
+
+def normalize_text(text: str) -> str:
+    """Fold width variants and collapse whitespace so equivalent texts match."""
+
+    return _WHITESPACE.sub(" ", unicodedata.normalize("NFKC", text)).strip()
+
+
+def cache_key(
+    text: str, voice: Optional[str], audio_format: str, sample_rate: Optional[int] = None
+) -> CacheKey:
+    audio_format = audio_format.lower()
+    if sample_rate:
+        audio_format = f"{audio_format}@{sample_rate}"
+    return (normalize_text(text), voice or "", audio_format)
+
+
+def audio_etag(key: CacheKey) -> str:
+    """HTTP validator for a clip; weak because re-synthesis may differ bytewise."""
+
+    return f'W/"{key_digest(key)[:32]}"'
+
+
+class TTSCache:
+    """Byte-budgeted LRU mapping of cache keys to raw audio bytes."""
+
+    def __init__(self, max_bytes: int, *, disk: Optional[DiskTTSStore] = None) -> None:
+        self.max_bytes = max_bytes
+        self.disk = disk
+        self._entries: "OrderedDict[CacheKey, bytes]" = OrderedDict()
+        self.size_bytes = 0
+        self.hits = 0
+        self.misses = 0
+        self.evictions = 0
+        self._lock = threading.Lock()
+
+    def __len__(self) -> int:
+        return len(self._entries)
+
+    def _lookup(self, key: CacheKey) -> Optional[bytes]:
+        """Memory-tier lookup counting a hit; ``None`` leaves the counters alone."""
+
+        with self._lock:
+            audio = self._entries.get(key)
+            if audio is not None:
+                self._entries.move_to_end(key)
+                self.hits += 1
+            return audio
+
+    def _promote(self, key: CacheKey, audio: Optional[bytes]) -> Optional[bytes]:
+        """Count the outcome of a disk lookup and keep found audio in memory."""
+
+        with self._lock:
+            if audio is None:
+                self.misses += 1
+                return None
+            self._remember(key, audio)
+            self.hits += 1
+            return audio
+
+    def get(self, key: CacheKey) -> Optional[bytes]:
+        audio = self._lookup(key)
+        if audio is not None:
+            return audio
+        return self._promote(key, self.disk.get(key) if self.disk is not None else None)
+
+    def put(self, key: CacheKey, audio: bytes) -> None:
+        if self.disk is not None:
+            self.disk.put(key, audio)
+        with self._lock:
+            self._remember(key, audio)
+
+    async def aget(self, key: CacheKey) -> Optional[bytes]:
+        """:meth:`get` for event-loop callers; disk reads run in a worker thread."""
+
+        audio = self._lookup(key)
+        if audio is not None:
+            return audio
+        if self.disk is None:
+            return self._promote(key, None)
+        return self._promote(key, await asyncio.to_thread(self.disk.get, key))
+
+    async def aput(self, key: CacheKey, audio: bytes) -> None:
+        """:meth:`put` for event-loop callers; disk writes run in a worker thread."""
+
+        with self._lock:
+            self._remember(key, audio)
+        if self.disk is not None:
+            await asyncio.to_thread(self.disk.put, key, audio)
+
+    def _remember(self, key: CacheKey, audio: bytes) -> None:
+        # Callers hold ``self._lock``.
+        if len(audio) > self.max_bytes:
+            return  # would evict everything and still not fit
+        previous = self._entries.pop(key, None)
+        if previous is not None:
+            self.size_bytes -= len(previous)
+        self._entries[key] = audio
+        self.size_bytes += len(audio)
+        while self.size_bytes > self.max_bytes:
+            _, evicted = self._entries.popitem(last=False)
+            self.size_bytes -= len(evicted)
+            self.evictions += 1
+
+    def clear(self) -> None:
+        with self._lock:
+            self._entries.clear()
+            self.size_bytes = 0
+
+    def stats(self) -> Dict[str, float]:
+        with self._lock:
+            lookups = self.hits + self.misses
+            stats = {
+                "entries": len(self._entries),
+                "bytes": self.size_bytes,
+                "max_bytes": self.max_bytes,
+                "hits": self.hits,
+                "misses": self.misses,
+                "evictions": self.evictions,
+                "hit_ratio": self.hits / lookups if lookups else 0.0,
+            }
+        if self.disk is not None:
+            stats["disk"] = self.disk.stats()
+        return stats
+
+
+@lru_cache()
+def get_tts_cache() -> Optional[TTSCache]:
+    """Return the process-wide TTS cache, or ``None`` when it is disabled."""
+
+    settings = get_settings()
+    disk = None
+    if settings.tts_disk_cache_dir:
+        disk = DiskTTSStore(
+            settings.tts_disk_cache_dir,
+            max_bytes=settings.tts_disk_cache_max_bytes,
+            max_age=settings.tts_disk_cache_max_age,
+        )
+    if settings.tts_cache_max_bytes <= 0 and disk is None:
+        return None
+    return TTSCache(max(settings.tts_cache_max_bytes, 0), disk=disk)
+
+
+def _cache_stat(name: str) -> Callable[[], Dict[Tuple[str, ...], float]]:
+    def _read() -> Dict[Tuple[str, ...], float]:
+        cache = get_tts_cache()
+        return {(): cache.stats()[name]} if cache is not None else {}
+
+    return _read
+
+
+for _stat, _help in (
+    ("hits", "TTS cache lookups answered from memory or disk"),
+    ("misses", "TTS cache lookups that went to Bailian"),
+    ("evictions", "Clips evicted from the in-memory TTS cache"),
+):
+    REGISTRY.counter(f"tts_cache_{_stat}_total", _help, function=_cache_stat(_stat))
+for _stat, _help in (
+    ("hit_ratio", "Share of TTS cache lookups that were hits"),
+    ("bytes", "Audio bytes held in the in-memory TTS cache"),
+):
+    REGISTRY.gauge(f"tts_cache_{_stat}", _help, function=_cache_stat(_stat))
+
+
+__all__ = ["TTSCache", "audio_etag", "cache_key", "normalize_text", "get_tts_cache"]
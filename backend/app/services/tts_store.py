@@ -0,0 +1,194 @@
+"""Persistent, content-addressed disk tier for synthesized speech.
+
+Clips are stored as ``<dir>/<hh>/<sha256>.<format>`` where the digest is
+derived from the TTS cache key, so every uvicorn worker on a host resolves the
+same request to the same file.  Writes go to a temporary file in the target
+directory followed by :func:`os.replace`, which makes them atomic for
+concurrent readers.  Temporary files left behind by a crash between the
+write and the rename are swept when a store is opened.  Every method does
+blocking file I/O; event-loop callers go through
+:meth:`TTSCache.aget <backend.app.services.tts_cache.TTSCache.aget>` and
+``aput``, which run them in a worker thread.
+
+Reads are a plain ``read()`` rather than :mod:`mmap`: a hit is promoted into
+the in-process memory tier as ``bytes``, so a mapping would be copied out in
+full anyway, while the kernel page cache is shared between workers either
+way.  A mapping would also fault (``SIGBUS``) if another worker truncated the
+file mid-read.
+
+Eviction removes files whose modification time is older than ``max_age`` and
+then the least recently used files until the directory fits ``max_bytes``.
+Hits refresh the modification time (at most once per ``touch_interval``) so it
+doubles as a cross-process "last used" marker.
+"""
+from __future__ import annotations
+
+import hashlib
+import logging
+import os
+import tempfile
+import threading
+import time
+from pathlib import Path
+from typing import Dict, List, Optional, Tuple
+
+logger = logging.getLogger(__name__)
+
+CacheKey = Tuple[str, str, str]
+
+# Temporary files younger than this may still be written by another worker.
+STALE_TMP_SECONDS = 600.0
+
+
+def key_digest(key: CacheKey) -> str:
+    """Stable hex digest identifying a ``(text, voice, format)`` cache key."""
+
+    return hashlib.sha256("\x1f".join(key).encode("utf-8")).hexdigest()
+
+
+class DiskTTSStore:
+    """Size- and age-bounded directory of synthesized audio files."""
+
+    def __init__(
+        self,
+        directory: "str | os.PathLike[str]",
+        *,
+        max_bytes: int,
+        max_age: float,
+        touch_interval: float = 60.0,
+        evict_every: int = 32,
+    ) -> None:
+        self.directory = Path(directory)
+        self.directory.mkdir(parents=True, exist_ok=True)
+        self.max_bytes = max_bytes
+        self.max_age = max_age
+        self.touch_interval = touch_interval
+        self.evict_every = max(1, evict_every)
+        self.hits = 0
+        self.misses = 0
+        self.writes = 0
+        self.evictions = 0
+        self._written_since_scan = 0
+        # Guards the counters and serialises eviction scans across threads.
+        self._lock = threading.Lock()
+        self.sweep_temporary()
+
+    def path_for(self, key: CacheKey) -> Path:
+        digest = key_digest(key)
+        suffix = "".join(ch for ch in key[2] if ch.isalnum()) or "bin"
+        return self.directory / digest[:2] / f"{digest}.{suffix}"
+
+    def get(self, key: CacheKey) -> Optional[bytes]:
+        """Return the stored clip for ``key`` or ``None`` on a miss."""
+
+        path = self.path_for(key)
+        try:
+            with open(path, "rb") as handle:
+                stat = os.fstat(handle.fileno())
+                if stat.st_size == 0 or time.time() - stat.st_mtime > self.max_age:
+                    return self._miss()
+                audio = handle.read()
+        except FileNotFoundError:
+            return self._miss()
+        except OSError as exc:  # pragma: no cover - depends on filesystem
+            logger.warning("Failed to read cached TTS clip %s: %s", path, exc)
+            return self._miss()
+
+        if time.time() - stat.st_mtime > self.touch_interval:
+            try:
+                os.utime(path)
+            except OSError:  # pragma: no cover - evicted concurrently
+                pass
+        with self._lock:
+            self.hits += 1
+        return audio
+
+    def _miss(self) -> None:
+        with self._lock:
+            self.misses += 1
+
+    def put(self, key: CacheKey, audio: bytes) -> None:
+        """Atomically persist ``audio`` under ``key``."""
+
+        if not audio or len(audio) > self.max_bytes:
+            return
+        path = self.path_for(key)
+        path.parent.mkdir(parents=True, exist_ok=True)
+        fd, tmp_name = tempfile.mkstemp(dir=path.parent, prefix=".tmp-")
+        try:
+            with os.fdopen(fd, "wb") as handle:
+                handle.write(audio)
+            os.replace(tmp_name, path)
+        except BaseException:
+            try:
+                os.unlink(tmp_name)
+            except OSError:
+                pass
+            raise
+        with self._lock:
+            self.writes += 1
+            self._written_since_scan += 1
+            due = self._written_since_scan >= self.evict_every
+        if due:
+            self.evict()
+
+    def sweep_temporary(self) -> int:
+        """Delete stale ``.tmp-*`` files of interrupted writes; return how many."""
+
+        removed = 0
+        deadline = time.time() - STALE_TMP_SECONDS
+        for path in self.directory.glob("*/.tmp-*"):
+            try:
+                if path.stat().st_mtime < deadline:
+                    path.unlink()
+                    removed += 1
+            except FileNotFoundError:
+                continue  # renamed or swept by another worker
+        if removed:
+            logger.info("Removed %d stale temporary TTS files from %s", removed, self.directory)
+        return removed
+
+    def _scan(self) -> List[Tuple[float, int, Path]]:
+        entries = []
+        for path in self.directory.glob("*/*"):
+            if path.name.startswith(".tmp-"):
+                continue
+            try:
+                stat = path.stat()
+            except FileNotFoundError:
+                continue
+            entries.append((stat.st_mtime, stat.st_size, path))
+        return entries
+
+    def evict(self) -> int:
+        """Remove expired and least recently used files; return how many."""
+
+        with self._lock:
+            self._written_since_scan = 0
+            entries = sorted(self._scan())
+            now = time.time()
+            total = sum(size for _, size, _ in entries)
+            removed = 0
+            for mtime, size, path in entries:
+                if now - mtime <= self.max_age and total <= self.max_bytes:
+                    break
+                try:
+                    path.unlink()
+                except FileNotFoundError:
+                    pass  # another worker got there first
+                total -= size
+                removed += 1
+            self.evictions += removed
+        return removed
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "hits": self.hits,
+            "misses": self.misses,
+            "writes": self.writes,
+            "evictions": self.evictions,
+            "max_bytes": self.max_bytes,
+        }
+
+
+__all__ = ["DiskTTSStore", "CacheKey", "key_digest"]
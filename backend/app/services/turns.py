@@ -0,0 +1,270 @@
+"""Ownership of the assistant's reply turn and barge-in handling.
+
+Cancelling the asyncio task of a reply is not enough on its own: Dify keeps
+generating (and burning GPU time) until told to stop, and audio already handed
+to LiveKit keeps playing.  :class:`TurnController` runs one reply at a time and
+on :meth:`~TurnController.interrupt`
+
+1. flushes audio queued for playback,
+2. cancels the reply task, which unwinds the Dify SSE stream and any Bailian
+   TTS request in flight and closes their connections,
+3. asks Dify to stop the generation using the ``task_id`` seen in the stream,
+   in the background so the next turn is not delayed,
+
+and reports the *cancel-to-silence* latency: the time from detecting the user's
+speech until playback is flushed and every upstream call has been torn down.
+
+In rooms with several participants every speaker gets their own controller,
+so one person talking never cancels another person's reply.  A
+:class:`RoomScheduler` shared by the room then decides *when* turns run:
+
+* at most ``max_concurrent`` turns (transcription, Dify and TTS calls) are in
+  flight per room; further turns wait,
+* waiting turns are admitted least-recently-served speaker first, and a
+  speaker has at most one waiting turn (a newer one replaces it), so a noisy
+  participant cannot starve the others,
+* the agent has a single voice: a turn takes the *floor* when it plays its
+  first sentence and keeps it until its reply is finished, so replies are
+  never interleaved.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import time
+from contextlib import asynccontextmanager
+from dataclasses import dataclass
+from typing import (
+    Any,
+    AsyncIterator,
+    Awaitable,
+    Callable,
+    Coroutine,
+    Dict,
+    Optional,
+    Set,
+    TypeVar,
+)
+
+logger = logging.getLogger(__name__)
+
+T = TypeVar("T")
+AudioT = TypeVar("AudioT")
+
+
+@dataclass
+class Interruption:
+    """Outcome of one barge-in."""
+
+    cancel_to_silence_ms: float
+    dify_task_id: Optional[str]
+
+
+class TurnController:
+    """Run reply turns one at a time and tear them down on barge-in."""
+
+    def __init__(
+        self,
+        *,
+        stop_generation: Callable[[str, Optional[str]], Awaitable[Any]],
+        flush_playback: Callable[[], None] = lambda: None,
+        on_interrupted: Optional[Callable[[Interruption], Awaitable[None]]] = None,
+    ) -> None:
+        self._stop_generation = stop_generation
+        self._flush_playback = flush_playback
+        self._on_interrupted = on_interrupted
+        self._task: Optional["asyncio.Task[None]"] = None
+        self._dify_task_id: Optional[str] = None
+        self._dify_user: Optional[str] = None
+        self._background: Set["asyncio.Task[Any]"] = set()
+        self.interruptions = 0
+
+    @property
+    def active(self) -> bool:
+        return self._task is not None and not self._task.done()
+
+    async def start(self, reply: Coroutine[Any, Any, None]) -> "asyncio.Task[None]":
+        """Run ``reply`` as the current turn; interrupt the previous one first."""
+
+        try:
+            await self.interrupt()
+        except BaseException:
+            reply.close()  # never scheduled, so never awaited
+            raise
+        self._dify_task_id = None
+        self._task = asyncio.create_task(reply)
+        return self._task
+
+    def track_generation(self, task_id: Optional[str], user: Optional[str] = None) -> None:
+        """Remember the Dify ``task_id`` (and its user) of the reply being streamed."""
+
+        if task_id:
+            self._dify_task_id, self._dify_user = task_id, user
+
+    async def interrupt(self, detected_at: Optional[float] = None) -> Optional[Interruption]:
+        """Silence and cancel the current turn; ``None`` if nothing was running.
+
+        ``detected_at`` is the :func:`time.monotonic` timestamp at which the
+        user's speech was detected and defaults to now.
+        """
+
+        detected_at = time.monotonic() if detected_at is None else detected_at
+        task, task_id, user = self._task, self._dify_task_id, self._dify_user
+        if task is None or task.done():
+            return None
+        self._task = self._dify_task_id = None
+
+        self._flush_playback()
+        task.cancel()
+        try:
+            await task
+        except asyncio.CancelledError:
+            pass
+        except Exception:  # pragma: no cover - the turn failed while cancelling
+            logger.exception("Reply turn failed during barge-in")
+        self._flush_playback()  # anything the player queued while unwinding
+        elapsed = (time.monotonic() - detected_at) * 1000
+
+        if task_id:
+            stop = asyncio.create_task(self._stop_generation(task_id, user))
+            self._background.add(stop)
+            stop.add_done_callback(self._background.discard)
+
+        self.interruptions += 1
+        interruption = Interruption(cancel_to_silence_ms=elapsed, dify_task_id=task_id)
+        logger.info(
+            "Barge-in: silent after %.1f ms (Dify task %s)", elapsed, task_id or "not started"
+        )
+        if self._on_interrupted is not None:
+            await self._on_interrupted(interruption)
+        return interruption
+
+    async def aclose(self) -> None:
+        """Interrupt the current turn and wait for pending stop requests."""
+
+        await self.interrupt()
+        if self._background:
+            await asyncio.gather(*self._background, return_exceptions=True)
+
+
+class RoomScheduler:
+    """Fair admission of reply turns and a single playback floor per room."""
+
+    def __init__(
+        self, *, max_concurrent: int = 2, clock: Callable[[], float] = time.monotonic
+    ) -> None:
+        self.max_concurrent = max(1, max_concurrent)
+        self._clock = clock
+        self._running = 0
+        # Speaker -> admission future; dict order is arrival order.
+        self._waiting: Dict[str, "asyncio.Future[None]"] = {}
+        self._last_admitted: Dict[str, float] = {}
+        self._floor = asyncio.Lock()
+        self.floor_owner: Optional[str] = None
+        self.admitted = 0
+        self.replaced = 0
+        self.max_wait_ms = 0.0
+
+    @property
+    def running(self) -> int:
+        return self._running
+
+    @property
+    def waiting(self) -> int:
+        return len(self._waiting)
+
+    async def run(
+        self,
+        speaker: str,
+        reply: Coroutine[Any, Any, T],
+        *,
+        on_queued: Optional[Callable[[], None]] = None,
+    ) -> T:
+        """Await ``reply`` once the room has capacity for ``speaker``'s turn.
+
+        ``on_queued`` is called when the turn has to wait for a slot, e.g. to
+        copy audio that would not survive the wait.
+        """
+
+        try:
+            await self._admit(speaker, on_queued)
+        except BaseException:
+            reply.close()
+            raise
+        try:
+            return await reply
+        finally:
+            self._release()
+
+    async def _admit(self, speaker: str, on_queued: Optional[Callable[[], None]]) -> None:
+        queued_at = self._clock()
+        if self._running < self.max_concurrent and not self._waiting:
+            self._running += 1
+        else:
+            if on_queued is not None:
+                on_queued()
+            previous = self._waiting.pop(speaker, None)
+            if previous is not None:
+                self.replaced += 1
+                previous.cancel()  # the newer turn from the same speaker wins
+            admission = asyncio.get_running_loop().create_future()
+            self._waiting[speaker] = admission
+            try:
+                await admission
+            except asyncio.CancelledError:
+                if self._waiting.get(speaker) is admission:
+                    del self._waiting[speaker]
+                elif admission.done() and not admission.cancelled():
+                    self._release()  # admitted, then cancelled before running
+                raise
+        waited = (self._clock() - queued_at) * 1000
+        self.max_wait_ms = max(self.max_wait_ms, waited)
+        self._last_admitted[speaker] = self._clock()
+        self.admitted += 1
+        if waited >= 1:
+            logger.debug("Turn of %s waited %.0f ms for a free slot", speaker, waited)
+
+    def _release(self) -> None:
+        self._running -= 1
+        while self._running < self.max_concurrent and self._waiting:
+            # Least recently served speaker first; ties keep arrival order.
+            speaker = min(self._waiting, key=lambda s: self._last_admitted.get(s, float("-inf")))
+            admission = self._waiting.pop(speaker)
+            if not admission.done():
+                self._running += 1
+                admission.set_result(None)
+
+    @asynccontextmanager
+    async def voice(
+        self, speaker: str, play: Callable[[AudioT], Awaitable[None]]
+    ) -> AsyncIterator[Callable[[AudioT], Awaitable[None]]]:
+        """Wrap ``play`` so the first call takes the room's floor for this turn."""
+
+        held = False
+
+        async def _play(audio: AudioT) -> None:
+            nonlocal held
+            if not held:
+                await self._floor.acquire()
+                held = True
+                self.floor_owner = speaker
+            await play(audio)
+
+        try:
+            yield _play
+        finally:
+            if held:
+                self.floor_owner = None
+                self._floor.release()
+
+    def stats(self) -> Dict[str, float]:
+        return {
+            "running": self._running,
+            "waiting": len(self._waiting),
+            "admitted": self.admitted,
+            "replaced": self.replaced,
+            "max_wait_ms": round(self.max_wait_ms, 1),
+        }
+
+
+__all__ = ["Interruption", "RoomScheduler", "TurnController"]
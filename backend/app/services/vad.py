@@ -0,0 +1,344 @@
+"""Server-side voice activity detection for the LiveKit agent.
+
+Incoming PCM is cut into fixed-size frames which are classified as speech or
+non-speech in one vectorised NumPy pass.  A small state machine then turns the
+per-frame decisions into utterances:
+
+* ``pre_roll_ms`` of audio before the first speech frame is kept so word
+  onsets are not clipped,
+* speech ends only after ``hangover_ms`` of continuous silence, or when an
+  ``end_of_turn`` hook (see :mod:`.endpointing`) decides the trailing silence
+  is long enough,
+* segments shorter than ``min_speech_ms`` (clicks, coughs) are dropped and
+  segments longer than ``max_utterance_ms`` are force-split.
+
+The default classifier combines frame energy against an adaptive noise floor
+with the zero-crossing rate.  Any callable with the
+:class:`SpeechClassifier` signature can be plugged in instead, for example the
+optional ``webrtcvad`` model via :class:`WebRTCClassifier`.
+"""
+from __future__ import annotations
+
+from dataclasses import dataclass, field, replace
+from typing import Any, Awaitable, Callable, Iterable, Iterator, List, Optional, Tuple
+
+import numpy as np
+
+from ..config import Settings
+from .audio_buffer import PCMInput, PCMRingBuffer
+
+# (frames[int16, shape=(n, frame_len)], sample_rate) -> bool[n]
+SpeechClassifier = Callable[[np.ndarray, int], np.ndarray]
+# Executor-style runner: ``await run(fn, frames, *args)`` returns ``fn(frames, *args)``.
+TransformRunner = Callable[..., Awaitable[Any]]
+
+
+class EnergyZCRClassifier:
+    """Energy + zero-crossing speech classifier with an adaptive noise floor.
+
+    A frame counts as speech when its energy is ``margin_db`` above the
+    tracked noise floor (and above ``min_db``).  Frames that only barely clear
+    the threshold must also have a zero-crossing rate below ``max_zcr``, which
+    rejects broadband hiss while keeping voiced speech.
+    """
+
+    def __init__(
+        self,
+        *,
+        margin_db: float = 12.0,
+        min_db: float = -50.0,
+        max_zcr: float = 0.35,
+        floor_adapt: float = 0.05,
+        initial_floor_db: float = -60.0,
+    ) -> None:
+        self.margin_db = margin_db
+        self.min_db = min_db
+        self.max_zcr = max_zcr
+        self.floor_adapt = floor_adapt
+        self.noise_floor_db = initial_floor_db
+
+    def __call__(self, frames: np.ndarray, sample_rate: int) -> np.ndarray:
+        del sample_rate  # energy/ZCR features are rate independent
+        samples = frames.astype(np.float32) * (1.0 / 32768.0)
+        energy_db = 10.0 * np.log10(np.mean(samples * samples, axis=1) + 1e-10)
+        signs = np.signbit(samples)
+        zcr = np.count_nonzero(signs[:, 1:] != signs[:, :-1], axis=1) / max(frames.shape[1] - 1, 1)
+
+        threshold = max(self.noise_floor_db + self.margin_db, self.min_db)
+        loud = energy_db > threshold
+        clearly_loud = energy_db > threshold + self.margin_db
+        speech = loud & (clearly_loud | (zcr < self.max_zcr))
+
+        # Track the floor slowly upwards but follow drops immediately.  Chunks
+        # without any quiet frame still nudge it so stationary loud noise is
+        # eventually absorbed instead of being treated as endless speech.
+        quiet = energy_db[~speech]
+        if quiet.size:
+            target, rate = float(np.median(quiet)), self.floor_adapt
+        else:
+            target, rate = float(energy_db.min()), self.floor_adapt * 0.1
+        if target < self.noise_floor_db:
+            self.noise_floor_db = target
+        else:
+            self.noise_floor_db += rate * (target - self.noise_floor_db)
+        return speech
+
+
+class WebRTCClassifier:
+    """Adapter for the optional ``webrtcvad`` package."""
+
+    def __init__(self, aggressiveness: int = 2) -> None:
+        try:
+            import webrtcvad
+        except Exception as exc:  # pragma: no cover - optional dependency
+            raise RuntimeError("Install 'webrtcvad' to use the WebRTC VAD model.") from exc
+        self.aggressiveness = aggressiveness
+        self._vad = webrtcvad.Vad(aggressiveness)
+
+    def __reduce__(self) -> Tuple[Any, ...]:
+        return WebRTCClassifier, (self.aggressiveness,)
+
+    def __call__(self, frames: np.ndarray, sample_rate: int) -> np.ndarray:  # pragma: no cover
+        return np.fromiter(
+            (self._vad.is_speech(frame.tobytes(), sample_rate) for frame in frames),
+            dtype=bool,
+            count=len(frames),
+        )
+
+
+def classify_detached(
+    frames: np.ndarray, classifier: SpeechClassifier, sample_rate: int
+) -> Tuple[np.ndarray, SpeechClassifier]:
+    """Classify ``frames`` and return the (possibly copied) classifier too.
+
+    Classifiers adapt to the noise floor, so a process-pool job must hand its
+    updated copy back; see :meth:`VoiceActivityDetector.process_with`.
+    """
+
+    return np.asarray(classifier(frames, sample_rate), dtype=bool), classifier
+
+
+@dataclass
+class Utterance:
+    """A contiguous speech segment ready for recognition.
+
+    ``pcm`` is a read-only view into the track's :class:`PCMRingBuffer`; it
+    stays valid until the buffer wraps past it (see :attr:`valid`).  Call
+    :meth:`detach` to keep the audio for longer.
+    """
+
+    pcm: np.ndarray
+    sample_rate: int
+    start_ms: int
+    end_ms: int
+    buffer: Optional[PCMRingBuffer] = field(default=None, repr=False, compare=False)
+    start_sample: int = field(default=0, repr=False, compare=False)
+
+    @property
+    def duration_ms(self) -> int:
+        return self.end_ms - self.start_ms
+
+    @property
+    def valid(self) -> bool:
+        """Whether ``pcm`` still holds this utterance's audio."""
+
+        return self.buffer is None or self.buffer.contains(self.start_sample)
+
+    def detach(self) -> "Utterance":
+        """Return this utterance with a private copy of its samples."""
+
+        if self.buffer is None or not self.valid:
+            return self
+        return replace(self, pcm=self.pcm.copy(), buffer=None)
+
+
+class VoiceActivityDetector:
+    """Segment a mono int16 PCM stream into utterances.
+
+    Samples are written once into a :class:`PCMRingBuffer`; frames and
+    utterances are views into it, so the detector never concatenates audio.
+    The buffer holds ``buffer_ms`` of audio (at least one maximal utterance
+    plus pre-roll and a second of slack).
+    """
+
+    def __init__(
+        self,
+        *,
+        sample_rate: int = 16000,
+        frame_ms: int = 20,
+        pre_roll_ms: int = 200,
+        hangover_ms: int = 500,
+        min_speech_ms: int = 200,
+        max_utterance_ms: int = 15000,
+        buffer_ms: int = 30000,
+        classifier: Optional[SpeechClassifier] = None,
+        end_of_turn: Optional[Callable[[int], bool]] = None,
+        on_pause: Optional[Callable[[int], None]] = None,
+    ) -> None:
+        self.sample_rate = sample_rate
+        self.frame_ms = frame_ms
+        self.frame_len = sample_rate * frame_ms // 1000
+        self.hangover_frames = max(1, hangover_ms // frame_ms)
+        # ``end_of_turn(silence_ms)`` replaces the fixed hangover and
+        # ``on_pause(pause_ms)`` reports silences the speaker talked through.
+        self.end_of_turn = end_of_turn
+        self.on_pause = on_pause
+        self.min_speech_frames = max(1, min_speech_ms // frame_ms)
+        self.max_samples = max(1, max_utterance_ms // frame_ms) * self.frame_len
+        self.pre_roll_samples = max(0, pre_roll_ms // frame_ms) * self.frame_len
+        self.classifier = classifier or EnergyZCRClassifier()
+
+        buffer_ms = max(buffer_ms, max_utterance_ms + pre_roll_ms + 1000)
+        self.buffer = PCMRingBuffer(sample_rate * buffer_ms // 1000, sample_rate=sample_rate)
+        self._cursor = 0  # next sample to classify
+        self._floor = 0  # pre-roll never reaches back past the previous utterance
+        self._start = 0
+        self._speech_frames = 0
+        self._silence_run = 0
+        self.speaking = False
+
+    def process(self, pcm: PCMInput) -> List[Utterance]:
+        """Feed PCM samples and return the utterances completed by them."""
+
+        utterances: List[Utterance] = []
+        for frames in self._frame_blocks(pcm):
+            utterances.extend(self._apply(self.classifier(frames, self.sample_rate)))
+        return utterances
+
+    async def process_with(self, run: TransformRunner, pcm: PCMInput) -> List[Utterance]:
+        """Like :meth:`process`, but classify frames through ``run``.
+
+        ``run`` is typically :meth:`AudioExecutor.run`, moving classification
+        off the event loop; the state machine and its end-of-turn hooks stay
+        on the caller's loop.
+        """
+
+        utterances: List[Utterance] = []
+        for frames in self._frame_blocks(pcm):
+            decisions, self.classifier = await run(
+                classify_detached, frames, self.classifier, self.sample_rate
+            )
+            utterances.extend(self._apply(decisions))
+        return utterances
+
+    def _frame_blocks(self, pcm: PCMInput) -> Iterator[np.ndarray]:
+        samples = pcm if isinstance(pcm, np.ndarray) else np.frombuffer(pcm, dtype=np.int16)
+        # Large chunks are written in blocks so unclassified audio is never
+        # overwritten before the classifier has seen it.
+        block = self.buffer.capacity // 2
+        for offset in range(0, samples.size, block):
+            self.buffer.write(samples[offset : offset + block])
+            ready = (self.buffer.written - self._cursor) // self.frame_len
+            if ready:
+                frames = self.buffer.view(self._cursor, self._cursor + ready * self.frame_len)
+                yield frames.reshape(-1, self.frame_len)
+
+    def _apply(self, decisions: Iterable[bool]) -> List[Utterance]:
+        utterances: List[Utterance] = []
+        for is_speech in decisions:
+            utterance = self._step(bool(is_speech))
+            if utterance is not None:
+                utterances.append(utterance)
+        return utterances
+
+    def flush(self) -> List[Utterance]:
+        """Close any open segment, e.g. when the track ends."""
+
+        utterance = self._finish() if self.speaking else None
+        self._cursor = self._floor = self.buffer.written  # drop the partial frame
+        return [utterance] if utterance is not None else []
+
+    def _step(self, is_speech: bool) -> Optional[Utterance]:
+        frame_start = self._cursor
+        self._cursor += self.frame_len
+        if not self.speaking:
+            if not is_speech:
+                return None
+            self.speaking = True
+            self._start = max(frame_start - self.pre_roll_samples, self._floor, self.buffer.oldest)
+            self._speech_frames = 0
+            self._silence_run = 0
+
+        if is_speech:
+            if self._silence_run and self.on_pause is not None:
+                self.on_pause(self._silence_run * self.frame_ms)
+            self._speech_frames += 1
+            self._silence_run = 0
+        else:
+            self._silence_run += 1
+
+        if self._cursor - self._start >= self.max_samples or (
+            self._silence_run and self._turn_ended()
+        ):
+            return self._finish()
+        return None
+
+    def _turn_ended(self) -> bool:
+        if self.end_of_turn is not None:
+            return self.end_of_turn(self._silence_run * self.frame_ms)
+        return self._silence_run >= self.hangover_frames
+
+    @property
+    def active_pcm(self) -> np.ndarray:
+        """Audio of the segment currently being spoken, pre-roll included."""
+
+        if not self.speaking:
+            return np.empty(0, dtype=np.int16)
+        return self.buffer.view(self._start, self._cursor)
+
+    def _finish(self) -> Optional[Utterance]:
+        start, end = self._start, self._cursor
+        self.speaking = False
+        self._floor = end
+        speech_frames = self._speech_frames
+        self._speech_frames = 0
+        self._silence_run = 0
+        if speech_frames < self.min_speech_frames:
+            return None
+        return Utterance(
+            pcm=self.buffer.view(start, end),
+            sample_rate=self.sample_rate,
+            start_ms=start * 1000 // self.sample_rate,
+            end_ms=end * 1000 // self.sample_rate,
+            buffer=self.buffer,
+            start_sample=start,
+        )
+
+
+def create_vad(
+    settings: Settings,
+    sample_rate: int,
+    *,
+    end_of_turn: Optional[Callable[[int], bool]] = None,
+    on_pause: Optional[Callable[[int], None]] = None,
+) -> VoiceActivityDetector:
+    """Build a detector from the ``vad_*`` settings."""
+
+    classifier: Optional[SpeechClassifier] = None
+    if settings.vad_model == "webrtc":
+        classifier = WebRTCClassifier(settings.vad_aggressiveness)
+    elif settings.vad_model != "energy":
+        raise ValueError(f"Unknown VAD model {settings.vad_model!r}")
+    return VoiceActivityDetector(
+        sample_rate=sample_rate,
+        pre_roll_ms=settings.vad_pre_roll_ms,
+        hangover_ms=settings.vad_hangover_ms,
+        min_speech_ms=settings.vad_min_speech_ms,
+        max_utterance_ms=settings.vad_max_utterance_ms,
+        buffer_ms=settings.agent_audio_buffer_ms,
+        classifier=classifier,
+        end_of_turn=end_of_turn,
+        on_pause=on_pause,
+    )
+
+
+__all__ = [
+    "SpeechClassifier",
+    "TransformRunner",
+    "EnergyZCRClassifier",
+    "WebRTCClassifier",
+    "Utterance",
+    "VoiceActivityDetector",
+    "classify_detached",
+    "create_vad",
+]
@@ -9,17 +9,48 @@ execution environments such as this evaluation container.
 from __future__ import annotations
 
 import asyncio
+import base64
 import logging
+from contextlib import aclosing
 from dataclasses import dataclass, field
-from typing import Awaitable, Callable, Optional
+from functools import partial
+from typing import Any, AsyncIterator, Awaitable, Callable, Dict, Optional
+
+import numpy as np
 
 from ..config import get_settings
-from .ali_bailian import BailianError, synthesize_speech, transcribe_audio
-from .dify import generate_reply
+from . import ali_bailian, dify
+from .ali_bailian import (
+    StreamingRecognizer,
+    stream_speech,
+    synthesize_speech,
+    transcribe_audio,
+)
+from .audio_executor import get_audio_executor
+from .audio_output import PacedPublisher, StreamedClip
+from .dify import stop_generation, stream_reply
+from .endpointing import create_endpoint_detector
+from .listener import ParticipantListener, Turn
+from .metrics import REGISTRY
+from .speculation import Speculator
+from .speech_pipeline import SpeechPipeline
+from .sessions import get_session_store
+from .tts_cache import get_tts_cache
+from . import timeline as stages
+from .timeline import TurnTimeline, current_timeline, get_latency_histograms, log_timeline
+from .tracing import get_span_exporter, start_span
+from .turns import Interruption, RoomScheduler, TurnController
+from .worker_load import get_worker_load
+from .vad import Utterance
 from ..schemas import Message
 
 logger = logging.getLogger(__name__)
 
+INTERRUPTIONS = REGISTRY.counter("agent_interruptions_total", "Replies cut short by barge-in")
+CANCEL_TO_SILENCE = REGISTRY.histogram(
+    "agent_cancel_to_silence_seconds", "Time from barge-in until the agent stops speaking"
+)
+
 
 class LiveKitDependencyError(RuntimeError):
     """Raised when ``livekit`` modules are missing at runtime."""
@@ -38,6 +69,25 @@ class AgentCallbacks:
     on_speech: Callable[[str], Awaitable[None]] = field(
         default_factory=lambda: (lambda _: asyncio.sleep(0))
     )
+    # Receives the cancel-to-silence latency of every barge-in in ms.
+    on_interrupted: Callable[[float], Awaitable[None]] = field(
+        default_factory=lambda: (lambda _: asyncio.sleep(0))
+    )
+    # Receives the stage timeline of every finished or cancelled user turn.
+    on_timeline: Callable[[TurnTimeline], Awaitable[None]] = field(
+        default_factory=lambda: (lambda _: asyncio.sleep(0))
+    )
+
+
+def _mark_first_frame() -> None:
+    timeline = current_timeline()
+    if timeline is not None:
+        timeline.mark_once(stages.FIRST_FRAME)
+
+
+def _encode_base64(pcm: bytes) -> str:
+    # Module level so process-pool executors can pickle it.
+    return base64.b64encode(pcm).decode()
 
 
 async def _ensure_livekit_modules() -> None:
@@ -57,16 +107,25 @@ async def run_agent(job_context: "JobContext", callbacks: Optional[AgentCallback
 
     The function performs the following steps for each connected participant:
 
-    1. Listens to microphone audio.
-    2. Sends the captured buffers to Alibaba Bailian STT.
+    1. Listens to microphone audio and segments it into utterances with a
+       voice-activity detector; an adaptive endpointer decides when the
+       speaker's turn is over.
+    2. Transcribes each turn with Alibaba Bailian STT, optionally streaming
+       audio while the user is still talking.
     3. Streams the transcript to Dify in order to obtain a response.
-    4. Converts the reply to speech using Bailian TTS and publishes it back into
-       the LiveKit room.
+    4. Cuts the streamed reply into sentences, converts each one to speech using
+       Bailian TTS and publishes it back into the LiveKit room while the next
+       sentence is still being generated and synthesized.  In the default
+       ``pcm`` mode audio is requested at the room sample rate and published
+       as paced 10/20 ms frames as soon as the first chunk arrives.
 
-    The orchestration is purposely sequential.  LiveKit itself handles audio
-    streaming and barge-in (the ability to interrupt).  Whenever a user speaks we
-    cancel any pending TTS playback which mimics the behaviour of ChatGPT's voice
-    mode.
+    Whenever a user starts speaking their current turn is interrupted
+    (barge-in): queued audio is flushed, the Dify stream and in-flight TTS
+    requests are closed and Dify is told to stop generating, which mimics the
+    behaviour of ChatGPT's voice mode.  Each participant keeps their own
+    listener, Dify conversation and reply turn; a :class:`RoomScheduler`
+    caps concurrent turns per room, admits waiting speakers fairly and lets
+    one reply speak at a time.
     """
 
     await _ensure_livekit_modules()
@@ -83,21 +142,171 @@ async def run_agent(job_context: "JobContext", callbacks: Optional[AgentCallback
     class _Assistant(AutoSubscribeAgent):
         def __init__(self) -> None:
             super().__init__(job_context)
-            self._current_task: Optional[asyncio.Task[None]] = None
+            # One turn controller per participant; the scheduler shares the
+            # room's upstream capacity and its single voice between them.
+            self._turns: Dict[str, TurnController] = {}
+            self._room = RoomScheduler(max_concurrent=settings.agent_room_max_concurrent_turns)
+            self._listeners: Dict[str, asyncio.Task[None]] = {}
+            self._http = ali_bailian.get_client()
+            self._dify = dify.get_client(settings)
+            self._tts_cache = get_tts_cache()
+            self._sessions = get_session_store()
+            self._endpointer = create_endpoint_detector(settings)
+            self._publisher: Optional[PacedPublisher] = None
+            self._executor = get_audio_executor()
 
-        async def _speak(self, text: str) -> None:
-            await callbacks.on_speech(text)
-            audio_base64 = await synthesize_speech(settings=settings, text=text)
-            pcm_data = rtc.AudioFrame.from_base64(audio_base64)
+        def _pcm_speech(self, text: str) -> AsyncIterator[bytes]:
+            # Raw PCM at the room rate needs no decoding before publishing.
+            return stream_speech(
+                settings=settings,
+                text=text,
+                audio_format="pcm",
+                sample_rate=settings.agent_output_sample_rate,
+                client=self._http,
+                cache=self._tts_cache,
+            )
+
+        async def _synthesize(self, text: str) -> Any:
+            timeline = current_timeline()
+            index = timeline.count(stages.TTS_REQUEST) if timeline is not None else 0
+            stages.mark(stages.TTS_REQUEST, index=index)
+            if settings.agent_tts_mode == "pcm":
+                audio = await StreamedClip.open(self._pcm_speech(text))
+            else:
+                audio = await synthesize_speech(
+                    settings=settings, text=text, client=self._http, cache=self._tts_cache
+                )
+            stages.mark(stages.TTS_FIRST_BYTE, index=index)
+            return audio
+
+        async def _warm_tts(self, text: str) -> None:
+            if settings.agent_tts_mode == "pcm":
+                async for _ in self._pcm_speech(text):
+                    pass  # completed streams are stored in the TTS cache
+            else:
+                await self._synthesize(text)
+
+        async def _transcribe(self, utterance: Utterance) -> str:
+            return await transcribe_audio(
+                settings=settings,
+                audio_base64=await self._executor.run(_encode_base64, utterance.pcm),
+                sample_rate=utterance.sample_rate,
+                client=self._http,
+            )
+
+        def _recognizer_factory(self, sample_rate: int) -> StreamingRecognizer:
+            return StreamingRecognizer(settings, sample_rate=sample_rate)
+
+        async def open_audio_output(self) -> None:
+            """Publish the assistant track fed by a paced ``AudioSource``."""
+
+            rate = settings.agent_output_sample_rate
+            self.audio_source = rtc.AudioSource(rate, 1)
+            track = rtc.LocalAudioTrack.create_audio_track("assistant-voice", self.audio_source)
+            await job_context.room.local_participant.publish_track(track)
+            # One preallocated frame; the publisher writes every slice into it.
+            frame = rtc.AudioFrame.create(rate, 1, rate * settings.agent_output_frame_ms // 1000)
+            self._publisher = PacedPublisher(
+                lambda _: self.audio_source.capture_frame(frame),
+                sample_rate=rate,
+                frame_ms=settings.agent_output_frame_ms,
+                buffer=np.frombuffer(frame.data, dtype=np.int16),
+                on_first_frame=_mark_first_frame,
+            )
+
+        async def _play(self, audio: Any) -> None:
+            if isinstance(audio, StreamedClip):
+                # Playback starts with the first chunk; barge-in cancels
+                # between two frames.  The publisher stamps the first frame
+                # when it reaches the audio source.
+                async for chunk in audio:
+                    await self._publisher.write(chunk)
+                await self._publisher.finish()
+                return
+            pcm_data = rtc.AudioFrame.from_base64(audio)
             await self.publish_audio_frame(pcm_data)
+            _mark_first_frame()
 
-        async def _cancel_pending(self) -> None:
-            if self._current_task and not self._current_task.done():
-                self._current_task.cancel()
-                try:
-                    await self._current_task
-                except asyncio.CancelledError:
-                    logger.debug("Cancelled pending TTS playback")
+        def _controller(self, identity: str) -> TurnController:
+            controller = self._turns.get(identity)
+            if controller is None:
+                controller = self._turns[identity] = TurnController(
+                    stop_generation=self._stop_generation,
+                    flush_playback=lambda: self._flush_playback(identity),
+                    on_interrupted=self._on_interrupted,
+                )
+            return controller
+
+        async def aclose(self) -> None:
+            listeners = list(self._listeners.values())
+            self._listeners.clear()
+            for task in listeners:
+                task.cancel()
+            await asyncio.gather(*listeners, return_exceptions=True)
+            for controller in list(self._turns.values()):
+                await controller.aclose()
+            logger.info("Room scheduler: %s", self._room.stats())
+
+        def _flush_playback(self, identity: str) -> None:
+            # Only the participant whose reply is being spoken silences it.
+            if self._room.floor_owner != identity:
+                return
+            if self._publisher is not None:
+                self._publisher.clear()
+            # Drop frames handed to LiveKit but not yet sent to the room.
+            source = getattr(self, "audio_source", None)
+            clear_queue = getattr(source, "clear_queue", None)
+            if clear_queue is not None:
+                clear_queue()
+
+        async def _stop_generation(self, task_id: str, user: Optional[str]) -> None:
+            await stop_generation(settings=settings, task_id=task_id, user=user, client=self._dify)
+
+        async def _on_interrupted(self, interruption: Interruption) -> None:
+            INTERRUPTIONS.inc()
+            CANCEL_TO_SILENCE.observe(interruption.cancel_to_silence_ms)
+            await callbacks.on_interrupted(interruption.cancel_to_silence_ms)
+
+        def _reply_events(self, transcript: str, identity: str) -> AsyncIterator[Dict[str, Any]]:
+            # Dify keeps the history per conversation, so each participant only
+            # sends the new utterance once its conversation has been created.
+            return stream_reply(
+                settings=settings,
+                messages=[Message(role="user", content=transcript)],
+                client=self._dify,
+                conversation_id=self._sessions.get((identity, job_context.room.name)),
+                user=identity,
+            )
+
+        async def _reply_deltas(
+            self, events: AsyncIterator[Dict[str, Any]], identity: str
+        ) -> AsyncIterator[str]:
+            key = (identity, job_context.room.name)
+            timeline = current_timeline()
+            if timeline is not None:
+                timeline.mark_once(stages.DIFY_REQUEST)  # speculative turns marked it earlier
+            responding = False
+            # ``aclosing`` tears the SSE connection down as soon as the
+            # consumer goes away, e.g. when barge-in cancels the turn.
+            async with aclosing(events):
+                async for event in events:
+                    # Tracked from the first event carrying it, so a barge-in
+                    # before the first token still stops the generation.
+                    self._controller(identity).track_generation(event.get("task_id"), identity)
+                    if event["event"] == "done":
+                        stages.mark(stages.DIFY_FINAL)
+                        if event.get("conversation_id"):
+                            self._sessions.set(key, event["conversation_id"])
+                    if event["event"] != "delta":
+                        continue
+                    if not responding:
+                        responding = True
+                        stages.mark(stages.DIFY_FIRST_TOKEN)
+                        await callbacks.on_thinking("responding")
+                    yield event["text"]
+
+        async def _interrupt(self, identity: str) -> None:
+            await self._controller(identity).interrupt()
 
         async def on_track_subscribed(
             self,
@@ -106,31 +315,139 @@ async def run_agent(job_context: "JobContext", callbacks: Optional[AgentCallback
             participant: rtc.RemoteParticipant,
         ) -> None:
             # Called every time the remote participant sends us audio.
-            del publication, participant  # Unused but keep signature stable
+            del publication  # Unused but keep signature stable
+            identity = participant.identity
 
-            async def _process() -> None:
-                await callbacks.on_thinking("listening")
-                audio_chunk = await track.to_base64()
-                transcript = await transcribe_audio(
-                    settings=settings, audio_base64=audio_chunk
+            speculator: Optional[Speculator] = None
+            if settings.agent_speculative_llm:
+                speculative_tts = settings.agent_speculative_tts and self._tts_cache is not None
+                speculator = Speculator(
+                    start=lambda text: self._reply_events(text, identity),
+                    stop=lambda task_id: self._stop_generation(task_id, identity),
+                    # Warming only pays off when the pipeline can hit the cache.
+                    warm=self._warm_tts if speculative_tts else None,
                 )
+
+            async def _process(turn: Turn) -> None:
+                async with get_worker_load().turn():
+                    await _reply(turn)
+
+            async def _reply(turn: Turn) -> None:
+                # Speech ended ``silence_ms`` before the endpointer noticed.
+                silence = turn.decision.silence_ms / 1000 if turn.decision else 0.0
+                timeline = TurnTimeline(identity, speech_end=turn.ended_at - silence)
+                timeline.mark(stages.TURN_END, at=turn.ended_at)
+                stages.set_current(timeline)  # inherited by the pipeline's tasks
+                # Each turn is its own trace; the STT, Dify and TTS calls made
+                # by the pipeline's tasks become its children.
+                attributes = {"participant": identity, "room": job_context.room.name}
+                with start_span("agent.turn", attributes=attributes) as span:
+                    try:
+                        await _respond(turn, timeline)
+                        timeline.mark(stages.PLAYBACK_END)
+                    except asyncio.CancelledError:
+                        timeline.mark(stages.CANCELLED)
+                        raise
+                    finally:
+                        span.set_attribute("turn.id", timeline.turn_id)
+                        for name, value in timeline.latencies().items():
+                            span.set_attribute(f"turn.{name}", value)
+                        get_latency_histograms()(timeline)
+                        log_timeline(timeline)
+                        await callbacks.on_timeline(timeline)
+
+            async def _respond(turn: Turn, timeline: TurnTimeline) -> None:
+                await callbacks.on_thinking("listening")
+                timeline.mark(stages.STT_REQUEST)
+                transcript = await turn.transcript()
+                timeline.mark(stages.STT_RESPONSE)
+                speculative = await speculator.claim(transcript) if speculator else None
+                if not transcript.strip():
+                    return
                 await callbacks.on_transcription(transcript)
+                if speculative is not None:
+                    timeline.mark(stages.DIFY_REQUEST, at=speculative.started)
+                    events = speculative.events()
+                else:
+                    events = self._reply_events(transcript, identity)
+
+                # Stream the next assistant turn from Dify and speak it
+                # sentence by sentence while generation continues.
+                async with self._room.voice(identity, self._play) as play:
+                    pipeline = SpeechPipeline(
+                        synthesize=self._synthesize,
+                        play=play,
+                        on_segment=callbacks.on_speech,
+                        max_chars=settings.tts_segment_max_chars,
+                        prefetch=settings.tts_prefetch_segments,
+                    )
+                    await pipeline.run(self._reply_deltas(events, identity))
 
-                # Query Dify for the next assistant turn.
-                response = await generate_reply(
-                    settings=settings,
-                    messages=[
-                        Message(role="user", content=transcript),
-                    ],
+            async def _start_turn(turn: Turn) -> None:
+                # ``start`` interrupts the participant's previous turn.  A queued
+                # turn's audio is a view into the ring buffer, which keeps
+                # filling while it waits behind other participants.
+                await self._controller(identity).start(
+                    self._room.run(identity, _process(turn), on_queued=turn.detach)
                 )
-                await callbacks.on_thinking("responding")
-                await self._speak(response["reply"])
 
-            await self._cancel_pending()
-            self._current_task = asyncio.create_task(_process())
+            listener = ParticipantListener(
+                settings,
+                identity,
+                endpointer=self._endpointer,
+                # Barge-in as soon as the user starts talking; other
+                # participants' replies carry on.
+                on_speech_start=partial(self._interrupt, identity),
+                on_turn=_start_turn,
+                transcribe=self._transcribe,
+                recognizer_factory=(
+                    self._recognizer_factory if settings.agent_streaming_stt else None
+                ),
+                on_stable_partial=speculator.speculate if speculator else None,
+                stable_ms=settings.agent_speculation_stable_ms,
+                executor=self._executor,
+            )
 
-    assistant = _Assistant()
-    await assistant.run()
+            async def _listen() -> None:
+                # Only speech segments found by the VAD reach STT; silence and
+                # background noise never leave the agent.
+                try:
+                    async for event in rtc.AudioStream(track):
+                        frame = event.frame
+                        # The listener reads the frame memory in place, converts
+                        # it to 16 kHz mono and writes it once into its ring buffer.
+                        await listener.push(frame.data, frame.sample_rate, frame.num_channels)
+                    await listener.flush()
+                finally:
+                    # Also on resubscription or shutdown: stop any speculative
+                    # Dify generation this listener started.
+                    if speculator is not None:
+                        await speculator.aclose()
+                        logger.info("Speculation for %s: %s", identity, speculator.stats())
+
+            previous = self._listeners.pop(identity, None)
+            if previous is not None:
+                previous.cancel()
+                await asyncio.gather(previous, return_exceptions=True)
+            self._listeners[identity] = asyncio.create_task(_listen())
+
+    # Share keep-alive pools across every job handled by this worker process.
+    await ali_bailian.open_client(settings)
+    await dify.open_client(settings)
+    try:
+        # Sessions, turns and loop lag feed the load reported to LiveKit.
+        async with get_worker_load().session():
+            assistant = _Assistant()
+            if settings.agent_tts_mode == "pcm":
+                await assistant.open_audio_output()
+            try:
+                await assistant.run()
+            finally:
+                await assistant.aclose()
+    finally:
+        await dify.close_client(settings)
+        await ali_bailian.close_client()
+        await asyncio.to_thread(get_span_exporter().flush)
 
 
 __all__ = ["run_agent", "AgentCallbacks", "LiveKitDependencyError"]
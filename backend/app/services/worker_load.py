@@ -0,0 +1,211 @@
+"""Load reporting for LiveKit agent workers.
+
+The LiveKit dispatcher only sends new rooms to workers whose reported load is
+below ``load_threshold``.  :func:`compute_load` combines four signals into one
+score in ``[0, 1]``, each normalised against its configured capacity:
+
+* active agent sessions (rooms) against ``agent_max_sessions``,
+* in-flight work against ``agent_max_in_flight``: the larger of the reply
+  turns (STT/Dify/TTS) and the Dify requests, since every turn holds a Dify
+  request while it streams and speculative requests add to the latter,
+* the p99 event-loop lag of the session loops against
+  ``agent_loop_lag_budget_ms``,
+* CPU utilisation of the host (``/proc/stat``, or the load average elsewhere).
+
+The score is the *largest* of these fractions: a worker is as full as its
+tightest resource, and a single saturated signal is enough to stop accepting
+rooms.  Sessions, turns and lag are tracked per process, so the runner keeps
+jobs in the worker process (thread job executor) where the library supports
+it.  Each job thread runs its own event loop, which is why the pooled
+Bailian and Dify clients are kept per loop and Dify requests are summed over
+all of them; CPU is measured host-wide and therefore covers job subprocesses
+as well.
+"""
+from __future__ import annotations
+
+import asyncio
+import logging
+import os
+import threading
+from contextlib import asynccontextmanager
+from functools import lru_cache
+from typing import Any, AsyncIterator, Callable, Dict, Optional, Tuple
+
+from ..config import Settings, get_settings
+from . import dify
+from .loop_lag import LoopLagMonitor
+from .metrics import REGISTRY
+
+logger = logging.getLogger(__name__)
+
+
+class CPUSampler:
+    """Host CPU utilisation between two calls, in ``[0, 1]``."""
+
+    def __init__(self, stat_path: str = "/proc/stat") -> None:
+        self._path = stat_path
+        self._previous: Optional[Tuple[int, int]] = None
+
+    def _read(self) -> Optional[Tuple[int, int]]:
+        try:
+            with open(self._path, encoding="ascii") as stat:
+                fields = [int(value) for value in stat.readline().split()[1:]]
+        except (OSError, ValueError):
+            return None
+        idle = fields[3] + (fields[4] if len(fields) > 4 else 0)  # idle + iowait
+        return sum(fields), idle
+
+    def sample(self) -> float:
+        current = self._read()
+        if current is None:
+            try:
+                return min(1.0, os.getloadavg()[0] / (os.cpu_count() or 1))
+            except OSError:
+                return 0.0
+        previous, self._previous = self._previous, current
+        if previous is None or current[0] <= previous[0]:
+            return 0.0
+        total, idle = current[0] - previous[0], current[1] - previous[1]
+        return max(0.0, min(1.0, 1.0 - idle / total))
+
+
+class WorkerLoad:
+    """Process-wide counters behind :func:`compute_load`.
+
+    Sessions may run on different event loops (one per job thread), so every
+    loop gets its own :class:`LoopLagMonitor` and the counters are guarded by
+    a lock.
+    """
+
+    def __init__(
+        self,
+        *,
+        max_sessions: int = 25,
+        max_in_flight: int = 50,
+        lag_budget_ms: float = 50.0,
+        cpu: Optional[CPUSampler] = None,
+        in_flight_requests: Callable[[], int] = lambda: 0,
+    ) -> None:
+        self.max_sessions = max(1, max_sessions)
+        self.max_in_flight = max(1, max_in_flight)
+        self.lag_budget_ms = lag_budget_ms
+        self._cpu = cpu or CPUSampler()
+        self._in_flight_requests = in_flight_requests
+        self._lock = threading.Lock()
+        self.sessions = 0
+        self.turns = 0
+        self._monitors: Dict[int, Tuple[LoopLagMonitor, int]] = {}
+
+    @asynccontextmanager
+    async def session(self) -> AsyncIterator[None]:
+        """Count one agent session and watch the lag of its event loop."""
+
+        loop_id = id(asyncio.get_running_loop())
+        with self._lock:
+            self.sessions += 1
+            monitor, users = self._monitors.get(loop_id, (None, 0))
+            if monitor is None:
+                monitor = LoopLagMonitor(interval=0.1, window=600)
+                monitor.start()
+            self._monitors[loop_id] = (monitor, users + 1)
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.sessions -= 1
+                monitor, users = self._monitors.pop(loop_id)
+                if users > 1:
+                    self._monitors[loop_id] = (monitor, users - 1)
+            if users == 1:
+                await monitor.stop()
+
+    @asynccontextmanager
+    async def turn(self) -> AsyncIterator[None]:
+        """Count one reply turn that is calling upstream services."""
+
+        with self._lock:
+            self.turns += 1
+        try:
+            yield
+        finally:
+            with self._lock:
+                self.turns -= 1
+
+    def loop_lag_ms(self) -> float:
+        with self._lock:
+            monitors = [monitor for monitor, _ in self._monitors.values()]
+        return max((monitor.stats()["p99_ms"] for monitor in monitors), default=0.0)
+
+    def snapshot(self) -> Dict[str, float]:
+        """Raw signals, their normalised fractions and the combined score."""
+
+        # A streaming turn also holds a Dify request; count that work once.
+        in_flight = max(self.turns, self._in_flight_requests())
+        lag_ms = self.loop_lag_ms()
+        cpu = self._cpu.sample()
+        fractions = {
+            "sessions": self.sessions / self.max_sessions,
+            "in_flight": in_flight / self.max_in_flight,
+            "loop_lag": lag_ms / self.lag_budget_ms if self.lag_budget_ms > 0 else 0.0,
+            "cpu": cpu,
+        }
+        return {
+            "sessions": self.sessions,
+            "in_flight": in_flight,
+            "loop_lag_p99_ms": lag_ms,
+            "cpu": round(cpu, 3),
+            "bottleneck": max(fractions, key=fractions.__getitem__),
+            "load": round(min(1.0, max(fractions.values())), 3),
+        }
+
+
+def create_worker_load(settings: Settings) -> WorkerLoad:
+    """Build the load tracker from the ``agent_*`` capacity settings."""
+
+    return WorkerLoad(
+        max_sessions=settings.agent_max_sessions,
+        max_in_flight=settings.agent_max_in_flight,
+        lag_budget_ms=settings.agent_loop_lag_budget_ms,
+        in_flight_requests=dify.requests_in_flight,
+    )
+
+
+@lru_cache()
+def get_worker_load() -> WorkerLoad:
+    """Return the load tracker of this worker process."""
+
+    return create_worker_load(get_settings())
+
+
+REGISTRY.gauge(
+    "agent_sessions_active",
+    "Agent sessions (rooms) running in this process",
+    function=lambda: get_worker_load().sessions,
+)
+REGISTRY.gauge(
+    "agent_turns_in_flight",
+    "Agent reply turns calling upstream services",
+    function=lambda: get_worker_load().turns,
+)
+
+
+def compute_load(*_: Any) -> float:
+    """``WorkerOptions.load_fnc``: the worker's load in ``[0, 1]``.
+
+    Accepts and ignores the ``Worker`` argument passed by newer releases of
+    ``livekit-agents``.
+    """
+
+    snapshot = get_worker_load().snapshot()
+    if snapshot["load"] >= get_settings().agent_load_threshold:
+        logger.info("Worker is full: %s", snapshot)
+    return snapshot["load"]
+
+
+__all__ = [
+    "CPUSampler",
+    "WorkerLoad",
+    "compute_load",
+    "create_worker_load",
+    "get_worker_load",
+]
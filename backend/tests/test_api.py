@@ -1,5 +1,6 @@
 import base64
 
+import httpx
 import pytest
 import pytest_asyncio
 import respx
@@ -7,6 +8,8 @@ from httpx import ASGITransport, AsyncClient, Response
 
 from backend.app.config import Settings
 from backend.app.main import app
+from backend.app.services.sessions import SessionStore, get_session_store
+from backend.app.services.tts_cache import TTSCache, get_tts_cache
 
 
 class TestSettings(Settings):
@@ -32,11 +35,25 @@ def override_settings(monkeypatch):
     monkeypatch.setattr(config_module, "get_settings", lambda: settings)
     monkeypatch.setattr(main_module, "get_settings", lambda: settings)
     app.dependency_overrides[original_get_settings] = lambda: settings
+    tts_cache = TTSCache(settings.tts_cache_max_bytes)
+    app.dependency_overrides[get_tts_cache] = lambda: tts_cache
+    sessions = SessionStore(ttl=settings.session_ttl_seconds, max_sessions=100)
+    app.dependency_overrides[get_session_store] = lambda: sessions
     yield
     app.dependency_overrides.clear()
     original_get_settings.cache_clear()
 
 
+def use_settings(**overrides) -> Settings:
+    """Serve a customised ``TestSettings`` through the FastAPI dependency."""
+
+    from backend.app.main import SettingsDep
+
+    settings = TestSettings(**overrides)
+    app.dependency_overrides[SettingsDep.__metadata__[0].dependency] = lambda: settings
+    return settings
+
+
 @pytest_asyncio.fixture
 async def client():
     transport = ASGITransport(app=app)
@@ -131,3 +148,1018 @@ async def test_voice_agent_dependency_error():
 
     with pytest.raises(LiveKitDependencyError):
         await _ensure_livekit_modules()
+
+
+@pytest.mark.asyncio
+async def test_lifespan_shares_bailian_pool():
+    from backend.app.services import ali_bailian
+
+    assert ali_bailian.get_client() is None
+    async with app.router.lifespan_context(app):
+        pooled = ali_bailian.get_client()
+        assert pooled is not None
+
+        transport = ASGITransport(app=app)
+        async with AsyncClient(transport=transport, base_url="http://testserver") as client:
+            with respx.mock(assert_all_called=True) as router:
+                route = router.post(
+                    "https://dashscope.test/api/v1/services/audio/dashscope/speech_to_text"
+                ).mock(return_value=Response(200, json={"output": {"text": "一"}}))
+                payload = {"audio_base64": base64.b64encode(b"demo").decode()}
+                for _ in range(2):
+                    response = await client.post("/speech-to-text", json=payload)
+                    assert response.status_code == 200
+
+        assert route.call_count == 2
+        assert ali_bailian.get_client() is pooled
+
+    assert ali_bailian.get_client() is None
+    assert pooled.is_closed
+
+
+@pytest.mark.asyncio
+async def test_bailian_pool_is_reference_counted():
+    from backend.app.services import ali_bailian
+
+    settings = TestSettings()
+    first = await ali_bailian.open_client(settings)
+    second = await ali_bailian.open_client(settings)
+    assert first is second
+
+    await ali_bailian.close_client()
+    assert not first.is_closed
+    await ali_bailian.close_client()
+    assert first.is_closed
+    assert ali_bailian.get_client() is None
+
+
+def test_shared_clients_are_per_event_loop():
+    import asyncio
+    import threading
+
+    from backend.app.services import ali_bailian, dify
+
+    settings = TestSettings()
+    opened = {}
+    both_open = threading.Barrier(2)
+
+    async def job(name):
+        opened[name] = (await ali_bailian.open_client(settings), await dify.open_client(settings))
+        assert ali_bailian.get_client() is opened[name][0]
+        assert dify.get_client(settings) is opened[name][1]
+        await asyncio.to_thread(both_open.wait, 5)
+        await dify.close_client(settings)
+        await ali_bailian.close_client()
+
+    threads = [threading.Thread(target=asyncio.run, args=(job(name),)) for name in "ab"]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    (bailian_a, dify_a), (bailian_b, dify_b) = opened["a"], opened["b"]
+    assert bailian_a is not bailian_b and dify_a is not dify_b
+    assert bailian_a.is_closed and bailian_b.is_closed
+    assert dify.requests_in_flight() == 0
+
+
+def test_request_gate_caps_requests_across_event_loops():
+    import asyncio
+    import threading
+
+    from backend.app.services.dify import RequestGate
+
+    gate = RequestGate(2)
+    active = peak = 0
+    lock = threading.Lock()
+
+    async def job():
+        nonlocal active, peak
+
+        async def request():
+            nonlocal active, peak
+            await gate.acquire()
+            with lock:
+                active += 1
+                peak = max(peak, active)
+            await asyncio.sleep(0.01)
+            with lock:
+                active -= 1
+            gate.release()
+
+        await asyncio.gather(*[request() for _ in range(4)])
+
+    threads = [threading.Thread(target=asyncio.run, args=(job(),)) for _ in range(3)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join(timeout=10)
+
+    async def abandon_wait():
+        await gate.acquire()
+        await gate.acquire()
+        with pytest.raises(asyncio.TimeoutError):
+            await asyncio.wait_for(gate.acquire(), timeout=0.01)
+        gate.release()
+        gate.release()
+
+    asyncio.run(abandon_wait())
+
+    assert peak == 2
+    assert gate._held == 0 and not gate._waiters
+
+
+@pytest.mark.asyncio
+async def test_dify_client_caps_in_flight_requests():
+    import asyncio
+
+    from backend.app.schemas import Message
+    from backend.app.services.dify import DifyClient, generate_reply
+
+    settings = TestSettings()
+    peak = 0
+    active = 0
+
+    async def slow_answer(request):
+        nonlocal peak, active
+        active += 1
+        peak = max(peak, active)
+        await asyncio.sleep(0.02)
+        active -= 1
+        return Response(200, json={"answer": "好的"})
+
+    with respx.mock(assert_all_called=True) as router:
+        router.post("http://dify.local/v1/chat-messages").mock(side_effect=slow_answer)
+        async with DifyClient(settings, max_concurrency=2) as dify_client:
+            results = await asyncio.gather(*[
+                generate_reply(
+                    settings=settings,
+                    messages=[Message(role="user", content="你好")],
+                    client=dify_client,
+                )
+                for _ in range(6)
+            ])
+
+    assert peak == 2
+    assert all(result["reply"] == "好的" for result in results)
+    assert max(result["queue_ms"] for result in results) >= 20
+
+
+@pytest.mark.asyncio
+async def test_stop_generation_bypasses_the_request_queue():
+    import asyncio
+    import json
+
+    from backend.app.services.dify import DifyClient, stop_generation
+
+    settings = TestSettings()
+    with respx.mock(assert_all_called=True) as router:
+        route = router.post("http://dify.local/v1/chat-messages/t-42/stop").mock(
+            return_value=Response(200, json={"result": "success"})
+        )
+        async with DifyClient(settings, max_concurrency=1) as dify_client:
+            async with dify_client._slot():  # a long stream holds the only slot
+                stopped = await asyncio.wait_for(
+                    stop_generation(settings=settings, task_id="t-42", user="alice", client=dify_client),
+                    timeout=1,
+                )
+
+    assert stopped is True
+    assert json.loads(route.calls.last.request.content) == {"user": "alice"}
+
+
+@pytest.mark.asyncio
+async def test_lifespan_opens_dify_client():
+    from backend.app.services import dify
+
+    settings = TestSettings()
+    assert dify.get_client(settings) is None
+    async with app.router.lifespan_context(app):
+        pooled = dify.get_client(settings)
+        assert pooled is not None
+    assert dify.get_client(settings) is None
+    assert pooled.is_closed
+
+
+def _dify_stream(*events):
+    import json
+
+    return "".join(f"data: {json.dumps(event, ensure_ascii=False)}\n\n" for event in events)
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_endpoint(client):
+    body = _dify_stream(
+        {"event": "message", "answer": "你好", "conversation_id": "c-1", "task_id": "t-1"},
+        {"event": "ping"},
+        {"event": "message", "answer": "，世界", "conversation_id": "c-1", "task_id": "t-1"},
+        {"event": "message_end", "conversation_id": "c-1", "message_id": "m-1"},
+    )
+    with respx.mock(assert_all_called=True) as router:
+        route = router.post("http://dify.local/v1/chat-messages").mock(
+            return_value=Response(
+                200, text=body, headers={"Content-Type": "text/event-stream"}
+            )
+        )
+        payload = {"messages": [{"role": "user", "content": "你好"}]}
+        response = await client.post("/chat/stream", json=payload)
+
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/event-stream")
+    assert b'"response_mode": "streaming"' in route.calls.last.request.content
+
+    from backend.app.services.sse import iter_sse_events
+
+    async def _lines():
+        for line in response.text.split("\n"):
+            yield line
+
+    events = [(sse.event, sse.json()) async for sse in iter_sse_events(_lines())]
+    assert [kind for kind, _ in events] == ["delta", "delta", "done"]
+    assert events[0][1]["text"] == "你好"
+    done = events[-1][1]
+    assert done["reply"] == "你好，世界"
+    assert done["conversation_id"] == "c-1"
+    assert done["task_id"] == "t-1"
+    assert isinstance(done["ttft_ms"], int)
+    # The header left before Dify answered; the stage timings ride on ``done``.
+    assert {"queue", "dify", "app"} <= set(done["server_timing"])
+    assert done["server_timing"]["app"] >= done["server_timing"]["dify"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_stream_reply_announces_task_id_before_the_first_token():
+    from backend.app.schemas import Message
+    from backend.app.services.dify import stream_reply
+
+    settings = TestSettings()
+    body = _dify_stream(
+        {"event": "workflow_started", "task_id": "t-9", "conversation_id": "c-9"},
+        {"event": "message", "answer": "", "task_id": "t-9"},
+        {"event": "message", "answer": "好", "task_id": "t-9"},
+        {"event": "message_end", "task_id": "t-9"},
+    )
+    with respx.mock(assert_all_called=True) as router:
+        router.post("http://dify.local/v1/chat-messages").mock(
+            return_value=Response(200, text=body, headers={"Content-Type": "text/event-stream"})
+        )
+        events = [
+            event
+            async for event in stream_reply(
+                settings=settings, messages=[Message(role="user", content="你好")]
+            )
+        ]
+
+    assert [event["event"] for event in events] == ["started", "delta", "done"]
+    assert events[0]["task_id"] == "t-9"
+
+
+@pytest.mark.asyncio
+async def test_chat_stream_reports_upstream_error(client):
+    body = _dify_stream({"event": "error", "status": 400, "message": "quota exceeded"})
+    with respx.mock(assert_all_called=True) as router:
+        router.post("http://dify.local/v1/chat-messages").mock(
+            return_value=Response(200, text=body)
+        )
+        payload = {"messages": [{"role": "user", "content": "你好"}]}
+        response = await client.post("/chat/stream", json=payload)
+
+    assert response.status_code == 200
+    assert "event: error" in response.text
+    assert "quota exceeded" in response.text
+
+
+@pytest.mark.asyncio
+async def test_text_to_speech_stream_relays_sse_chunks(client):
+    import json
+
+    chunks = [b"ID3-first", b"second-chunk"]
+    body = "".join(
+        "data: " + json.dumps({"output": {"audio": {"data": base64.b64encode(c).decode()}}}) + "\n\n"
+        for c in chunks
+    )
+    with respx.mock(assert_all_called=True) as router:
+        route = router.post(
+            "https://dashscope.test/api/v1/services/audio/dashscope/text_to_speech"
+        ).mock(
+            return_value=Response(200, text=body, headers={"Content-Type": "text/event-stream"})
+        )
+        response = await client.get("/text-to-speech/stream", params={"text": "你好"})
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "audio/mpeg"
+    assert response.content == b"".join(chunks)
+    assert route.calls.last.request.headers["X-DashScope-SSE"] == "enable"
+    timings = [part.split(";")[0].strip() for part in response.headers["server-timing"].split(",")]
+    assert timings == ["tts", "app"]
+
+
+@pytest.mark.asyncio
+async def test_text_to_speech_stream_falls_back_to_json(client):
+    audio = b"\x00\x01" * 20000
+    with respx.mock(assert_all_called=True) as router:
+        router.post("https://dashscope.test/api/v1/services/audio/dashscope/text_to_speech").mock(
+            return_value=Response(
+                200, json={"output": {"audio": {"data": base64.b64encode(audio).decode()}}}
+            )
+        )
+        response = await client.post(
+            "/text-to-speech/stream", json={"text": "你好", "format": "wav"}
+        )
+
+    assert response.status_code == 200
+    assert response.headers["content-type"] == "audio/wav"
+    assert response.content == audio
+
+
+@pytest.mark.asyncio
+async def test_text_to_speech_stream_upstream_error(client):
+    with respx.mock(assert_all_called=True) as router:
+        router.post("https://dashscope.test/api/v1/services/audio/dashscope/text_to_speech").mock(
+            return_value=Response(401, json={"message": "invalid token"})
+        )
+        response = await client.get("/text-to-speech/stream", params={"text": "你好"})
+
+    assert response.status_code == 400
+    assert response.json()["detail"] == "invalid token"
+
+
+@pytest.mark.asyncio
+async def test_text_to_speech_stream_maps_transport_errors(client):
+    url = "https://dashscope.test/api/v1/services/audio/dashscope/text_to_speech"
+    with respx.mock(assert_all_called=True) as router:
+        router.post(url).mock(side_effect=httpx.ReadTimeout("slow"))
+        timed_out = await client.get("/text-to-speech/stream", params={"text": "你好"})
+    with respx.mock(assert_all_called=True) as router:
+        router.post(url).mock(side_effect=httpx.ConnectError("refused"))
+        unreachable = await client.get("/text-to-speech/stream", params={"text": "再见"})
+
+    assert timed_out.status_code == 504
+    assert unreachable.status_code == 502
+
+
+class _FakeDashScopeSocket:
+    """In-memory stand-in for the DashScope duplex WebSocket."""
+
+    def __init__(self, sentences):
+        import asyncio
+
+        self.sent = []
+        self._incoming = asyncio.Queue()
+        self._sentences = sentences
+
+    def _push(self, event, payload=None):
+        import json
+
+        self._incoming.put_nowait(json.dumps({"header": {"event": event}, "payload": payload or {}}))
+
+    async def send(self, message):
+        import json
+
+        self.sent.append(message)
+        if isinstance(message, bytes):
+            return
+        action = json.loads(message)["header"]["action"]
+        if action == "run-task":
+            self._push("task-started")
+        elif action == "finish-task":
+            for sentence in self._sentences:
+                self._push("result-generated", {"output": {"sentence": sentence}})
+            self._push("task-finished")
+
+    async def recv(self):
+        return await self._incoming.get()
+
+    async def close(self):
+        pass
+
+
+@pytest.mark.asyncio
+async def test_streaming_recognizer_closes_socket_when_the_task_fails_or_stalls():
+    import json
+
+    from backend.app.services.ali_bailian import BailianError, StreamingRecognizer
+
+    class _Socket(_FakeDashScopeSocket):
+        def __init__(self, reply):
+            super().__init__([])
+            self.reply = reply
+            self.closed = False
+
+        async def send(self, message):
+            self.sent.append(message)
+            if self.reply:
+                self._incoming.put_nowait(json.dumps({
+                    "header": {"event": self.reply, "error_message": "quota exceeded"},
+                }))
+
+        async def close(self):
+            self.closed = True
+
+    for reply, error in (("task-failed", "quota exceeded"), (None, "did not start in time")):
+        socket = _Socket(reply)
+
+        async def fake_connect(url, headers):
+            return socket
+
+        settings = TestSettings(ali_ws_handshake_timeout=0.05)
+        with pytest.raises(BailianError, match=error):
+            async with StreamingRecognizer(settings, connect=fake_connect):
+                pass
+        assert socket.closed
+
+
+@pytest.mark.asyncio
+async def test_streaming_recognizer_protocol():
+    import json
+
+    from backend.app.services.ali_bailian import StreamingRecognizer
+
+    socket = _FakeDashScopeSocket([
+        {"text": "你好", "begin_time": 0, "end_time": None, "sentence_end": False},
+        {"text": "你好世界", "begin_time": 0, "end_time": 900, "sentence_end": True},
+    ])
+
+    async def fake_connect(url, headers):
+        assert url.startswith("wss://")
+        assert headers["Authorization"] == "Bearer demo-token"
+        return socket
+
+    async with StreamingRecognizer(TestSettings(), connect=fake_connect) as recognizer:
+        await recognizer.send_audio(b"\x00\x00" * 160)
+        await recognizer.finish()
+        results = [result async for result in recognizer.results()]
+
+    run_task = json.loads(socket.sent[0])
+    assert run_task["payload"]["parameters"] == {
+        "format": "pcm",
+        "sample_rate": 16000,
+        "language_hints": ["zh"],
+    }
+    assert socket.sent[1] == b"\x00\x00" * 160
+    assert [(r.text, r.is_final, r.end_ms) for r in results] == [
+        ("你好", False, None),
+        ("你好世界", True, 900),
+    ]
+
+
+def test_speech_to_text_websocket_streams_transcripts():
+    from starlette.testclient import TestClient
+
+    from backend.app.main import get_recognizer_factory
+    from backend.app.services.ali_bailian import StreamingRecognizer
+
+    socket = _FakeDashScopeSocket([
+        {"text": "测试", "begin_time": 0, "end_time": None, "sentence_end": False},
+        {"text": "测试文本", "begin_time": 0, "end_time": 640, "sentence_end": True},
+    ])
+
+    async def fake_connect(url, headers):
+        return socket
+
+    def factory(settings, **kwargs):
+        return StreamingRecognizer(settings, connect=fake_connect, **kwargs)
+
+    app.dependency_overrides[get_recognizer_factory] = lambda: factory
+    with TestClient(app).websocket_connect("/ws/stt?sample_rate=16000") as ws:
+        ws.send_bytes(b"\x01\x00" * 320)
+        ws.send_text('{"type": "stop"}')
+        messages = [ws.receive_json() for _ in range(3)]
+
+    assert [m["type"] for m in messages] == ["partial", "final", "end"]
+    assert messages[1]["text"] == "测试文本"
+    assert messages[1]["end_ms"] == 640
+    assert socket.sent[1] == b"\x01\x00" * 320
+
+
+@pytest.mark.asyncio
+async def test_speech_to_text_binary_upload_spools_and_streams(client, monkeypatch):
+    import json
+
+    from backend.app import main as main_module
+
+    use_settings(stt_spool_max_bytes=1024)
+    spooled = []
+    original = main_module.tempfile.SpooledTemporaryFile
+
+    def tracking_spool(*args, **kwargs):
+        spool = original(*args, **kwargs)
+        spooled.append(spool)
+        return spool
+
+    monkeypatch.setattr(main_module.tempfile, "SpooledTemporaryFile", tracking_spool)
+
+    audio = bytes(range(256)) * 64  # 16 KiB, larger than the spool threshold
+    with respx.mock(assert_all_called=True) as router:
+        route = router.post(
+            "https://dashscope.test/api/v1/services/audio/dashscope/speech_to_text"
+        ).mock(return_value=Response(200, json={"output": {"text": "二进制"}}))
+        response = await client.post(
+            "/speech-to-text?sample_rate=8000",
+            content=audio,
+            headers={"Content-Type": "application/octet-stream", "X-Audio-Format": "wav"},
+        )
+
+    assert response.status_code == 200
+    assert response.json() == {"text": "二进制"}
+    assert spooled and spooled[0]._rolled
+    sent = json.loads(route.calls.last.request.content)
+    assert sent["input"]["audio"]["format"] == "wav"
+    assert sent["input"]["audio"]["sample_rate"] == 8000
+    assert base64.b64decode(sent["input"]["audio"]["data"]) == audio
+
+
+@pytest.mark.asyncio
+async def test_speech_to_text_downsamples_stereo_48k_pcm(client):
+    import json
+
+    import numpy as np
+
+    tone = (8000 * np.sin(2 * np.pi * 440 * np.arange(48000) / 48000)).astype(np.int16)
+    stereo = np.repeat(tone, 2).tobytes()
+    with respx.mock(assert_all_called=True) as router:
+        route = router.post(
+            "https://dashscope.test/api/v1/services/audio/dashscope/speech_to_text"
+        ).mock(return_value=Response(200, json={"output": {"text": "降采样"}}))
+        response = await client.post(
+            "/speech-to-text?sample_rate=48000&channels=2",
+            content=stereo,
+            headers={"Content-Type": "application/octet-stream"},
+        )
+        json_response = await client.post(
+            "/speech-to-text",
+            json={"audio_base64": base64.b64encode(stereo).decode(), "sample_rate": 48000, "channels": 2},
+        )
+
+    assert response.status_code == 200
+    assert json_response.status_code == 200
+    for call in route.calls:
+        audio = json.loads(call.request.content)["input"]["audio"]
+        assert audio["sample_rate"] == 16000
+        assert len(base64.b64decode(audio["data"])) * 6 == len(stereo)
+
+
+@pytest.mark.asyncio
+async def test_speech_to_text_rejects_oversized_upload(client):
+    use_settings(stt_max_upload_bytes=10)
+    response = await client.post(
+        "/speech-to-text",
+        content=b"x" * 11,
+        headers={"Content-Type": "application/octet-stream"},
+    )
+    assert response.status_code == 413
+
+
+@pytest.mark.asyncio
+async def test_speech_to_text_json_validation_error(client):
+    response = await client.post("/speech-to-text", json={"format": "pcm"})
+    assert response.status_code == 422
+
+
+@pytest.mark.asyncio
+async def test_text_to_speech_cache_skips_network(client):
+    fake_audio = base64.b64encode(b"cached-audio").decode()
+    with respx.mock(assert_all_called=True) as router:
+        route = router.post(
+            "https://dashscope.test/api/v1/services/audio/dashscope/text_to_speech"
+        ).mock(return_value=Response(200, json={"output": {"audio": {"data": fake_audio}}}))
+        first = await client.post("/text-to-speech", json={"text": "请稍等", "format": "mp3"})
+        second = await client.post("/text-to-speech", json={"text": " 请稍等 ", "format": "mp3"})
+        streamed = await client.get(
+            "/text-to-speech/stream", params={"text": "请稍等", "format": "mp3"}
+        )
+
+    assert route.call_count == 1
+    assert first.json() == second.json() == {"audio_base64": fake_audio}
+    assert streamed.content == b"cached-audio"
+
+    health = (await client.get("/health")).json()
+    assert health["tts_cache"]["hits"] == 2
+    assert health["tts_cache"]["misses"] == 1
+
+
+@pytest.mark.asyncio
+async def test_stream_speech_requests_pcm_at_output_rate():
+    import json
+
+    from backend.app.services.ali_bailian import stream_speech
+
+    pcm = b"\x01\x00" * 480
+    body = "data: " + json.dumps({"output": {"audio": {"data": base64.b64encode(pcm).decode()}}})
+    cache = TTSCache(1024 * 1024)
+    with respx.mock(assert_all_called=True) as router:
+        route = router.post(
+            "https://dashscope.test/api/v1/services/audio/dashscope/text_to_speech"
+        ).mock(
+            return_value=Response(200, text=body + "\n\n", headers={"Content-Type": "text/event-stream"})
+        )
+        chunks = [
+            chunk
+            async for chunk in stream_speech(
+                settings=TestSettings(), text="你好", audio_format="pcm", sample_rate=48000, cache=cache
+            )
+        ]
+
+    sent = json.loads(route.calls.last.request.content)
+    assert sent["input"]["format"] == "pcm"
+    assert sent["input"]["sample_rate"] == 48000
+    assert b"".join(chunks) == pcm
+    # Clips at other rates must not be served from the same cache entry.
+    assert cache.get(("你好", "", "pcm@48000")) == pcm
+    assert cache.get(("你好", "", "pcm")) is None
+
+
+@pytest.mark.asyncio
+async def test_text_to_speech_stream_http_caching(client, tmp_path):
+    from backend.app.services.tts_store import DiskTTSStore
+
+    disk_cache = TTSCache(0, disk=DiskTTSStore(tmp_path, max_bytes=1 << 20, max_age=3600))
+    app.dependency_overrides[get_tts_cache] = lambda: disk_cache
+    audio = bytes(range(100))
+
+    with respx.mock(assert_all_called=True) as router:
+        route = router.post(
+            "https://dashscope.test/api/v1/services/audio/dashscope/text_to_speech"
+        ).mock(
+            return_value=Response(
+                200, json={"output": {"audio": {"data": base64.b64encode(audio).decode()}}}
+            )
+        )
+        params = {"text": "欢迎", "format": "mp3"}
+        miss = await client.get("/text-to-speech/stream", params=params)
+        etag = miss.headers["etag"]
+        hit = await client.get("/text-to-speech/stream", params=params)
+        partial = await client.get(
+            "/text-to-speech/stream", params=params, headers={"Range": "bytes=10-19"}
+        )
+        not_modified = await client.get(
+            "/text-to-speech/stream", params=params, headers={"If-None-Match": etag}
+        )
+        unsatisfiable = await client.get(
+            "/text-to-speech/stream", params=params, headers={"Range": "bytes=500-"}
+        )
+
+    assert route.call_count == 1
+    assert miss.content == hit.content == audio
+    assert hit.headers["etag"] == etag
+    assert "max-age=" in hit.headers["cache-control"]
+    assert partial.status_code == 206
+    assert partial.content == audio[10:20]
+    assert partial.headers["content-range"] == "bytes 10-19/100"
+    assert not_modified.status_code == 304
+    assert unsatisfiable.status_code == 416
+    assert list(tmp_path.glob("*/*.mp3"))
+
+
+@pytest.mark.asyncio
+async def test_text_to_speech_post_ignores_if_none_match(client):
+    fake_audio = base64.b64encode(b"audio").decode()
+    with respx.mock(assert_all_called=True) as router:
+        router.post("https://dashscope.test/api/v1/services/audio/dashscope/text_to_speech").mock(
+            return_value=Response(200, json={"output": {"audio": {"data": fake_audio}}})
+        )
+        first = await client.post("/text-to-speech", json={"text": "你好"})
+    second = await client.post(
+        "/text-to-speech", json={"text": "你好"}, headers={"If-None-Match": first.headers["etag"]}
+    )
+
+    assert first.status_code == second.status_code == 200
+    assert second.json()["audio_base64"] == fake_audio
+
+
+@pytest.mark.asyncio
+async def test_chat_session_reuses_dify_conversation(client):
+    import json
+
+    with respx.mock(assert_all_called=True) as router:
+        route = router.post("http://dify.local/v1/chat-messages").mock(
+            return_value=Response(200, json={"answer": "好的", "conversation_id": "conv-1"})
+        )
+        first = await client.post("/chat", json={
+            "session_id": "s-1",
+            "user": "alice",
+            "messages": [{"role": "user", "content": "你好"}],
+        })
+        second = await client.post("/chat", json={
+            "session_id": "s-1",
+            "user": "alice",
+            "messages": [{"role": "user", "content": "再说一遍"}],
+        })
+
+    assert first.json()["conversation_id"] == "conv-1"
+    assert second.status_code == 200
+    first_payload, second_payload = (json.loads(call.request.content) for call in route.calls)
+    assert first_payload["conversation_id"] is None
+    assert "messages" in first_payload
+    assert second_payload["conversation_id"] == "conv-1"
+    assert second_payload["query"] == "再说一遍"
+    assert second_payload["user"] == "alice"
+    assert "messages" not in second_payload
+
+
+@pytest.mark.asyncio
+async def test_chat_session_recovers_from_stale_conversation(client):
+    import json
+
+    from backend.app.main import SessionStoreDep
+
+    sessions = app.dependency_overrides[SessionStoreDep.__metadata__[0].dependency]()
+    sessions.set(("livekit-web-assistant", "s-2"), "gone")
+    with respx.mock(assert_all_called=True) as router:
+        route = router.post("http://dify.local/v1/chat-messages").mock(side_effect=[
+            Response(404, json={"code": "not_found", "message": "Conversation Not Exists."}),
+            Response(200, json={"answer": "新的会话", "conversation_id": "conv-2"}),
+        ])
+        response = await client.post("/chat", json={
+            "session_id": "s-2",
+            "messages": [{"role": "user", "content": "你好"}],
+        })
+
+    assert response.status_code == 200
+    assert json.loads(route.calls.last.request.content)["conversation_id"] is None
+    assert sessions.get(("livekit-web-assistant", "s-2")) == "conv-2"
+
+
+@pytest.mark.asyncio
+async def test_chat_prefers_client_conversation_and_rebuilds_stale_history(client):
+    import json
+
+    history = [
+        {"role": "user", "content": "我叫小明"},
+        {"role": "assistant", "content": "你好，小明"},
+        {"role": "user", "content": "我叫什么？"},
+    ]
+    with respx.mock(assert_all_called=True) as router:
+        route = router.post("http://dify.local/v1/chat-messages").mock(side_effect=[
+            Response(200, json={"answer": "小明", "conversation_id": "conv-3"}),
+            Response(404, json={"code": "not_found", "message": "Conversation Not Exists."}),
+            Response(200, json={"answer": "小明", "conversation_id": "conv-4"}),
+        ])
+        # A session this worker has never seen still continues the conversation.
+        live = await client.post("/chat", json={
+            "session_id": "s-3", "conversation_id": "conv-3", "messages": history,
+        })
+        rebuilt = await client.post("/chat", json={"conversation_id": "gone", "messages": history})
+
+    live_payload, stale_payload, retry_payload = (
+        json.loads(call.request.content) for call in route.calls
+    )
+    assert live.json()["conversation_id"] == "conv-3"
+    assert live_payload["conversation_id"] == "conv-3"
+    assert "messages" not in live_payload
+    assert stale_payload["conversation_id"] == "gone"
+    assert rebuilt.json()["conversation_id"] == "conv-4"
+    assert retry_payload["conversation_id"] is None
+    assert len(retry_payload["messages"]) == 3
+
+
+@pytest.mark.asyncio
+async def test_worker_load_reports_the_tightest_resource(tmp_path):
+    from backend.app.services.worker_load import CPUSampler, WorkerLoad
+
+    stat = tmp_path / "stat"
+    stat.write_text("cpu  100 0 100 800 0 0 0 0 0 0\n")
+    cpu = CPUSampler(str(stat))
+    cpu.sample()
+    stat.write_text("cpu  400 0 200 900 0 0 0 0 0 0\n")  # 400 of 500 ticks busy
+    assert cpu.sample() == pytest.approx(0.8)
+
+    class _FixedCPU:
+        def sample(self):
+            return 0.1
+
+    load = WorkerLoad(
+        max_sessions=4, max_in_flight=4, cpu=_FixedCPU(), in_flight_requests=lambda: 1
+    )
+    assert load.snapshot()["load"] == pytest.approx(0.25)
+
+    async with load.session(), load.turn():
+        # The turn's own Dify request is the same work, not a second unit.
+        snapshot = load.snapshot()
+        assert snapshot["sessions"] == 1 and snapshot["in_flight"] == 1
+        assert snapshot["load"] == pytest.approx(0.25)
+
+    async with load.session(), load.session(), load.turn(), load.turn(), load.turn():
+        snapshot = load.snapshot()
+        assert snapshot["sessions"] == 2 and snapshot["in_flight"] == 3
+        assert snapshot["bottleneck"] == "in_flight"
+        assert snapshot["load"] == pytest.approx(0.75)
+
+    assert load.sessions == 0 and load.turns == 0
+    assert not load._monitors  # lag monitors stop with the last session
+
+
+@pytest.mark.asyncio
+async def test_metrics_count_upstream_calls_by_status(client):
+    from backend.app.services.metrics import UPSTREAM_REQUESTS
+
+    stt = {"service": "bailian_stt", "endpoint": "services/audio/dashscope/speech_to_text"}
+    before_ok = UPSTREAM_REQUESTS.value(status="200", **stt)
+    before_error = UPSTREAM_REQUESTS.value(status="500", **stt)
+    with respx.mock(assert_all_called=True) as router:
+        router.post("https://dashscope.test/api/v1/services/audio/dashscope/speech_to_text").mock(
+            side_effect=[
+                Response(200, json={"output": {"text": "好"}}),
+                Response(500, json={"message": "boom"}),
+            ]
+        )
+        payload = {"audio_base64": base64.b64encode(b"demo").decode(), "format": "pcm"}
+        assert (await client.post("/speech-to-text", json=payload)).status_code == 200
+        assert (await client.post("/speech-to-text", json=payload)).status_code == 400
+
+    assert UPSTREAM_REQUESTS.value(status="200", **stt) == before_ok + 1
+    assert UPSTREAM_REQUESTS.value(status="500", **stt) == before_error + 1
+
+    response = await client.get("/metrics")
+    assert response.status_code == 200
+    assert response.headers["content-type"].startswith("text/plain; version=0.0.4")
+    text = response.text
+    assert "# TYPE upstream_requests_total counter" in text
+    assert (
+        'upstream_requests_total{service="bailian_stt",'
+        'endpoint="services/audio/dashscope/speech_to_text",status="500"}'
+    ) in text
+    assert 'upstream_in_flight{service="bailian_stt"} 0' in text
+    assert "tts_cache_hit_ratio" in text
+    assert "# TYPE tts_cache_hits_total counter" in text
+
+
+def test_metrics_keep_every_increment_across_threads():
+    import threading
+
+    from backend.app.services.metrics import MetricsRegistry
+
+    registry = MetricsRegistry()
+    counter = registry.counter("demo_total", "Demo", ("kind",))
+    histogram = registry.histogram("demo_seconds", "Demo", ("kind",))
+
+    def record():
+        for index in range(2000):
+            counter.inc(kind=index % 3)
+            histogram.observe(1.0, kind=index % 3)
+
+    threads = [threading.Thread(target=record) for _ in range(8)]
+    for thread in threads:
+        thread.start()
+    for thread in threads:
+        thread.join()
+
+    assert sum(counter.value(kind=kind) for kind in range(3)) == 16000
+    assert sum(histogram.labels(kind=kind).count for kind in range(3)) == 16000
+
+
+def test_metrics_histogram_renders_cumulative_buckets():
+    from backend.app.services.metrics import MetricsRegistry
+
+    registry = MetricsRegistry()
+    histogram = registry.histogram("demo_seconds", "Demo", ("stage",), buckets=(0.01, 0.1, 1.0))
+    for value_ms in (2, 40, 60, 700, 5000):
+        histogram.observe(value_ms, stage="a")
+    lines = registry.render().splitlines()
+
+    assert 'demo_seconds_bucket{stage="a",le="0.01"} 1' in lines
+    assert 'demo_seconds_bucket{stage="a",le="0.1"} 3' in lines
+    assert 'demo_seconds_bucket{stage="a",le="1"} 4' in lines
+    assert 'demo_seconds_bucket{stage="a",le="+Inf"} 5' in lines
+    assert 'demo_seconds_count{stage="a"} 5' in lines
+    assert 'demo_seconds_sum{stage="a"} 5.802' in lines
+
+
+@pytest.mark.asyncio
+async def test_server_timing_breaks_down_chat_latency(client):
+    with respx.mock(assert_all_called=True) as router:
+        router.post("http://dify.local/v1/chat-messages").mock(
+            return_value=Response(200, json={"answer": "好"})
+        )
+        response = await client.post(
+            "/chat",
+            json={"messages": [{"role": "user", "content": "你好"}]},
+            headers={"Origin": "http://localhost"},
+        )
+
+    assert response.status_code == 200
+    entries = dict(
+        (part.split(";")[0].strip(), float(part.split("dur=")[1]))
+        for part in response.headers["server-timing"].split(",")
+    )
+    assert set(entries) == {"queue", "dify", "app"}
+    assert entries["app"] >= entries["dify"] >= 0
+    assert "Server-Timing" in response.headers["access-control-expose-headers"]
+    assert response.headers["timing-allow-origin"] == "*"
+
+    health = await client.get("/health")
+    assert health.headers["server-timing"].startswith("app;dur=")
+
+
+@pytest.mark.asyncio
+async def test_server_timing_allows_configured_origins():
+    from backend.app.services.server_timing import ServerTimingMiddleware
+
+    async def endpoint(scope, receive, send):
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    wrapped = ServerTimingMiddleware(
+        endpoint, timing_allow_origins=["https://a.example", "https://b.example"]
+    )
+    async with AsyncClient(transport=ASGITransport(app=wrapped), base_url="http://testserver") as client:
+        response = await client.get("/")
+
+    assert response.headers["timing-allow-origin"] == "https://a.example, https://b.example"
+    assert response.headers["server-timing"].startswith("app;dur=")
+
+
+@pytest.mark.asyncio
+async def test_traceparent_propagates_to_upstream_and_exports_spans(client, monkeypatch, tmp_path):
+    import json
+
+    from backend.app.services import tracing
+
+    exporter = tracing.FileSpanExporter(str(tmp_path / "spans.jsonl"), service_name="test")
+    monkeypatch.setattr(tracing, "get_span_exporter", lambda: exporter)
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    incoming = f"00-{trace_id}-00f067aa0ba902b7-01"
+
+    with respx.mock(assert_all_called=True) as router:
+        route = router.post("http://dify.local/v1/chat-messages").mock(
+            return_value=Response(200, json={"answer": "好"})
+        )
+        response = await client.post(
+            "/chat",
+            json={"messages": [{"role": "user", "content": "你好"}]},
+            headers={"traceparent": incoming},
+        )
+    assert response.status_code == 200
+
+    outbound = tracing.parse_traceparent(route.calls.last.request.headers["traceparent"])
+    assert outbound.trace_id == trace_id and outbound.span_id != "00f067aa0ba902b7"
+
+    exporter.flush()
+    (line,) = (tmp_path / "spans.jsonl").read_text().splitlines()
+    spans = {
+        span["kind"]: span
+        for span in json.loads(line)["resourceSpans"][0]["scopeSpans"][0]["spans"]
+    }
+    server, client_span = spans[tracing.SERVER], spans[tracing.CLIENT]
+    assert server["traceId"] == client_span["traceId"] == trace_id
+    assert server["parentSpanId"] == "00f067aa0ba902b7"
+    assert client_span["parentSpanId"] == server["spanId"]
+    assert client_span["spanId"] == outbound.span_id
+
+
+@pytest.mark.asyncio
+async def test_tracing_accepts_traceparent_query_parameter_for_media_requests():
+    from backend.app.services import tracing
+
+    parents = []
+
+    async def endpoint(scope, receive, send):
+        parents.append(tracing.current_span().parent_id)
+        await send({"type": "http.response.start", "status": 204, "headers": []})
+        await send({"type": "http.response.body", "body": b""})
+
+    transport = ASGITransport(app=tracing.TracingMiddleware(endpoint))
+    trace_id = "4bf92f3577b34da6a3ce929d0e0e4736"
+    async with AsyncClient(transport=transport, base_url="http://testserver") as client:
+        await client.get("/text-to-speech/stream", params={
+            "text": "好", "traceparent": f"00-{trace_id}-00f067aa0ba902b7-01",
+        })
+        await client.get("/text-to-speech/stream", params={
+            "traceparent": f"00-{trace_id}-00f067aa0ba902b7-01",
+        }, headers={"traceparent": f"00-{trace_id}-b7ad6b7169203331-01"})
+
+    assert parents == ["00f067aa0ba902b7", "b7ad6b7169203331"]  # the header wins
+
+
+def test_file_span_exporter_writes_off_the_calling_thread(tmp_path):
+    import threading
+
+    from backend.app.services import tracing
+
+    exporter = tracing.FileSpanExporter(str(tmp_path / "spans.jsonl"), service_name="test", batch_size=2)
+    writers = []
+    write = exporter._write
+    exporter._write = lambda batch: (writers.append(threading.current_thread()), write(batch))
+    for name in ("a", "b", "c"):
+        exporter.export(tracing.Span(name, tracing.SpanContext("1" * 32, "2" * 16)))
+    exporter.flush()
+
+    assert len(writers) == 2 and threading.current_thread() not in writers
+    assert len((tmp_path / "spans.jsonl").read_text().splitlines()) == 2
+
+
+def test_parse_traceparent_rejects_invalid_headers():
+    from backend.app.services.tracing import parse_traceparent
+
+    valid = "00-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-00"
+    assert parse_traceparent(valid).sampled is False
+    for header in (
+        None,
+        "garbage",
+        "ff-4bf92f3577b34da6a3ce929d0e0e4736-00f067aa0ba902b7-01",
+        "00-00000000000000000000000000000000-00f067aa0ba902b7-01",
+        "00-4bf92f3577b34da6a3ce929d0e0e4736-0000000000000000-01",
+        valid + "-extra",
+        valid.upper(),  # the spec only allows lowercase hex
+    ):
+        assert parse_traceparent(header) is None
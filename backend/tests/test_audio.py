@@ -0,0 +1,330 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from backend.app.config import Settings
+from backend.app.services.audio_buffer import PCMRingBuffer
+from backend.app.services.audio_dsp import PolyphaseResampler, resample_detached, to_target_rate
+from backend.app.services.audio_executor import (
+    AudioExecutor,
+    ProcessAudioExecutor,
+    ThreadAudioExecutor,
+)
+from backend.app.services.endpointing import EndpointDetector, classify_cue
+from backend.app.services.listener import ParticipantListener
+from backend.app.services.vad import VoiceActivityDetector
+
+RATE = 16000
+
+
+def _tone(ms, amplitude=8000, freq=220):
+    t = np.arange(RATE * ms // 1000) / RATE
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.int16)
+
+
+def _noise(ms, amplitude=30, seed=0):
+    rng = np.random.default_rng(seed)
+    return rng.normal(0, amplitude, RATE * ms // 1000).astype(np.int16)
+
+
+def _feed(vad, pcm, chunk_ms=10):
+    step = RATE * chunk_ms // 1000
+    utterances = []
+    for offset in range(0, pcm.size, step):
+        utterances.extend(vad.process(pcm[offset : offset + step].tobytes()))
+    return utterances + vad.flush()
+
+
+def test_vad_emits_one_utterance_per_speech_segment():
+    vad = VoiceActivityDetector(sample_rate=RATE, pre_roll_ms=100, hangover_ms=300)
+    pcm = np.concatenate([
+        _noise(500),
+        _tone(600),
+        _noise(800, seed=1),
+        _tone(400, freq=330),
+        _noise(600, seed=2),
+    ])
+
+    utterances = _feed(vad, pcm)
+
+    assert len(utterances) == 2
+    first, second = utterances
+    # Pre-roll reaches back before the onset; hangover extends past the end.
+    assert first.start_ms == 400
+    assert 1100 <= first.end_ms <= 1420
+    assert second.start_ms == 1800
+    assert first.pcm.dtype == np.int16
+    assert first.pcm.size == (first.end_ms - first.start_ms) * RATE // 1000
+
+
+def test_vad_ignores_clicks_and_background_noise():
+    vad = VoiceActivityDetector(sample_rate=RATE, min_speech_ms=200)
+    pcm = np.concatenate([_noise(1000), _tone(60), _noise(1000, seed=3)])
+
+    assert _feed(vad, pcm) == []
+
+
+def test_ring_buffer_returns_contiguous_views_across_the_wrap():
+    ring = PCMRingBuffer(8, sample_rate=1000)
+    assert ring.write(np.arange(6, dtype=np.int16)) == 0
+    assert ring.write(np.arange(6, 12, dtype=np.int16).tobytes()) == 6
+
+    window = ring.view(5, 11)  # wraps around the physical end
+    assert window.tolist() == [5, 6, 7, 8, 9, 10]
+    assert np.shares_memory(window, ring._data)
+    assert not window.flags.writeable
+    with pytest.raises(ValueError):
+        ring.view(2, 6)  # already overwritten
+    ring.write(np.arange(100, 120, dtype=np.int16))  # larger than the ring
+    assert ring.written == 32
+    assert ring.view(ring.oldest, ring.written).tolist() == list(range(112, 120))
+    assert ring.stats() == {"capacity_ms": 8, "bytes": 32, "buffered_ms": 8, "written_ms": 32}
+
+
+def test_vad_utterances_are_views_into_a_bounded_buffer():
+    vad = VoiceActivityDetector(sample_rate=RATE, max_utterance_ms=1000, buffer_ms=3000)
+    pcm = np.concatenate([_noise(400), _tone(600), _noise(600, seed=5)] * 4)
+
+    utterances = _feed(vad, pcm)
+
+    assert len(utterances) == 4
+    assert vad.buffer.nbytes == 2 * 2 * 3 * RATE  # mirrored int16, never grows
+    latest = utterances[-1]
+    assert latest.valid and np.shares_memory(latest.pcm, vad.buffer._data)
+    assert not utterances[0].valid  # the ring has wrapped past it
+
+
+def _sine(rate, freq, seconds=1.0, amplitude=8000):
+    t = np.arange(int(rate * seconds)) / rate
+    return (amplitude * np.sin(2 * np.pi * freq * t)).astype(np.int16)
+
+
+def _rms(pcm):
+    return float(np.sqrt(np.mean(pcm.astype(np.float64) ** 2)))
+
+
+@pytest.mark.parametrize("rate", [48000, 44100, 24000])
+def test_resampler_converts_to_16k_and_rejects_aliases(rate):
+    speech_band = to_target_rate(_sine(rate, 440), rate)
+    alias = to_target_rate(_sine(rate, 10000), rate)  # above the new Nyquist
+
+    assert speech_band.dtype == np.int16
+    assert abs(speech_band.size - 16000) <= 1
+    assert _rms(speech_band[200:]) == pytest.approx(_rms(_sine(16000, 440)), rel=0.03)
+    assert _rms(alias[200:]) < 0.03 * _rms(speech_band[200:])
+
+
+def test_resampler_is_seamless_across_frames_and_downmixes():
+    mono = _sine(48000, 300)
+    stereo = np.stack([mono, mono], axis=1).ravel()
+    resampler = PolyphaseResampler(48000, channels=2)
+
+    streamed = np.concatenate(
+        [resampler.process(stereo[i : i + 960].tobytes()) for i in range(0, stereo.size, 960)]
+    )
+
+    assert np.array_equal(streamed, to_target_rate(mono, 48000))
+    assert streamed.nbytes * 6 == stereo.nbytes
+
+
+@pytest.mark.asyncio
+@pytest.mark.parametrize("executor_cls", [AudioExecutor, ThreadAudioExecutor, ProcessAudioExecutor])
+async def test_executors_resample_and_segment_like_the_inline_path(executor_cls):
+    executor = executor_cls() if executor_cls is AudioExecutor else executor_cls(1)
+    mono = np.concatenate([_noise(300), _tone(600), _noise(900, seed=1)])
+    stereo = np.repeat(_sine(48000, 300), 2)
+    try:
+        resampler = PolyphaseResampler(48000, channels=2)
+        chunks = []
+        for i in range(0, stereo.size, 1920):
+            out, resampler = await executor.run(resample_detached, stereo[i : i + 1920], resampler)
+            chunks.append(out)
+
+        vad = VoiceActivityDetector(sample_rate=RATE, hangover_ms=300)
+        utterances = []
+        for i in range(0, mono.size, 320):
+            utterances += await vad.process_with(executor.run, mono[i : i + 320])
+    finally:
+        executor.shutdown()
+
+    # State (filter history, noise floor) survives the round trip to workers.
+    assert np.array_equal(np.concatenate(chunks), to_target_rate(_sine(48000, 300), 48000))
+    expected = _feed(VoiceActivityDetector(sample_rate=RATE, hangover_ms=300), mono, chunk_ms=20)
+    assert utterances and [(u.start_ms, u.end_ms) for u in utterances] == [(u.start_ms, u.end_ms) for u in expected]
+
+
+@pytest.mark.parametrize(
+    "text, cue",
+    [
+        ("今天天气怎么样呢", "question_particle"),
+        ("你能帮我订票吗？", "question_particle"),
+        ("我想订一张去上海的票。", "final_punctuation"),
+        ("我想订一张票，然后", "continuation"),
+        ("I want a ticket um", "continuation"),
+        ("", "silence"),
+    ],
+)
+def test_classify_cue(text, cue):
+    assert classify_cue(text) == cue
+
+
+def test_endpointer_adapts_hangover_to_speaker_pauses():
+    decisions = []
+    detector = EndpointDetector(base_hangover_ms=500, min_ms=200, max_ms=1200, on_decision=decisions.append)
+    for pause in (600, 700, 650, 680):
+        detector.observe_pause("slow", pause)
+    for pause in (120, 140, 100, 160):
+        detector.observe_pause("fast", pause)
+
+    assert detector.hangover_ms("new") == 500
+    assert detector.hangover_ms("slow") > 700
+    assert detector.hangover_ms("fast") < 300
+    assert not detector.update("slow", 600).end_of_turn
+    assert detector.update("fast", 300).end_of_turn
+    # A question ends the turn sooner, a trailing filler waits longer.
+    assert detector.update("new", 260, "你好吗").end_of_turn
+    assert not detector.update("new", 700, "我想问一下，那个").end_of_turn
+    assert [d.speaker for d in decisions] == ["fast", "new"]
+    assert decisions[-1].cue == "question_particle"
+
+
+class _FakeRecognizer:
+    def __init__(self, partial, final):
+        self.partial, self.final = partial, final
+        self.audio = bytearray()
+        self._heard = asyncio.Event()
+        self._finished = asyncio.Event()
+
+    async def __aenter__(self):
+        return self
+
+    async def __aexit__(self, *exc_info):
+        pass
+
+    async def send_audio(self, chunk):
+        self.audio.extend(chunk)
+        self._heard.set()
+
+    async def finish(self):
+        self._finished.set()
+
+    async def results(self):
+        from backend.app.services.ali_bailian import RecognitionResult
+
+        await self._heard.wait()
+        yield RecognitionResult(text=self.partial, is_final=False)
+        await self._finished.wait()
+        yield RecognitionResult(text=self.final, is_final=True)
+
+
+async def _listen(partial, **listener_options):
+    settings = Settings(vad_pre_roll_ms=100, vad_hangover_ms=600, endpoint_min_ms=200)
+    recognizers, turns = [], []
+
+    def factory(sample_rate):
+        recognizers.append(_FakeRecognizer(partial, partial + "？"))
+        return recognizers[-1]
+
+    async def on_turn(turn):
+        turns.append((turn, await turn.transcript()))
+
+    async def no_batch(utterance):
+        raise AssertionError("streaming transcript expected")
+
+    listener = ParticipantListener(
+        settings,
+        "alice",
+        endpointer=EndpointDetector(base_hangover_ms=600, min_ms=200),
+        on_speech_start=lambda: asyncio.sleep(0),
+        on_turn=on_turn,
+        transcribe=no_batch,
+        recognizer_factory=factory,
+        **listener_options,
+    )
+    pcm = np.concatenate([_noise(300), _tone(600), _noise(1500, seed=4)])
+    step = RATE // 100
+    for offset in range(0, pcm.size, step):
+        await listener.push(pcm[offset : offset + step], RATE)
+        await asyncio.sleep(0)
+    await listener.flush()
+    return recognizers, turns
+
+
+@pytest.mark.asyncio
+async def test_listener_ends_questions_sooner_using_partial_transcripts():
+    recognizers, turns = await _listen("明天会下雨吗")
+    _, baseline = await _listen("明天我要去")
+
+    assert len(turns) == 1
+    turn, transcript = turns[0]
+    assert transcript == "明天会下雨吗？"
+    assert turn.decision.cue == "question_particle"
+    # Pre-roll and speech were streamed to the recognizer while talking.
+    assert len(recognizers[0].audio) >= 600 * RATE // 1000 * 2
+    assert turn.utterance.end_ms < baseline[0][0].utterance.end_ms
+
+
+@pytest.mark.asyncio
+async def test_listener_reports_stable_partials_once_per_text():
+    stable = []
+
+    async def on_stable_partial(text):
+        stable.append(text)
+
+    _, turns = await _listen("订一张票", on_stable_partial=on_stable_partial, stable_ms=0)
+
+    assert stable == ["订一张票"]
+    assert turns[0][1] == "订一张票？"
+
+
+@pytest.mark.asyncio
+async def test_queued_turn_keeps_its_audio_after_the_ring_buffer_wraps():
+    from backend.app.services.turns import RoomScheduler
+
+    settings = Settings(
+        vad_pre_roll_ms=100, vad_hangover_ms=300, vad_max_utterance_ms=1000,
+        agent_audio_buffer_ms=2000,
+    )
+    room = RoomScheduler(max_concurrent=1)
+    busy = asyncio.Event()
+    queued, replies, heard = [], [], {}
+
+    async def transcribe(utterance):
+        assert utterance.valid
+        return f"{utterance.pcm.size} samples"
+
+    async def reply(turn):
+        replies.append((turn, await turn.transcript()))
+
+    async def on_turn(turn):
+        heard["pcm"] = turn.utterance.pcm.copy()
+        queued.append(asyncio.create_task(room.run("alice", reply(turn), on_queued=turn.detach)))
+
+    listener = ParticipantListener(
+        settings,
+        "alice",
+        endpointer=EndpointDetector(base_hangover_ms=300, min_ms=200),
+        on_speech_start=lambda: asyncio.sleep(0),
+        on_turn=on_turn,
+        transcribe=transcribe,
+    )
+    # Bob's reply holds the room's only slot while Alice keeps talking.
+    bob = asyncio.create_task(room.run("bob", busy.wait()))
+    await asyncio.sleep(0)
+    pcm = np.concatenate([_noise(300), _tone(600), _noise(600, seed=4)])
+    more = _noise(3000, seed=5)  # keeps filling the ring while the turn waits
+    step = RATE // 100
+    for audio in (pcm, more):
+        for offset in range(0, audio.size, step):
+            await listener.push(audio[offset : offset + step], RATE)
+            await asyncio.sleep(0)
+    assert listener.stats()["written_ms"] > settings.agent_audio_buffer_ms + 1500
+    assert room.waiting == 1
+
+    busy.set()
+    await asyncio.gather(bob, *queued)
+
+    [(turn, transcript)] = replies
+    assert transcript == f"{heard['pcm'].size} samples"
+    assert np.array_equal(turn.utterance.pcm, heard["pcm"])
@@ -0,0 +1,36 @@
+from backend.app.services.sessions import SessionStore
+
+
+class _Clock:
+    def __init__(self):
+        self.now = 0.0
+
+    def __call__(self):
+        return self.now
+
+
+def test_sessions_expire_after_idle_ttl():
+    clock = _Clock()
+    store = SessionStore(ttl=10, max_sessions=10, clock=clock)
+    store.set(("u", "a"), "conv-a")
+    store.set(("u", "b"), "conv-b")
+
+    clock.now = 8
+    assert store.get(("u", "a")) == "conv-a"  # refreshes "a"
+    clock.now = 15
+
+    assert store.get(("u", "b")) is None
+    assert store.get(("u", "a")) == "conv-a"
+    assert store.stats()["expired"] == 1
+
+
+def test_sessions_evict_least_recently_used():
+    store = SessionStore(ttl=60, max_sessions=2)
+    store.set(("u", "a"), "conv-a")
+    store.set(("u", "b"), "conv-b")
+    store.get(("u", "a"))
+    store.set(("u", "c"), "conv-c")
+
+    assert store.get(("u", "b")) is None
+    assert store.get(("u", "a")) == "conv-a"
+    assert store.stats()["evicted"] == 1
@@ -0,0 +1,448 @@
+import asyncio
+
+import numpy as np
+import pytest
+
+from backend.app.services import timeline as stages
+from backend.app.services.audio_output import PacedPublisher, StreamedClip
+from backend.app.services.histogram import LatencyHistogram
+from backend.app.services.speculation import Speculator
+from backend.app.services.speech_pipeline import SpeechPipeline
+from backend.app.services.text_segmenter import SentenceSegmenter
+from backend.app.services.timeline import LatencyHistograms, TurnTimeline, current_timeline
+from backend.app.services.turns import RoomScheduler, TurnController
+
+
+def test_segmenter_cuts_on_chinese_and_english_boundaries():
+    segmenter = SentenceSegmenter()
+    segments = []
+    for delta in ["你好", "！今天", "天气不错。", "It costs 3.5 dollars.", " Bye", "\n好的"]:
+        segments.extend(segmenter.feed(delta))
+    segments.extend(segmenter.flush())
+
+    assert segments == ["你好！", "今天天气不错。", "It costs 3.5 dollars.", "Bye", "好的"]
+
+
+def test_segmenter_caps_long_runs_at_soft_boundary():
+    segmenter = SentenceSegmenter(max_chars=10)
+    segments = segmenter.feed("一二三四五，六七八九十十一十二")
+
+    assert segments == ["一二三四五，"]
+    assert segmenter.flush() == ["六七八九十十一十二"]
+
+
+async def _deltas(*parts, delay=0.0):
+    for part in parts:
+        await asyncio.sleep(delay)
+        yield part
+
+
+@pytest.mark.asyncio
+async def test_pipeline_synthesizes_ahead_and_plays_in_order():
+    log = []
+
+    async def synthesize(text):
+        log.append(("synth-start", text))
+        await asyncio.sleep(0.01)
+        log.append(("synth-end", text))
+        return text.upper()
+
+    async def play(audio):
+        log.append(("play-start", audio))
+        await asyncio.sleep(0.03)
+        log.append(("play-end", audio))
+
+    pipeline = SpeechPipeline(synthesize=synthesize, play=play)
+    spoken = await pipeline.run(_deltas("a. ", "b. ", "c."))
+
+    assert spoken == "a. b. c."
+    played = [item for kind, item in log if kind == "play-start"]
+    assert played == ["A.", "B.", "C."]
+    # Segment two is synthesized while segment one is still playing.
+    assert log.index(("synth-end", "b.")) < log.index(("play-end", "A."))
+
+
+@pytest.mark.asyncio
+async def test_pipeline_cancellation_drops_queued_segments():
+    played = []
+    started = asyncio.Event()
+
+    async def synthesize(text):
+        return text
+
+    async def play(audio):
+        played.append(audio)
+        started.set()
+        await asyncio.sleep(1)
+
+    pipeline = SpeechPipeline(synthesize=synthesize, play=play)
+    task = asyncio.create_task(pipeline.run(_deltas("一。", "二。", "三。")))
+    await started.wait()
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert played == ["一。"]
+
+
+class _FakeTime:
+    def __init__(self):
+        self.now = 0.0
+        self.sleeps = []
+
+    def clock(self):
+        return self.now
+
+    async def sleep(self, delay):
+        self.sleeps.append(round(delay, 3))
+        self.now += delay
+
+
+@pytest.mark.asyncio
+async def test_paced_publisher_emits_fixed_frames_on_schedule():
+    fake = _FakeTime()
+    frames = []
+
+    async def capture(frame):
+        frames.append((round(fake.now, 3), frame.copy()))
+
+    publisher = PacedPublisher(
+        capture, sample_rate=48000, frame_ms=20, lead_ms=40, clock=fake.clock, sleep=fake.sleep
+    )
+    pcm = np.arange(960 * 5 + 100, dtype=np.int16)
+    # Odd-sized byte chunks: samples split across chunks are reassembled.
+    data = pcm.tobytes()
+    for offset in range(0, len(data), 1001):
+        await publisher.write(data[offset : offset + 1001])
+    await publisher.finish()
+
+    assert [frame.size for _, frame in frames] == [960] * 6
+    assert np.array_equal(np.concatenate([f for _, f in frames])[: pcm.size], pcm)
+    assert not frames[-1][1][100:].any()  # trailing frame padded with silence
+    # Two frames of lead, then one frame per 20 ms of audio.
+    assert [t for t, _ in frames] == [0.0, 0.0, 0.0, 0.02, 0.04, 0.06]
+
+
+@pytest.mark.asyncio
+async def test_paced_publisher_resyncs_instead_of_bursting():
+    fake = _FakeTime()
+    sent = []
+
+    async def capture(frame):
+        sent.append(round(fake.now, 3))
+
+    publisher = PacedPublisher(
+        capture, sample_rate=16000, frame_ms=10, lead_ms=0, max_lag_ms=50,
+        clock=fake.clock, sleep=fake.sleep,
+    )
+    await publisher.write(np.zeros(320, np.int16))
+    fake.now += 1.0  # the TTS stream stalled
+    await publisher.write(np.zeros(320, np.int16))
+
+    assert publisher.resyncs == 1
+    assert sent == [0.0, 0.01, 1.02, 1.03]
+
+
+@pytest.mark.asyncio
+async def test_paced_publisher_reports_first_frame_before_pacing():
+    fake = _FakeTime()
+    first_frames = []
+
+    async def capture(frame):
+        pass
+
+    publisher = PacedPublisher(
+        capture, sample_rate=16000, frame_ms=10, lead_ms=0, clock=fake.clock, sleep=fake.sleep,
+        on_first_frame=lambda: first_frames.append(round(fake.now, 3)),
+    )
+    # One write of three frames: the stamp must not wait for the whole chunk.
+    await publisher.write(np.zeros(480, np.int16))
+    await publisher.finish()
+    await publisher.write(np.zeros(100, np.int16))  # next clip, shorter than a frame
+    await publisher.finish()
+
+    assert first_frames == [0.0, 0.03]
+
+
+@pytest.mark.asyncio
+async def test_pipeline_closes_streamed_clips_on_barge_in():
+    closed = []
+    started = asyncio.Event()
+
+    async def chunks(text):
+        try:
+            yield text.encode()
+            await asyncio.sleep(10)
+        finally:
+            closed.append(text)
+
+    async def synthesize(text):
+        return await StreamedClip.open(chunks(text))
+
+    async def play(clip):
+        async for _ in clip:
+            started.set()
+
+    pipeline = SpeechPipeline(synthesize=synthesize, play=play)
+    task = asyncio.create_task(pipeline.run(_deltas("一。", "二。")))
+    await started.wait()
+    await asyncio.sleep(0)
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    # The playing clip and the prefetched one both released their streams.
+    assert sorted(closed) == ["一。", "二。"]
+
+
+@pytest.mark.asyncio
+async def test_pipeline_closes_clip_blocked_behind_a_full_queue():
+    opened, closed = [], []
+    started = asyncio.Event()
+
+    async def chunks(text):
+        try:
+            yield text.encode()
+            await asyncio.sleep(10)
+        finally:
+            closed.append(text)
+
+    async def synthesize(text):
+        opened.append(text)
+        return await StreamedClip.open(chunks(text))
+
+    async def play(clip):
+        async for _ in clip:
+            started.set()
+
+    # One clip playing, one prefetched, the third waiting for queue space.
+    pipeline = SpeechPipeline(synthesize=synthesize, play=play, prefetch=1)
+    task = asyncio.create_task(pipeline.run(_deltas("一。", "二。", "三。")))
+    await started.wait()
+    while len(opened) < 3:
+        await asyncio.sleep(0)
+    await asyncio.sleep(0.01)  # the third clip is open and blocked on the queue
+    task.cancel()
+    with pytest.raises(asyncio.CancelledError):
+        await task
+
+    assert sorted(closed) == ["一。", "三。", "二。"]
+
+
+@pytest.mark.asyncio
+async def test_barge_in_flushes_audio_cancels_reply_and_stops_dify():
+    stopped, flushed, reports = [], [], []
+    closed = asyncio.Event()
+
+    async def stop(task_id, user):
+        stopped.append((task_id, user))
+
+    async def record(interruption):
+        reports.append(interruption)
+
+    turns = TurnController(
+        stop_generation=stop, flush_playback=lambda: flushed.append(True), on_interrupted=record
+    )
+
+    async def reply():
+        turns.track_generation("t-1", "alice")
+        try:
+            await asyncio.sleep(10)  # streaming from Dify
+        finally:
+            closed.set()
+
+    await turns.start(reply())
+    await asyncio.sleep(0)
+    interruption = await turns.interrupt()
+    await turns.aclose()
+
+    assert closed.is_set() and not turns.active
+    assert flushed and stopped == [("t-1", "alice")]
+    assert reports == [interruption]
+    assert 0 <= interruption.cancel_to_silence_ms < 1000
+    assert await turns.interrupt() is None  # nothing left to cancel
+
+
+@pytest.mark.asyncio
+async def test_turn_controller_start_interrupts_the_running_turn():
+    cancelled = []
+
+    async def stop(task_id, user):
+        pass
+
+    turns = TurnController(stop_generation=stop)
+
+    async def reply(name):
+        try:
+            await asyncio.sleep(10)
+        except asyncio.CancelledError:
+            cancelled.append(name)
+            raise
+
+    first = await turns.start(reply("first"))
+    await asyncio.sleep(0)
+    second = await turns.start(reply("second"))
+    await asyncio.sleep(0)
+
+    assert first.cancelled() and cancelled == ["first"]
+    assert turns.active and not second.done()
+    await turns.aclose()
+    assert cancelled == ["first", "second"]
+
+
+def _speculator(started, stopped, warmed, closed):
+    async def start(text):
+        started.append(text)
+        try:
+            yield {"event": "delta", "text": "会的。", "task_id": "t-" + text}
+            yield {"event": "delta", "text": "记得带伞。", "task_id": "t-" + text}
+            await asyncio.sleep(0.01)
+            yield {"event": "done", "reply": "会的。记得带伞。", "task_id": "t-" + text}
+        finally:
+            closed.append(text)
+
+    async def stop(task_id):
+        stopped.append(task_id)
+
+    async def warm(sentence):
+        warmed.append(sentence)
+
+    return Speculator(start=start, stop=stop, warm=warm)
+
+
+@pytest.mark.asyncio
+async def test_speculation_hit_replays_the_early_reply():
+    started, stopped, warmed, closed = [], [], [], []
+    speculator = _speculator(started, stopped, warmed, closed)
+
+    await speculator.speculate("明天会下雨吗")
+    await speculator.speculate("明天会下雨吗。")  # same key, no second request
+    await asyncio.sleep(0)
+    reply = await speculator.claim("明天会下雨吗？")
+    events = [event async for event in reply.events()]
+
+    assert started == ["明天会下雨吗"]
+    assert [event["event"] for event in events] == ["delta", "delta", "done"]
+    assert warmed == ["会的。"] and stopped == []
+    stats = speculator.stats()
+    assert stats["hits"] == 1 and stats["hit_rate"] == 1.0
+    assert stats["saved_ms_total"] >= 0
+
+
+@pytest.mark.asyncio
+async def test_speculation_miss_cancels_and_stops_dify():
+    started, stopped, warmed, closed = [], [], [], []
+    speculator = _speculator(started, stopped, warmed, closed)
+
+    await speculator.speculate("明天会下雨")
+    await asyncio.sleep(0)
+    assert await speculator.claim("明天会下雨吗后天呢") is None
+    await speculator.speculate("后天呢")
+    await speculator.aclose()
+
+    assert closed == ["明天会下雨"]  # the stream was closed on the miss
+    assert stopped == ["t-明天会下雨"]  # the second request never started
+    assert speculator.stats()["misses"] == 2 and speculator.stats()["hit_rate"] == 0.0
+
+
+@pytest.mark.asyncio
+async def test_room_scheduler_caps_turns_and_serves_quiet_speakers_first():
+    room = RoomScheduler(max_concurrent=1)
+    order = []
+    gate = asyncio.Event()
+
+    async def reply(name):
+        order.append(name)
+        if name == "alice-1":
+            await gate.wait()
+
+    first = asyncio.create_task(room.run("alice", reply("alice-1")))
+    await asyncio.sleep(0)
+    stale = asyncio.create_task(room.run("alice", reply("alice-2")))
+    await asyncio.sleep(0)
+    latest = asyncio.create_task(room.run("alice", reply("alice-3")))
+    bob = asyncio.create_task(room.run("bob", reply("bob")))
+    await asyncio.sleep(0)
+    assert room.running == 1 and room.waiting == 2
+
+    gate.set()
+    await asyncio.gather(first, bob, latest)
+    with pytest.raises(asyncio.CancelledError):
+        await stale
+
+    # Alice's newer turn replaced her waiting one, and Bob - not served yet -
+    # goes first although he queued after her.
+    assert order == ["alice-1", "bob", "alice-3"]
+    assert room.stats()["replaced"] == 1 and room.running == 0
+
+
+@pytest.mark.asyncio
+async def test_room_scheduler_gives_one_reply_the_floor_at_a_time():
+    room = RoomScheduler(max_concurrent=2)
+    played = []
+
+    async def play(audio):
+        played.append(audio)
+        await asyncio.sleep(0.01)
+
+    async def reply(speaker, segments):
+        async with room.voice(speaker, play) as speak:
+            for segment in segments:
+                await speak(segment)
+                assert room.floor_owner == speaker
+
+    await asyncio.gather(
+        room.run("alice", reply("alice", ["a1", "a2", "a3"])),
+        room.run("bob", reply("bob", ["b1", "b2"])),
+    )
+
+    assert played == ["a1", "a2", "a3", "b1", "b2"]
+    assert room.floor_owner is None
+
+
+def test_latency_histogram_percentiles_stay_within_bucket_error():
+    histogram = LatencyHistogram()
+    for value in range(1, 1001):  # 1..1000 ms
+        histogram.observe(float(value))
+
+    assert histogram.count == 1000
+    for q, expected in [(0.5, 500), (0.95, 950), (0.99, 990)]:
+        assert histogram.percentile(q) == pytest.approx(expected, rel=0.035)
+    assert histogram.snapshot()["max_ms"] == 1000
+    assert sum(count for _, count in histogram.buckets()) == 1000
+
+
+@pytest.mark.asyncio
+async def test_turn_timeline_follows_the_turn_into_pipeline_tasks():
+    now = [10.0]
+    timeline = TurnTimeline("alice", speech_end=9.5, clock=lambda: now[0])
+    timeline.mark(stages.TURN_END)
+
+    async def synthesize(text):
+        now[0] += 0.2
+        stages.mark(stages.TTS_REQUEST, index=current_timeline().count(stages.TTS_REQUEST))
+        now[0] += 0.1
+        stages.mark(stages.TTS_FIRST_BYTE)
+        return text
+
+    async def play(audio):
+        current_timeline().mark_once(stages.FIRST_FRAME)
+        now[0] += 0.5
+
+    async def run_turn():
+        stages.set_current(timeline)
+        await SpeechPipeline(synthesize=synthesize, play=play).run(_deltas("一。", "二。"))
+        timeline.mark(stages.PLAYBACK_END)
+
+    await asyncio.create_task(run_turn())
+    histograms = LatencyHistograms()
+    histograms(timeline)
+
+    assert stages.current_timeline() is None  # the turn's context did not leak
+    assert timeline.count(stages.TTS_REQUEST) == 2
+    latency = timeline.latencies()
+    assert latency["endpoint_ms"] == 500
+    assert latency["tts_first_byte_ms"] == pytest.approx(100)
+    assert latency["first_audio_ms"] == pytest.approx(800)
+    assert histograms.snapshot()["first_audio_ms"]["count"] == 1
+    assert timeline.as_dict()["outcome"] == "completed"
@@ -0,0 +1,103 @@
+import pytest
+
+from backend.app.services.tts_cache import TTSCache, cache_key
+
+
+def test_cache_key_normalises_text():
+    assert cache_key(" 请稍等　 ", None, "MP3") == cache_key("请稍等", "", "mp3")
+    assert cache_key("ＡＢＣ  好", "v", "mp3") == ("ABC 好", "v", "mp3")
+    assert cache_key("你好", "a", "mp3") != cache_key("你好", "b", "mp3")
+
+
+def test_cache_evicts_least_recently_used_by_bytes():
+    cache = TTSCache(max_bytes=10)
+    cache.put(("a", "", "mp3"), b"1234")
+    cache.put(("b", "", "mp3"), b"5678")
+    assert cache.get(("a", "", "mp3")) == b"1234"  # "b" is now least recent
+
+    cache.put(("c", "", "mp3"), b"90ab")
+
+    assert cache.get(("b", "", "mp3")) is None
+    assert cache.get(("c", "", "mp3")) == b"90ab"
+    stats = cache.stats()
+    assert stats["bytes"] == 8
+    assert stats["entries"] == 2
+    assert stats["evictions"] == 1
+    assert (stats["hits"], stats["misses"]) == (2, 1)
+
+
+def test_cache_skips_oversized_entries():
+    cache = TTSCache(max_bytes=4)
+    cache.put(("a", "", "mp3"), b"12")
+    cache.put(("huge", "", "mp3"), b"123456")
+
+    assert cache.get(("huge", "", "mp3")) is None
+    assert cache.get(("a", "", "mp3")) == b"12"
+
+
+def test_disk_store_survives_restart_and_promotes(tmp_path):
+    from backend.app.services.tts_store import DiskTTSStore
+
+    key = cache_key("欢迎光临", None, "mp3")
+    first = TTSCache(1024, disk=DiskTTSStore(tmp_path, max_bytes=1024, max_age=60))
+    first.put(key, b"persisted")
+
+    restarted = TTSCache(1024, disk=DiskTTSStore(tmp_path, max_bytes=1024, max_age=60))
+    assert restarted.get(key) == b"persisted"
+    assert restarted.disk.hits == 1
+    assert restarted.get(key) == b"persisted"  # now served from memory
+    assert restarted.disk.hits == 1
+    assert not list(tmp_path.glob("*/.tmp-*"))
+
+
+def test_disk_store_evicts_by_age_and_size(tmp_path):
+    import os
+    import time
+
+    from backend.app.services.tts_store import DiskTTSStore
+
+    store = DiskTTSStore(tmp_path, max_bytes=10, max_age=5000, evict_every=100)
+    keys = [cache_key(text, None, "mp3") for text in ("旧", "甲", "乙", "丙")]
+    now = time.time()
+    for offset, key in enumerate(keys):
+        store.put(key, b"1234")
+        os.utime(store.path_for(key), (now - 7200 + offset * 3000, now - 7200 + offset * 3000))
+
+    # "旧" is past max_age; of the rest the least recently used goes until <= 10 bytes.
+    assert store.evict() == 2
+    assert store.get(keys[0]) is None
+    assert store.get(keys[1]) is None
+    assert store.get(keys[3]) == b"1234"
+
+
+@pytest.mark.asyncio
+async def test_async_access_reads_and_writes_disk_tier(tmp_path):
+    from backend.app.services.tts_store import DiskTTSStore
+
+    key = cache_key("稍后再试", None, "mp3")
+    await TTSCache(1024, disk=DiskTTSStore(tmp_path, max_bytes=1024, max_age=60)).aput(key, b"clip")
+
+    restarted = TTSCache(1024, disk=DiskTTSStore(tmp_path, max_bytes=1024, max_age=60))
+    assert await restarted.aget(key) == b"clip"
+    assert await restarted.aget(key) == b"clip"
+    assert await restarted.aget(cache_key("没有", None, "mp3")) is None
+    assert (restarted.hits, restarted.misses, restarted.disk.hits) == (2, 1, 1)
+
+
+def test_disk_store_sweeps_stale_temporary_files(tmp_path):
+    import os
+    import time
+
+    from backend.app.services.tts_store import STALE_TMP_SECONDS, DiskTTSStore
+
+    (tmp_path / "ab").mkdir()
+    stale, fresh = tmp_path / "ab" / ".tmp-crashed", tmp_path / "ab" / ".tmp-writing"
+    stale.write_bytes(b"partial")
+    fresh.write_bytes(b"partial")
+    old = time.time() - STALE_TMP_SECONDS - 60
+    os.utime(stale, (old, old))
+
+    DiskTTSStore(tmp_path, max_bytes=1024, max_age=60)
+
+    assert not stale.exists()
+    assert fresh.exists()  # another worker may still rename it
@@ -0,0 +1,330 @@
+"""Throughput and tail latency of the HTTP API against latency-injecting mocks.
+
+Starts local stand-ins for Dify and Bailian (see :mod:`benchmarks.mock_upstreams`),
+runs the real app under uvicorn in a subprocess pointed at them, and drives
+``/chat``, ``/speech-to-text`` and ``/text-to-speech`` with a fixed number of
+concurrent clients per level.  For every endpoint and level it reports
+throughput, p50/p95/p99 latency, and the overhead the API adds on top of the
+mocks: the client-observed latency minus the upstream time the app reports
+in its ``Server-Timing`` header.  Run from the repository root::
+
+    python -m benchmarks.api_latency --concurrency 1 8 32 --requests 200 \\
+        --dify-latency lognormal:300:0.4 --output bench.json
+
+Pass ``--baseline`` with an earlier output file to compare; the command exits
+with status 1 when a latency percentile, the overhead or the throughput got
+worse than ``--tolerance`` (and by more than ``--min-delta-ms``).
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import base64
+import json
+import os
+import platform
+import subprocess
+import sys
+import time
+from typing import Any, Callable, Dict, List, Optional, Sequence, Tuple
+
+import httpx
+
+from benchmarks.mock_upstreams import (
+    BAILIAN_STT,
+    BAILIAN_TTS,
+    DIFY_CHAT,
+    LatencyDistribution,
+    MockProfile,
+    MockServer,
+    create_mock_app,
+    free_port,
+)
+
+UPSTREAM_TIMINGS = ("dify", "stt", "tts")
+
+# Regressions are checked on these (section, statistic) pairs.
+CHECKED_LATENCIES = (
+    ("latency_ms", "p50"),
+    ("latency_ms", "p95"),
+    ("latency_ms", "p99"),
+    ("overhead_ms", "p50"),
+    ("overhead_ms", "p99"),
+)
+
+RequestFactory = Callable[[int], Tuple[str, Dict[str, Any]]]
+
+
+def _endpoints(audio_ms: int, text_chars: int) -> Dict[str, RequestFactory]:
+    audio = base64.b64encode(os.urandom(16000 * 2 * audio_ms // 1000)).decode()
+
+    def _chat(i: int) -> Tuple[str, Dict[str, Any]]:
+        return "/chat", {"messages": [{"role": "user", "content": f"第 {i} 个问题"}]}
+
+    def _stt(_: int) -> Tuple[str, Dict[str, Any]]:
+        return "/speech-to-text", {"audio_base64": audio, "format": "pcm", "sample_rate": 16000}
+
+    def _tts(i: int) -> Tuple[str, Dict[str, Any]]:
+        return "/text-to-speech", {"text": f"{i}" + "好" * text_chars, "format": "mp3"}
+
+    return {"chat": _chat, "stt": _stt, "tts": _tts}
+
+
+def server_timing(header: Optional[str]) -> Dict[str, float]:
+    """Durations from a ``Server-Timing`` header, by name."""
+
+    timings: Dict[str, float] = {}
+    for entry in (header or "").split(","):
+        name, *params = [part.strip() for part in entry.split(";")]
+        for param in params:
+            if param.startswith("dur="):
+                timings[name] = timings.get(name, 0.0) + float(param[4:])
+    return timings
+
+
+def percentiles(values: Sequence[float]) -> Dict[str, float]:
+    """Nearest-rank p50/p95/p99 plus mean and max, in ms."""
+
+    if not values:
+        return {"p50": 0.0, "p95": 0.0, "p99": 0.0, "mean": 0.0, "max": 0.0}
+    ordered = sorted(values)
+
+    def _rank(q: float) -> float:
+        return ordered[min(len(ordered) - 1, max(0, int(q * len(ordered) + 0.999999) - 1))]
+
+    return {
+        "p50": round(_rank(0.50), 2),
+        "p95": round(_rank(0.95), 2),
+        "p99": round(_rank(0.99), 2),
+        "mean": round(sum(ordered) / len(ordered), 2),
+        "max": round(ordered[-1], 2),
+    }
+
+
+async def drive(
+    client: httpx.AsyncClient, factory: RequestFactory, concurrency: int, requests: int
+) -> Dict[str, Any]:
+    """Send ``requests`` requests from ``concurrency`` closed-loop clients."""
+
+    issued = 0
+    latencies: List[float] = []
+    overheads: List[float] = []
+    app_overheads: List[float] = []
+    upstreams: List[float] = []
+    errors: Dict[str, int] = {}
+
+    async def _client() -> None:
+        nonlocal issued
+        while issued < requests:
+            path, body = factory(issued)
+            issued += 1
+            started = time.perf_counter()
+            try:
+                response = await client.post(path, json=body)
+                await response.aread()
+            except httpx.HTTPError as exc:
+                errors[type(exc).__name__] = errors.get(type(exc).__name__, 0) + 1
+                continue
+            elapsed = (time.perf_counter() - started) * 1000
+            if response.status_code != 200:
+                errors[str(response.status_code)] = errors.get(str(response.status_code), 0) + 1
+                continue
+            timings = server_timing(response.headers.get("server-timing"))
+            upstream = sum(timings.get(name, 0.0) for name in UPSTREAM_TIMINGS)
+            latencies.append(elapsed)
+            upstreams.append(upstream)
+            overheads.append(elapsed - upstream)
+            if "app" in timings:
+                app_overheads.append(timings["app"] - upstream)
+
+    started = time.perf_counter()
+    await asyncio.gather(*(_client() for _ in range(concurrency)))
+    elapsed = time.perf_counter() - started
+    return {
+        "requests": requests,
+        "ok": len(latencies),
+        "errors": errors,
+        "throughput_rps": round(len(latencies) / elapsed, 2) if elapsed else 0.0,
+        "latency_ms": percentiles(latencies),
+        "upstream_ms": percentiles(upstreams),
+        "overhead_ms": percentiles(overheads),
+        "app_overhead_ms": percentiles(app_overheads),
+    }
+
+
+def _api_env(dify: MockServer, bailian: MockServer) -> Dict[str, str]:
+    return {
+        **os.environ,
+        "DIFY_API_BASE": f"{dify.url}/v1/",
+        "DIFY_API_KEY": "bench",
+        "ALI_API_BASE": f"{bailian.url}/api/v1/",
+        "ALI_APP_KEY": "bench",
+        "ALI_ACCESS_TOKEN": "bench",
+        # Every request must reach the mocks.
+        "TTS_CACHE_MAX_BYTES": "0",
+        "TTS_DISK_CACHE_DIR": "",
+        "TRACE_EXPORT_PATH": "",
+    }
+
+
+def _start_api(env: Dict[str, str], port: int, *, logs: bool) -> subprocess.Popen:
+    command = [
+        sys.executable, "-m", "uvicorn", "backend.app.main:app",
+        "--host", "127.0.0.1", "--port", str(port), "--log-level", "warning",
+    ]
+    output = None if logs else subprocess.DEVNULL
+    return subprocess.Popen(command, env=env, stdout=output, stderr=output)
+
+
+async def _wait_ready(base_url: str, process: subprocess.Popen, timeout: float = 30.0) -> None:
+    deadline = time.monotonic() + timeout
+    async with httpx.AsyncClient(base_url=base_url) as client:
+        while time.monotonic() < deadline:
+            if process.poll() is not None:
+                raise RuntimeError(f"API exited with status {process.returncode}")
+            try:
+                if (await client.get("/health")).status_code == 200:
+                    return
+            except httpx.TransportError:
+                pass
+            await asyncio.sleep(0.1)
+    raise RuntimeError("API did not become ready")
+
+
+async def run_levels(
+    base_url: str,
+    endpoints: Dict[str, RequestFactory],
+    levels: Sequence[int],
+    requests: int,
+    warmup: int,
+) -> List[Dict[str, Any]]:
+    results = []
+    limits = httpx.Limits(max_connections=max(levels), max_keepalive_connections=max(levels))
+    async with httpx.AsyncClient(base_url=base_url, limits=limits, timeout=60.0) as client:
+        for name, factory in endpoints.items():
+            await drive(client, factory, min(warmup, max(levels)), warmup)
+            for concurrency in levels:
+                result = await drive(client, factory, concurrency, requests)
+                result = {"endpoint": name, "concurrency": concurrency, **result}
+                print(json.dumps(result, ensure_ascii=False), flush=True)
+                results.append(result)
+    return results
+
+
+def compare(
+    results: Sequence[Dict[str, Any]],
+    baseline: Sequence[Dict[str, Any]],
+    *,
+    tolerance: float,
+    min_delta_ms: float,
+) -> List[str]:
+    """Describe every metric that regressed against ``baseline``."""
+
+    previous = {(item["endpoint"], item["concurrency"]): item for item in baseline}
+    regressions = []
+    for item in results:
+        before = previous.get((item["endpoint"], item["concurrency"]))
+        if before is None:
+            continue
+        label = f"{item['endpoint']}@{item['concurrency']}"
+        for section, stat in CHECKED_LATENCIES:
+            old, new = before[section][stat], item[section][stat]
+            if new - old > min_delta_ms and new > old * (1 + tolerance):
+                regressions.append(f"{label} {section}.{stat}: {old} -> {new} ms")
+        old_rps, new_rps = before["throughput_rps"], item["throughput_rps"]
+        if new_rps < old_rps * (1 - tolerance):
+            regressions.append(f"{label} throughput: {old_rps} -> {new_rps} req/s")
+        old_failed = 1 - before["ok"] / before["requests"]
+        new_failed = 1 - item["ok"] / item["requests"]
+        if new_failed > old_failed + 0.01:
+            regressions.append(f"{label} failed requests: {old_failed:.1%} -> {new_failed:.1%}")
+    return regressions
+
+
+def _git_revision() -> Optional[str]:
+    try:
+        return subprocess.run(
+            ["git", "rev-parse", "--short", "HEAD"], capture_output=True, text=True, check=True
+        ).stdout.strip()
+    except (OSError, subprocess.CalledProcessError):
+        return None
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--concurrency", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--requests", type=int, default=200, help="Requests per endpoint and level")
+    parser.add_argument("--warmup", type=int, default=20)
+    parser.add_argument("--endpoints", nargs="+", default=["chat", "stt", "tts"])
+    parser.add_argument("--dify-latency", default="lognormal:300:0.4")
+    parser.add_argument("--stt-latency", default="lognormal:150:0.3")
+    parser.add_argument("--tts-latency", default="lognormal:200:0.3")
+    parser.add_argument("--dify-bytes", type=int, default=600, help="Size of the Dify answer")
+    parser.add_argument("--tts-bytes", type=int, default=32_000, help="Size of the TTS audio")
+    parser.add_argument("--audio-ms", type=int, default=3000, help="Length of the STT upload")
+    parser.add_argument("--text-chars", type=int, default=40, help="Length of the TTS text")
+    parser.add_argument("--error-rate", type=float, default=0.0, help="Injected upstream error rate")
+    parser.add_argument("--seed", type=int, default=0)
+    parser.add_argument("--api-logs", action="store_true", help="Show the API's log output")
+    parser.add_argument("--output", help="Write results as JSON to this file")
+    parser.add_argument("--baseline", help="Earlier --output file to compare against")
+    parser.add_argument("--tolerance", type=float, default=0.2, help="Allowed relative slowdown")
+    parser.add_argument("--min-delta-ms", type=float, default=2.0, help="Ignore smaller slowdowns")
+    args = parser.parse_args()
+
+    dify = MockProfile(LatencyDistribution.parse(args.dify_latency), args.dify_bytes, args.error_rate)
+    stt = MockProfile(LatencyDistribution.parse(args.stt_latency), 60, args.error_rate)
+    tts = MockProfile(LatencyDistribution.parse(args.tts_latency), args.tts_bytes, args.error_rate)
+    dify_app = create_mock_app({DIFY_CHAT: dify}, seed=args.seed)
+    bailian_app = create_mock_app({BAILIAN_STT: stt, BAILIAN_TTS: tts}, seed=args.seed + 1)
+    all_endpoints = _endpoints(args.audio_ms, args.text_chars)
+    endpoints = {name: all_endpoints[name] for name in args.endpoints}
+
+    with MockServer(dify_app) as dify_server, MockServer(bailian_app) as bailian_server:
+        port = free_port()
+        api = _start_api(_api_env(dify_server, bailian_server), port, logs=args.api_logs)
+        base_url = f"http://127.0.0.1:{port}"
+        try:
+            asyncio.run(_wait_ready(base_url, api))
+            results = asyncio.run(
+                run_levels(base_url, endpoints, args.concurrency, args.requests, args.warmup)
+            )
+        finally:
+            api.terminate()
+            api.wait(timeout=10)
+
+    report = {
+        "meta": {
+            "timestamp": time.strftime("%Y-%m-%dT%H:%M:%S%z"),
+            "revision": _git_revision(),
+            "python": platform.python_version(),
+            "platform": platform.platform(),
+            "cpus": os.cpu_count(),
+            "requests": args.requests,
+            "mocks": {"dify": dify.describe(), "stt": stt.describe(), "tts": tts.describe()},
+        },
+        "results": results,
+    }
+    if args.output:
+        with open(args.output, "w", encoding="utf-8") as handle:
+            json.dump(report, handle, ensure_ascii=False, indent=2)
+
+    if args.baseline:
+        with open(args.baseline, encoding="utf-8") as handle:
+            baseline = json.load(handle)["results"]
+        levels = {(item["endpoint"], item["concurrency"]) for item in baseline}
+        if not any((item["endpoint"], item["concurrency"]) in levels for item in results):
+            print(f"No endpoint/concurrency level in common with {args.baseline}", file=sys.stderr)
+            sys.exit(2)
+        regressions = compare(
+            results, baseline, tolerance=args.tolerance, min_delta_ms=args.min_delta_ms
+        )
+        for line in regressions:
+            print(f"REGRESSION {line}", file=sys.stderr)
+        if regressions:
+            sys.exit(1)
+        print(f"No regressions against {args.baseline}", file=sys.stderr)
+
+
+if __name__ == "__main__":
+    main()
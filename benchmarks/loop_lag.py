@@ -0,0 +1,109 @@
+"""Event-loop lag of the agent's audio intake under concurrent rooms.
+
+Every simulated room pushes 48 kHz stereo frames in real time through a
+:class:`ParticipantListener` (resampling + VAD), as the agent does for each
+subscribed microphone.  A :class:`LoopLagMonitor` measures how late the shared
+event loop wakes up, once per audio executor.  Run from the repository root::
+
+    python -m benchmarks.loop_lag --rooms 1 8 32 --seconds 5
+"""
+from __future__ import annotations
+
+import argparse
+import asyncio
+import json
+import time
+
+import numpy as np
+
+from backend.app.config import Settings
+from backend.app.services.audio_executor import create_audio_executor
+from backend.app.services.endpointing import create_endpoint_detector
+from backend.app.services.listener import ParticipantListener
+from backend.app.services.loop_lag import LoopLagMonitor
+
+RATE, CHANNELS = 48000, 2
+
+
+def _speech_like(seconds: float) -> np.ndarray:
+    """Alternating 1 s tone bursts and quiet noise, interleaved stereo."""
+
+    rng = np.random.default_rng(0)
+    t = np.arange(int(RATE * seconds)) / RATE
+    gate = (t % 2.0) < 1.0
+    mono = np.where(gate, 6000 * np.sin(2 * np.pi * 220 * t), 0) + rng.normal(0, 40, t.size)
+    return np.repeat(mono.astype(np.int16), CHANNELS)
+
+
+async def _room(index: int, settings: Settings, executor, audio: np.ndarray, frame_ms: int) -> int:
+    async def _nothing(*_: object) -> None:
+        return None
+
+    async def _no_transcript(_: object) -> str:
+        return ""
+
+    listener = ParticipantListener(
+        settings,
+        f"room-{index}",
+        endpointer=create_endpoint_detector(settings),
+        on_speech_start=_nothing,
+        on_turn=_nothing,
+        transcribe=_no_transcript,
+        executor=executor,
+    )
+    step = RATE * frame_ms // 1000 * CHANNELS
+    # Stagger rooms so their frames do not all arrive in the same tick.
+    await asyncio.sleep(index * frame_ms / 1000 / 7)
+    deadline = time.perf_counter()
+    frames = 0
+    for offset in range(0, audio.size - step + 1, step):
+        await listener.push(audio[offset : offset + step].tobytes(), RATE, CHANNELS)
+        frames += 1
+        deadline += frame_ms / 1000
+        await asyncio.sleep(max(0.0, deadline - time.perf_counter()))
+    await listener.flush()
+    return frames
+
+
+async def measure(kind: str, rooms: int, seconds: float, frame_ms: int, workers: int) -> dict:
+    settings = Settings(agent_dsp_executor=kind, agent_dsp_workers=workers)
+    executor = create_audio_executor(settings)
+    audio = _speech_like(seconds)
+    monitor = LoopLagMonitor(interval=0.005, window=100_000)
+    try:
+        await executor.run(len, audio[:CHANNELS])  # start pool workers up front
+        monitor.start()
+        started = time.perf_counter()
+        frames = await asyncio.gather(
+            *(_room(i, settings, executor, audio, frame_ms) for i in range(rooms))
+        )
+        elapsed = time.perf_counter() - started
+    finally:
+        await monitor.stop()
+        executor.shutdown()
+    return {
+        "executor": kind,
+        "rooms": rooms,
+        "frame_ms": frame_ms,
+        "frames": sum(frames),
+        "slowdown": round(elapsed / seconds, 3),
+        "loop_lag": monitor.stats(),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--rooms", type=int, nargs="+", default=[1, 8, 32])
+    parser.add_argument("--executors", nargs="+", default=["inline", "thread", "process"])
+    parser.add_argument("--seconds", type=float, default=5.0)
+    parser.add_argument("--frame-ms", type=int, default=10)
+    parser.add_argument("--workers", type=int, default=2)
+    args = parser.parse_args()
+    for rooms in args.rooms:
+        for kind in args.executors:
+            result = asyncio.run(measure(kind, rooms, args.seconds, args.frame_ms, args.workers))
+            print(json.dumps(result))
+
+
+if __name__ == "__main__":
+    main()
@@ -0,0 +1,200 @@
+"""Local stand-ins for Dify and the Bailian speech APIs.
+
+Each mock answers the endpoints the API calls (``chat-messages`` in blocking
+mode, ``speech_to_text`` and ``text_to_speech``) after a delay drawn from a
+configurable distribution, with a configurable payload size and error rate::
+
+    const:50            always 50 ms
+    uniform:20:80       uniformly between 20 and 80 ms
+    lognormal:80:0.5    median 80 ms, sigma 0.5 (long right tail)
+
+Mocks are plain ASGI apps served by uvicorn on a background thread, so their
+sleeps do not share an event loop with the load generator.
+"""
+from __future__ import annotations
+
+import asyncio
+import base64
+import json
+import math
+import random
+import socket
+import threading
+import time
+import uuid
+from dataclasses import dataclass
+from typing import Any, Awaitable, Callable, Dict, Optional, Tuple
+
+import uvicorn
+
+Handler = Callable[["MockProfile", random.Random, Dict[str, Any]], Dict[str, Any]]
+
+
+@dataclass(frozen=True)
+class LatencyDistribution:
+    """Injected latency in milliseconds, parsed from ``kind:arg[:arg]``."""
+
+    kind: str
+    params: Tuple[float, ...]
+
+    @classmethod
+    def parse(cls, spec: str) -> "LatencyDistribution":
+        kind, *raw = spec.split(":")
+        params = tuple(float(value) for value in raw)
+        expected = {"const": 1, "uniform": 2, "lognormal": 2}
+        if expected.get(kind) != len(params):
+            raise ValueError(
+                f"Bad latency spec {spec!r}; use const:MS, uniform:LO:HI or lognormal:MEDIAN:SIGMA"
+            )
+        return cls(kind, params)
+
+    def sample(self, rng: random.Random) -> float:
+        if self.kind == "const":
+            return self.params[0]
+        if self.kind == "uniform":
+            return rng.uniform(*self.params)
+        median, sigma = self.params
+        return rng.lognormvariate(math.log(median), sigma)
+
+    def __str__(self) -> str:
+        return ":".join([self.kind, *(f"{value:g}" for value in self.params)])
+
+
+@dataclass
+class MockProfile:
+    """Behaviour of one mocked service."""
+
+    latency: LatencyDistribution
+    payload_bytes: int = 256
+    error_rate: float = 0.0
+    requests: int = 0
+    errors: int = 0
+    injected_ms: float = 0.0
+
+    def describe(self) -> Dict[str, Any]:
+        return {
+            "latency": str(self.latency),
+            "payload_bytes": self.payload_bytes,
+            "error_rate": self.error_rate,
+        }
+
+
+def _dify_reply(profile: MockProfile, rng: random.Random, request: Dict[str, Any]) -> Dict[str, Any]:
+    return {
+        "answer": "好" * max(1, profile.payload_bytes // 3),  # 3 UTF-8 bytes each
+        "conversation_id": request.get("conversation_id") or str(uuid.uuid4()),
+        "message_id": str(uuid.uuid4()),
+        "task_id": str(uuid.uuid4()),
+    }
+
+
+def _stt_reply(profile: MockProfile, rng: random.Random, request: Dict[str, Any]) -> Dict[str, Any]:
+    return {"output": {"text": "测" * max(1, profile.payload_bytes // 3)}}
+
+
+def _tts_reply(profile: MockProfile, rng: random.Random, request: Dict[str, Any]) -> Dict[str, Any]:
+    audio = rng.randbytes(profile.payload_bytes)
+    return {"output": {"audio": {"data": base64.b64encode(audio).decode()}}}
+
+
+DIFY_CHAT = "/v1/chat-messages"
+BAILIAN_STT = "/api/v1/services/audio/dashscope/speech_to_text"
+BAILIAN_TTS = "/api/v1/services/audio/dashscope/text_to_speech"
+
+HANDLERS: Dict[str, Handler] = {
+    DIFY_CHAT: _dify_reply,
+    BAILIAN_STT: _stt_reply,
+    BAILIAN_TTS: _tts_reply,
+}
+
+
+def create_mock_app(
+    profiles: Dict[str, MockProfile], *, seed: int = 0
+) -> Callable[..., Awaitable[None]]:
+    """ASGI app answering each path in ``profiles`` with that profile."""
+
+    rng = random.Random(seed)
+
+    async def _respond(send: Callable[..., Awaitable[None]], status: int, body: Dict[str, Any]) -> None:
+        payload = json.dumps(body, ensure_ascii=False).encode()
+        headers = [
+            (b"content-type", b"application/json"),
+            (b"content-length", str(len(payload)).encode()),
+        ]
+        await send({"type": "http.response.start", "status": status, "headers": headers})
+        await send({"type": "http.response.body", "body": payload})
+
+    async def app(scope: Dict[str, Any], receive: Callable[..., Awaitable[Any]], send: Any) -> None:
+        chunks = []
+        while True:
+            message = await receive()
+            chunks.append(message.get("body", b""))
+            if not message.get("more_body"):
+                break
+        profile = profiles.get(scope["path"])
+        if profile is None:
+            await _respond(send, 404, {"message": f"No mock for {scope['path']}"})
+            return
+
+        delay = profile.latency.sample(rng)
+        profile.requests += 1
+        profile.injected_ms += delay
+        await asyncio.sleep(delay / 1000)
+        if rng.random() < profile.error_rate:
+            profile.errors += 1
+            await _respond(send, 500, {"message": "injected error"})
+            return
+        try:
+            request = json.loads(b"".join(chunks) or b"{}")
+        except ValueError:
+            request = {}
+        await _respond(send, 200, HANDLERS[scope["path"]](profile, rng, request))
+
+    return app
+
+
+def free_port() -> int:
+    with socket.socket() as sock:
+        sock.bind(("127.0.0.1", 0))
+        return sock.getsockname()[1]
+
+
+class MockServer:
+    """Serve an ASGI app on ``127.0.0.1`` from a daemon thread."""
+
+    def __init__(self, app: Callable[..., Awaitable[None]], port: Optional[int] = None) -> None:
+        self.port = port or free_port()
+        config = uvicorn.Config(
+            app, host="127.0.0.1", port=self.port, log_level="warning", lifespan="off"
+        )
+        self._server = uvicorn.Server(config)
+        self._thread = threading.Thread(target=self._server.run, name=f"mock-{self.port}", daemon=True)
+
+    @property
+    def url(self) -> str:
+        return f"http://127.0.0.1:{self.port}"
+
+    def __enter__(self) -> "MockServer":
+        self._thread.start()
+        deadline = time.monotonic() + 10
+        while not self._server.started:
+            if time.monotonic() > deadline or not self._thread.is_alive():
+                raise RuntimeError(f"Mock server on port {self.port} did not start")
+            time.sleep(0.01)
+        return self
+
+    def __exit__(self, *exc_info: Any) -> None:
+        self._server.should_exit = True
+        self._thread.join(timeout=5)
+
+
+__all__ = [
+    "BAILIAN_STT",
+    "BAILIAN_TTS",
+    "DIFY_CHAT",
+    "LatencyDistribution",
+    "MockProfile",
+    "MockServer",
+    "create_mock_app",
+    "free_port",
+]
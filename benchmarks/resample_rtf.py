@@ -0,0 +1,56 @@
+"""Throughput of the 16 kHz mono conversion stage, in real-time factor.
+
+RTF is processing time divided by audio duration on a single core: 0.01 means
+one core converts 100 seconds of audio per second.  Run from the repository
+root::
+
+    python -m benchmarks.resample_rtf --seconds 30 --frame-ms 10
+"""
+from __future__ import annotations
+
+import argparse
+import json
+import time
+
+import numpy as np
+
+from backend.app.services.audio_dsp import PolyphaseResampler
+
+CASES = [(48000, 2), (48000, 1), (44100, 1), (24000, 1), (16000, 2)]
+
+
+def measure(rate: int, channels: int, seconds: float, frame_ms: int, repeats: int) -> dict:
+    rng = np.random.default_rng(0)
+    audio = rng.integers(-8000, 8000, int(rate * seconds) * channels, dtype=np.int16)
+    step = rate * frame_ms // 1000 * channels
+    best = float("inf")
+    for _ in range(repeats):
+        resampler = PolyphaseResampler(rate, channels=channels)
+        started = time.perf_counter()
+        if frame_ms:
+            for offset in range(0, audio.size, step):
+                resampler.process(audio[offset : offset + step])
+        else:
+            resampler.process(audio)
+        best = min(best, time.perf_counter() - started)
+    return {
+        "input": f"{rate}Hz x{channels}",
+        "frame_ms": frame_ms or "whole",
+        "rtf_per_core": round(best / seconds, 5),
+        "x_realtime": round(seconds / best, 1),
+        "bytes_ratio": round((rate * channels) / 16000, 2),
+    }
+
+
+def main() -> None:
+    parser = argparse.ArgumentParser(description=__doc__.splitlines()[0])
+    parser.add_argument("--seconds", type=float, default=30.0)
+    parser.add_argument("--frame-ms", type=int, default=10, help="0 converts the clip in one call")
+    parser.add_argument("--repeats", type=int, default=3)
+    args = parser.parse_args()
+    for rate, channels in CASES:
+        print(json.dumps(measure(rate, channels, args.seconds, args.frame_ms, args.repeats)))
+
+
+if __name__ == "__main__":
+    main()
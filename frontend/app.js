@@ -6,6 +6,8 @@ const dom = {
   connectionState: document.getElementById('connection-state'),
   assistantState: document.getElementById('assistant-state'),
   ambientLevel: document.getElementById('ambient-level'),
+  serverTiming: document.getElementById('server-timing'),
+  traceId: document.getElementById('trace-id'),
   conversationLog: document.getElementById('conversation-log'),
   messageTemplate: document.getElementById('message-template'),
   manualInput: document.getElementById('manual-input'),
@@ -18,6 +20,12 @@ const dom = {
 dom.identity.value += Math.floor(Math.random() * 10000);
 
 const conversationHistory = [];
+// Dify conversation of this page, echoed back with every turn so the server
+// only forwards the newest message to Dify.  The full history still goes to
+// the server so it can rebuild the context if Dify has dropped the
+// conversation.
+let conversationId = null;
+const chatSessionId = crypto.randomUUID ? crypto.randomUUID() : `${Date.now()}-${Math.random()}`;
 let thinkingTimer = null;
 let currentRoom = null;
 let localStream = null;
@@ -28,9 +36,11 @@ function appendMessage(role, text) {
   const root = node.querySelector('.message');
   root.classList.add(role);
   root.querySelector('.meta').textContent = `${role === 'user' ? '🧑 用户' : '🤖 助手'} · ${new Date().toLocaleTimeString()}`;
-  root.querySelector('.content').textContent = text;
+  const content = root.querySelector('.content');
+  content.textContent = text;
   dom.conversationLog.appendChild(node);
   dom.conversationLog.scrollTop = dom.conversationLog.scrollHeight;
+  return content;
 }
 
 function setAssistantState(stateText) {
@@ -59,6 +69,45 @@ function startThinkingTimer() {
   }, 3000);
 }
 
+// Server-Timing entries of the API calls (dify, stt, tts, queue, app, …),
+// read from the Resource Timing API so <audio> requests are covered too.
+// /chat/stream sends its header before Dify answers, so its breakdown comes
+// from the `server_timing` field of the SSE `done` event instead.
+const TIMED_PATHS = ['/chat', '/speech-to-text', '/text-to-speech', '/livekit/token'];
+const STREAMED_TIMING_PATHS = ['/chat/stream'];
+
+function formatServerTiming(entries) {
+  return entries
+    .map((entry) => {
+      const duration = entry.duration ? ` ${Math.round(entry.duration)} ms` : '';
+      const description = entry.description ? `（${entry.description}）` : '';
+      return `${entry.name}${duration}${description}`;
+    })
+    .join(' · ');
+}
+
+function showServerTiming(pathname, entries) {
+  dom.serverTiming.textContent = `${pathname}：${formatServerTiming(entries)}`;
+}
+
+function watchServerTiming() {
+  if (!window.PerformanceObserver) return;
+  const observer = new PerformanceObserver((list) => {
+    for (const entry of list.getEntries()) {
+      if (!entry.serverTiming || !entry.serverTiming.length) continue;
+      const { pathname } = new URL(entry.name);
+      if (!TIMED_PATHS.some((path) => pathname.startsWith(path))) continue;
+      if (STREAMED_TIMING_PATHS.includes(pathname)) continue;
+      showServerTiming(pathname, entry.serverTiming);
+    }
+  });
+  try {
+    observer.observe({ type: 'resource', buffered: true });
+  } catch (error) {
+    // Older browsers without resource timing support keep the placeholder.
+  }
+}
+
 async function updateAmbientMonitor(stream) {
   if (!stream) return;
   if (analyserInterval) clearInterval(analyserInterval);
@@ -84,10 +133,30 @@ async function updateAmbientMonitor(stream) {
   }, 500);
 }
 
-async function fetchJson(url, options = {}) {
+// W3C trace context: one trace id per user action and a fresh parent span id
+// per request, so the backend's spans for that action share one trace.
+function randomHex(bytes) {
+  const values = crypto.getRandomValues(new Uint8Array(bytes));
+  return Array.from(values, (value) => value.toString(16).padStart(2, '0')).join('');
+}
+
+function newTraceId() {
+  return randomHex(16);
+}
+
+function traceparent(traceId) {
+  return `00-${traceId}-${randomHex(8)}-01`;
+}
+
+// Every request of one user action carries the same trace id.
+async function fetchJson(url, options = {}, traceId = newTraceId()) {
   const response = await fetch(url, {
-    headers: { 'Content-Type': 'application/json', ...(options.headers || {}) },
     ...options,
+    headers: {
+      'Content-Type': 'application/json',
+      traceparent: traceparent(traceId),
+      ...(options.headers || {}),
+    },
   });
   if (!response.ok) {
     const detail = await response.json().catch(() => ({}));
@@ -96,6 +165,113 @@ async function fetchJson(url, options = {}) {
   return response.json();
 }
 
+async function streamChat(messages, onDelta, traceId = newTraceId()) {
+  const response = await fetch('/chat/stream', {
+    method: 'POST',
+    headers: {
+      'Content-Type': 'application/json',
+      Accept: 'text/event-stream',
+      traceparent: traceparent(traceId),
+    },
+    body: JSON.stringify({
+      messages,
+      conversation_id: conversationId || undefined,
+      session_id: chatSessionId,
+      user: dom.identity.value.trim() || undefined,
+    }),
+  });
+  if (!response.ok || !response.body) {
+    const detail = await response.json().catch(() => ({}));
+    throw new Error(detail.detail || `请求失败: ${response.status}`);
+  }
+
+  const reader = response.body.pipeThrough(new TextDecoderStream()).getReader();
+  let buffer = '';
+  let done = null;
+  for (;;) {
+    const { value, done: finished } = await reader.read();
+    if (finished) break;
+    buffer += value;
+    let boundary = buffer.indexOf('\n\n');
+    while (boundary !== -1) {
+      const frame = buffer.slice(0, boundary);
+      buffer = buffer.slice(boundary + 2);
+      boundary = buffer.indexOf('\n\n');
+
+      let event = 'message';
+      const data = [];
+      for (const line of frame.split('\n')) {
+        if (line.startsWith('event:')) event = line.slice(6).trim();
+        else if (line.startsWith('data:')) data.push(line.slice(5).trimStart());
+      }
+      if (!data.length) continue;
+      const payload = JSON.parse(data.join('\n'));
+      if (event === 'delta') onDelta(payload.text);
+      else if (event === 'done') done = payload;
+      else if (event === 'error') throw new Error(payload.detail || 'Dify 流式响应出错');
+    }
+  }
+  if (!done) throw new Error('Dify 流式响应意外中断');
+  if (done.conversation_id) conversationId = done.conversation_id;
+  if (done.server_timing) {
+    const entries = Object.entries(done.server_timing).map(([name, duration]) => ({ name, duration }));
+    showServerTiming('/chat/stream', entries);
+  }
+  return done;
+}
+
+const MAX_TTS_URL_LENGTH = 2000;
+
+async function playStreamedSpeech(text, traceId = newTraceId()) {
+  // The <audio> element cannot send headers, so its request carries the
+  // turn's trace as a query parameter.
+  const params = new URLSearchParams({ text, format: 'mp3', traceparent: traceparent(traceId) });
+  const url = `/text-to-speech/stream?${params}`;
+  dom.audio.srcObject = null;
+
+  // Short replies: let the <audio> element fetch the chunked stream itself so
+  // playback starts as soon as the first bytes arrive.
+  if (url.length <= MAX_TTS_URL_LENGTH) {
+    dom.audio.src = url;
+    await dom.audio.play().catch(() => {});
+    return;
+  }
+
+  const response = await fetch('/text-to-speech/stream', {
+    method: 'POST',
+    headers: { 'Content-Type': 'application/json', traceparent: traceparent(traceId) },
+    body: JSON.stringify({ text, format: 'mp3' }),
+  });
+  if (!response.ok || !response.body) {
+    const detail = await response.json().catch(() => ({}));
+    throw new Error(detail.detail || `语音合成失败: ${response.status}`);
+  }
+
+  if (!window.MediaSource || !MediaSource.isTypeSupported('audio/mpeg')) {
+    dom.audio.src = URL.createObjectURL(await response.blob());
+    await dom.audio.play().catch(() => {});
+    return;
+  }
+
+  const mediaSource = new MediaSource();
+  dom.audio.src = URL.createObjectURL(mediaSource);
+  await new Promise((resolve) => mediaSource.addEventListener('sourceopen', resolve, { once: true }));
+  const sourceBuffer = mediaSource.addSourceBuffer('audio/mpeg');
+  const reader = response.body.getReader();
+  let started = false;
+  for (;;) {
+    const { value, done } = await reader.read();
+    if (done) break;
+    sourceBuffer.appendBuffer(value);
+    await new Promise((resolve) => sourceBuffer.addEventListener('updateend', resolve, { once: true }));
+    if (!started) {
+      started = true;
+      dom.audio.play().catch(() => {});
+    }
+  }
+  mediaSource.endOfStream();
+}
+
 async function connectLiveKit() {
   if (currentRoom) return;
   const identity = dom.identity.value.trim();
@@ -107,11 +283,12 @@ async function connectLiveKit() {
 
   try {
     setConnectionState('获取令牌…');
+    const traceId = newTraceId();
     const tokenData = await fetchJson('/livekit/token', {
       method: 'POST',
       body: JSON.stringify({ identity, room: roomName }),
-    });
-    const health = await fetchJson('/health');
+    }, traceId);
+    const health = await fetchJson('/health', {}, traceId);
 
     const room = new LiveKit.Room();
     currentRoom = room;
@@ -203,22 +380,30 @@ async function sendManualText() {
   dom.manualInput.value = '';
   setAssistantState('正在调用 Dify');
   startThinkingTimer();
+  // Shown next to the timings so a slow turn can be looked up in the span export.
+  const traceId = newTraceId();
+  dom.traceId.textContent = traceId;
 
   try {
-    const chatResp = await fetchJson('/chat', {
-      method: 'POST',
-      body: JSON.stringify({ messages: conversationHistory }),
-    });
+    let replyNode = null;
+    const chatResp = await streamChat(conversationHistory, (delta) => {
+      if (!replyNode) {
+        resetThinkingTimer();
+        setAssistantState('助手正在回复…');
+        replyNode = appendMessage('assistant', '');
+      }
+      replyNode.textContent += delta;
+      dom.conversationLog.scrollTop = dom.conversationLog.scrollHeight;
+    }, traceId);
     resetThinkingTimer();
-    setAssistantState(`响应完成（耗时 ${chatResp.latency_ms} ms）`);
+    const queued = chatResp.queue_ms ? `，排队 ${chatResp.queue_ms} ms` : '';
+    setAssistantState(
+      `响应完成（首字 ${chatResp.ttft_ms} ms，总耗时 ${chatResp.latency_ms} ms${queued}）`,
+    );
     conversationHistory.push({ role: 'assistant', content: chatResp.reply });
-    appendMessage('assistant', chatResp.reply);
+    if (!replyNode) appendMessage('assistant', chatResp.reply);
 
-    const ttsResp = await fetchJson('/text-to-speech', {
-      method: 'POST',
-      body: JSON.stringify({ text: chatResp.reply, format: 'mp3' }),
-    });
-    dom.audio.src = `data:audio/mp3;base64,${ttsResp.audio_base64}`;
+    await playStreamedSpeech(chatResp.reply, traceId);
   } catch (error) {
     resetThinkingTimer();
     setAssistantState('出错了');
@@ -227,6 +412,7 @@ async function sendManualText() {
 }
 
 async function init() {
+  watchServerTiming();
   dom.connectBtn.addEventListener('click', connectLiveKit);
   dom.disconnectBtn.addEventListener('click', disconnectLiveKit);
   dom.manualSend.addEventListener('click', sendManualText);